@@ -0,0 +1,265 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Cache configuration
+ANALYSIS_CACHE_SIZE = int(os.environ.get("ANALYSIS_CACHE_SIZE", "256"))
+# Disk tier shared by the worker processes of one host: without it /chat finds
+# a document_id's passage index only on the worker that analyzed it. Set it
+# to a volume to keep it across restarts; an empty value disables it
+ANALYSIS_CACHE_DIR = os.environ.get("ANALYSIS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "legalklarity-cache"))
+ANALYSIS_CACHE_DISK_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_DISK_ENTRIES", "4096"))
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_stream(file_stream):
+    """
+    SHA-256 of a file-like object, read in blocks
+
+    The stream is rewound before and after hashing so extractors can
+    read it again.
+
+    Returns:
+        str: Hex digest of the stream contents
+    """
+    digest = hashlib.sha256()
+    file_stream.seek(0)
+    for block in iter(lambda: file_stream.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    file_stream.seek(0)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash, document_type=None, version=""):
+    """
+    Build a cache key from the upload hash and everything that changes the analysis
+
+    Args:
+        content_hash (str): SHA-256 of the raw upload bytes
+        document_type (str, optional): Requested document type (None means auto-detect)
+        version (str): Model and prompt version the analysis was produced with
+
+    Returns:
+        str: Hex digest usable as a file name
+    """
+    raw = "\x1f".join([content_hash, document_type or "auto", version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of analysis results
+
+    The memory tier is a bounded LRU private to the worker process; it
+    stores and returns copies, so callers can modify what they get. The
+    optional disk tier stores one JSON file per key under ``directory`` so
+    every gunicorn worker sharing the directory sees the same entries.
+    Writes go through a temp file and ``os.replace`` so readers never see
+    a partial entry. The directory is listed once, then each worker counts
+    its own new files and prunes the oldest only once the count passes
+    max_disk_entries by a tenth, so pruning is not a directory scan per
+    write (with several workers it can overshoot by a tenth per worker).
+    """
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_SIZE, directory=ANALYSIS_CACHE_DIR,
+                 max_disk_entries=ANALYSIS_CACHE_DISK_ENTRIES):
+        self.max_entries = max(0, max_entries)
+        self.directory = directory or None
+        self.max_disk_entries = max(0, max_disk_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Files on disk as of the last listing plus the ones written since (None: not listed yet)
+        self._disk_count = None
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+            "disk_errors": 0
+        }
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"Analysis cache directory unavailable, disk tier disabled: {e}")
+                self.directory = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _remember(self, key, value):
+        if not self.max_entries:
+            return
+        evicted = 0
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self._stats["evictions"] += evicted
+
+    def get(self, key):
+        """
+        Look up a cached value, promoting disk hits into memory
+
+        Returns:
+            dict or None: Cached value, or None on a miss
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["memory_hits"] += 1
+                return copy.deepcopy(value)
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+            except FileNotFoundError:
+                value = None
+            except (OSError, ValueError) as e:
+                print(f"Analysis cache read error: {e}")
+                self._count("disk_errors")
+                value = None
+            if value is not None:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                self._remember(key, copy.deepcopy(value))
+                with self._lock:
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        """
+        Store a JSON-serializable value in both tiers
+        """
+        if self.max_entries:
+            self._remember(key, copy.deepcopy(value))
+        self._count("stores")
+        if self.directory:
+            self._write_disk(key, value)
+
+    def _write_disk(self, key, value):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            new_file = not os.path.exists(path)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Analysis cache write error: {e}")
+            self._count("disk_errors")
+            return
+        if not self.max_disk_entries:
+            return
+        with self._lock:
+            if self._disk_count is not None:
+                self._disk_count += new_file
+            count = self._disk_count
+        if count is None or count > self.max_disk_entries + max(1, self.max_disk_entries // 10):
+            self._prune_disk()
+
+    def _disk_files(self):
+        # Only this cache's two-character shard directories: other caches
+        # (passages/, chunks/) live in subdirectories of the same directory
+        files = []
+        try:
+            shards = [name for name in os.listdir(self.directory) if len(name) == 2]
+        except OSError:
+            return files
+        for shard in shards:
+            shard_dir = os.path.join(self.directory, shard)
+            try:
+                names = os.listdir(shard_dir)
+            except OSError:
+                # Not a directory, or removed meanwhile
+                continue
+            files.extend(os.path.join(shard_dir, name) for name in names if name.endswith(".json"))
+        return files
+
+    def _prune_disk(self):
+        files = self._disk_files()
+        overflow = len(files) - self.max_disk_entries
+        with self._lock:
+            self._disk_count = len(files) - max(0, overflow)
+        if overflow <= 0:
+            return
+
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+
+        removed = 0
+        for path in sorted(files, key=mtime)[:overflow]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Another worker pruned it first
+                pass
+        self._count("disk_evictions", removed)
+
+    def clear(self):
+        """
+        Drop every entry in both tiers (counters are kept)
+        """
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            for path in self._disk_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._disk_count = None
+
+    def stats(self):
+        """
+        Snapshot of cache counters for sizing
+
+        Returns:
+            dict: Hit/miss/eviction counters plus current sizes
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["disk_enabled"] = bool(self.directory)
+        if self.directory:
+            stats["disk_entries"] = len(self._disk_files())
+            stats["max_disk_entries"] = self.max_disk_entries
+        return stats
@@ -1,50 +1,130 @@
+import hashlib
+import importlib
 import io
 import re
-import pdfplumber
-import docx
-import pytesseract
-import fitz
-from PIL import Image
-from flask import Flask, request, jsonify, send_file
-from reportlab.platypus import SimpleDocTemplate, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 import json
+import queue
+import threading
 import os
 from datetime import datetime
-import textwrap
-
-# Try to import Vertex AI components
-try:
-    import google.cloud.aiplatform as aiplatform
-    from vertexai.generative_models import GenerativeModel, Part
-    VERTEX_AI_AVAILABLE = True
-except ImportError:
-    VERTEX_AI_AVAILABLE = False
-    print("Vertex AI not available - using fallback analysis")
-except Exception as e:
-    VERTEX_AI_AVAILABLE = False
-    print(f"Vertex AI initialization failed: {e}")
+from functools import lru_cache
+from importlib.util import find_spec
+from analysis_cache import ANALYSIS_CACHE_DIR, AnalysisCache, hash_stream, make_cache_key
+from batch import (BATCH_MAX_FILES, BATCH_MAX_UPLOAD_BYTES, BatchError, batch_model_slots, group_duplicates,
+                   open_zip_members, run_concurrently)
+from exports import ExportError, render_docx, render_pdf
+from jobs import DONE, FAILED, JOB_DIR, JobRunner, new_job
+from json_stream import ObjectMemberParser
+from keyword_matcher import KeywordMatcher
+from mapreduce import map_chunks, merge_analyses, pack_sections, split_sections
+from metrics import SERVER_TIMING, label, render_metrics, stage, trace
+from model_backends import MODEL_BACKEND, chunk_text_or_empty, create_model
+from model_clients import ModelRegistry, init_vertex
+from model_scheduler import ModelScheduler
+from ooxml import iter_docx_text
+from ocr_preprocess import ocr_image, open_upload_image
+from page_extraction import extract_hybrid, extract_ocr, extraction_progress, materialize_stream, pdf_page_count
+from passage_index import PassageIndex
+from revisions import REVISION_ANALYSIS, RevisionIndex, diff_clauses
+from rule_extractor import amounts_as_terms, clause_outline, extract_facts
+from templates import TEMPLATE_MATCHING, TemplateIndex
+from uploads import ENDPOINT_UPLOAD_LIMITS, MAX_UPLOAD_BYTES, SpoolingRequest
 
 # Flask app
 app = Flask(__name__)
+app.request_class = SpoolingRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 
-# Google Cloud configuration
-GOOGLE_CLOUD_PROJECT = os.environ.get("GOOGLE_CLOUD_PROJECT", "your-google-cloud-project-id")
-GOOGLE_CLOUD_LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
+# Model configuration (bump PROMPT_VERSION whenever the analysis prompt changes
+# so cached results produced by the old prompt are not served)
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash-001")
+PROMPT_VERSION = "2"
 
-# Initialize Vertex AI
-if VERTEX_AI_AVAILABLE:
-    try:
-        aiplatform.init(
-            project=GOOGLE_CLOUD_PROJECT,
-            location=GOOGLE_CLOUD_LOCATION
-        )
-        print("Vertex AI initialized successfully")
-    except Exception as e:
-        VERTEX_AI_AVAILABLE = False
-        print(f"Vertex AI initialization failed: {e}")
-else:
-    print("Vertex AI not available")
+# Long documents: "auto" switches to map-reduce above MAP_REDUCE_THRESHOLD_CHARS,
+# "single" always sends one prompt (truncated), "mapreduce" always chunks
+ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "auto")
+MAP_REDUCE_THRESHOLD_CHARS = int(os.environ.get("MAP_REDUCE_THRESHOLD_CHARS", "30000"))
+MAP_CHUNK_WORDS = int(os.environ.get("MAP_CHUNK_WORDS", "1500"))
+MAP_MAX_CHUNKS = int(os.environ.get("MAP_MAX_CHUNKS", "40"))
+MAP_CONCURRENCY = int(os.environ.get("MAP_CONCURRENCY", "4"))
+# Revisions of shorter documents are analyzed in chunks of this many words, so the
+# next version only sends the chunks it changed to the model
+REVISION_CHUNK_WORDS = int(os.environ.get("REVISION_CHUNK_WORDS", "400"))
+# Chunk analyses kept per worker, so revised documents only send changed chunks to the model
+CHUNK_CACHE_SIZE = int(os.environ.get("CHUNK_CACHE_SIZE", "1024"))
+# Single-prompt mode limit to prevent token overflow
+SINGLE_PROMPT_MAX_CHARS = 50000
+# Rule-based prefill: dates, parties, defined terms, amounts, obligations and
+# governing law found by rule_extractor are sent with the prompt, and the
+# model only adds the items they miss (a shorter response to wait for)
+RULE_PREFILL = os.environ.get("RULE_PREFILL", "true").lower() != "false"
+
+# Early rejection: PDFs longer than EARLY_SCREEN_PAGES pages are classified on
+# their first pages and rejected without extracting the rest if those pages
+# score below EARLY_REJECT_MAX_SCORE (acceptance needs 0.4); 0 disables
+EARLY_SCREEN_PAGES = int(os.environ.get("EARLY_SCREEN_PAGES", "5"))
+EARLY_REJECT_MAX_SCORE = float(os.environ.get("EARLY_REJECT_MAX_SCORE", "0.15"))
+
+# Document chat: passages retrieved per question and their size budget
+CHAT_TOP_K = int(os.environ.get("CHAT_TOP_K", "6"))
+CHAT_MAX_CONTEXT_CHARS = int(os.environ.get("CHAT_MAX_CONTEXT_CHARS", "6000"))
+PASSAGE_INDEX_CACHE_SIZE = int(os.environ.get("PASSAGE_INDEX_CACHE_SIZE", "128"))
+
+print(f"Model backend: {MODEL_BACKEND}")
+
+def model_available():
+    """
+    Whether a model can be called: a local backend (MODEL_BACKEND=stub/replay)
+    stands in for Vertex AI, which is initialized on the first call
+    """
+    return MODEL_BACKEND != "vertex" or init_vertex()
+
+# Heavy dependencies, imported by the routes that need them on first use
+LAZY_DEPENDENCIES = ("pdfplumber", "fitz", "PIL.Image", "pytesseract", "tesserocr", "reportlab.platypus")
+
+def preload_dependencies():
+    """
+    Import the lazily loaded dependencies now instead of on first use
+
+    gunicorn.conf.py calls this in the master when GUNICORN_PRELOAD is set,
+    so workers are forked with them already loaded. Vertex AI is imported
+    but not initialized (each worker initializes it on first use).
+
+    Returns:
+        list: Names of the modules imported (those not installed are skipped)
+    """
+    names = list(LAZY_DEPENDENCIES)
+    if MODEL_BACKEND == "vertex":
+        names.append("vertexai.generative_models")
+    loaded = []
+    for name in names:
+        if find_spec(name.split(".")[0]) is not None:
+            importlib.import_module(name)
+            loaded.append(name)
+    return loaded
+
+# Model clients, created once per worker process; every call goes through the
+# scheduler (in-flight caps, shared rate limit, coalescing, 429 retries)
+model_registry = ModelRegistry(factory=create_model, scheduler=ModelScheduler())
+
+# Content-addressed cache of analysis results
+analysis_cache = AnalysisCache()
+# Passage indexes for /chat, keyed by document id (shares the analysis cache directory)
+passage_index_cache = AnalysisCache(
+    max_entries=PASSAGE_INDEX_CACHE_SIZE,
+    directory=os.path.join(ANALYSIS_CACHE_DIR, "passages") if ANALYSIS_CACHE_DIR else ""
+)
+# Map-reduce chunk analyses, keyed by chunk content (shares the analysis cache directory)
+chunk_analysis_cache = AnalysisCache(
+    max_entries=CHUNK_CACHE_SIZE,
+    directory=os.path.join(ANALYSIS_CACHE_DIR, "chunks") if ANALYSIS_CACHE_DIR else ""
+)
+# Recently analyzed documents, for recognizing revised versions (shares the analysis
+# cache directory, so a revision is recognized whichever worker saw the earlier version)
+revision_index = RevisionIndex(directory=os.path.join(ANALYSIS_CACHE_DIR, "revisions") if ANALYSIS_CACHE_DIR else "")
+# Analyzed documents that later uploads may be filled-in copies of
+template_index = TemplateIndex()
 
 # Section cues to check for agreements
 POSITIVE_LABELS = [
@@ -63,6 +143,25 @@ SECTION_CUES = [
     "attendance", "leaves", "certificate", "offer letter"
 ]
 
+# Document type patterns
+DOCUMENT_TYPE_PATTERNS = {
+    "rental agreement": ["rent", "lease", "tenant", "landlord", "security deposit"],
+    "employment contract": ["employment", "employee", "employer", "salary", "position"],
+    "service agreement": ["service", "provider", "client", "deliverable"],
+    "loan agreement": ["loan", "borrower", "lender", "interest rate"],
+    "nda": ["confidential", "non-disclosure", "secrecy"],
+    "purchase agreement": ["purchase", "buy", "sell", "buyer", "seller"],
+    "internship agreement": ["internship", "intern", "supervisor", "internship period"]
+}
+
+# Section cues match whole words, document type keywords match anywhere;
+# both are found by one matcher compiled at import
+KEYWORD_MATCHER = KeywordMatcher(
+    words=SECTION_CUES,
+    substrings=[k for keywords in DOCUMENT_TYPE_PATTERNS.values() for k in keywords]
+)
+SECTION_CUE_ENTRIES = frozenset((cue, True) for cue in SECTION_CUES)
+
 # Helpers
 def safe_join_text(parts):
     return "\n".join([p for p in parts if p])
@@ -83,10 +182,44 @@ def chunk_text(text, max_words=300, max_chunks=10):
     chunks = [" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words)]
     return chunks[:max_chunks]
 
+@lru_cache(maxsize=4)
+def scan_keywords(text):
+    """
+    Section cues and document type keywords present in a document
+
+    Cached on the text, so classify_agreement and detect_document_type
+    share a single scan of the same document.
+
+    Returns:
+        frozenset: Matched ``(keyword, whole_word)`` entries
+    """
+    return frozenset(KEYWORD_MATCHER.found(text.lower()))
+
 def heuristic_score(text):
-    t = (text or "").lower()
-    found = sum(1 for k in SECTION_CUES if re.search(r"\b" + re.escape(k) + r"\b", t))
-    return found / max(1, len(SECTION_CUES))
+    found = scan_keywords(text or "") & SECTION_CUE_ENTRIES
+    return len(found) / max(1, len(SECTION_CUES))
+
+def word_window(text, max_words, max_chunks):
+    """
+    Whitespace-normalized prefix of the text and the spans of its chunks
+
+    Equivalent to joining ``chunk_text(text, max_words, max_chunks)`` with
+    single spaces, without splitting the words past the last chunk.
+
+    Returns:
+        tuple: (window string, list of (start, end) chunk spans)
+    """
+    words = []
+    for match in re.finditer(r"\S+", text):
+        words.append(match.group())
+        if len(words) == max_words * max_chunks:
+            break
+    spans, pos = [], 0
+    for i in range(0, len(words), max_words):
+        length = sum(len(w) for w in words[i:i + max_words]) + min(max_words, len(words) - i) - 1
+        spans.append((pos, pos + length))
+        pos += length + 1
+    return " ".join(words), spans
 
 def classify_agreement(text):
     details = {
@@ -100,17 +233,18 @@ def classify_agreement(text):
     if not text.strip():
         details["reason"] = "empty_text"
         return False, details
-    chunks = chunk_text(text, max_words=300, max_chunks=10)
-    details["chunks"] = len(chunks)
+    # One keyword scan over the chunked window, one over the full text
+    window, spans = word_window(text.lower(), max_words=300, max_chunks=10)
+    details["chunks"] = len(spans)
     votes, per_chunk_scores = 0, []
     CHUNK_THRESHOLD = 0.5
-    for ch in chunks:
+    for found in KEYWORD_MATCHER.found_in_spans(window, spans):
         # Simple keyword-based classification instead of ML model
-        score = heuristic_score(ch)
+        score = len(found & SECTION_CUE_ENTRIES) / len(SECTION_CUES)
         per_chunk_scores.append(score)
         if score >= CHUNK_THRESHOLD:
             votes += 1
-    ratio = votes / len(chunks)
+    ratio = votes / len(spans)
     heur = heuristic_score(text)
     details.update({
         "votes": votes,
@@ -123,7 +257,39 @@ def classify_agreement(text):
         details["reason"] = "low_confidence"
     return accept, details
 
+def screen_agreement(text, pages_done, page_count):
+    """
+    Early verdict on a long document from its first pages
+
+    Acceptance is never decided early; a document is only rejected when
+    its first pages have text but hardly any agreement cues (heuristic
+    score below EARLY_REJECT_MAX_SCORE).
+
+    Returns:
+        dict or None: Rejection details, or None to keep extracting
+    """
+    if not text.strip():
+        return None
+    accepted, details = classify_agreement(text)
+    if accepted or details["heuristic"] >= EARLY_REJECT_MAX_SCORE:
+        return None
+    details.update(reason="low_confidence_early", pages_screened=pages_done, pages=page_count)
+    return details
+
 # Document type detection
+def document_type_scores(text):
+    """
+    Keyword score per document type, from one scan of the text
+
+    Returns:
+        dict: Number of distinct keywords found per document type
+    """
+    found = scan_keywords(text)
+    return {
+        doc_type: sum(1 for keyword in keywords if (keyword, False) in found)
+        for doc_type, keywords in DOCUMENT_TYPE_PATTERNS.items()
+    }
+
 def detect_document_type(text):
     """
     Enhanced document type detection
@@ -131,24 +297,7 @@ def detect_document_type(text):
     Returns:
         str: Detected document type
     """
-    text_lower = text.lower()
-    
-    # Document type patterns
-    patterns = {
-        "rental agreement": ["rent", "lease", "tenant", "landlord", "security deposit"],
-        "employment contract": ["employment", "employee", "employer", "salary", "position"],
-        "service agreement": ["service", "provider", "client", "deliverable"],
-        "loan agreement": ["loan", "borrower", "lender", "interest rate"],
-        "nda": ["confidential", "non-disclosure", "secrecy"],
-        "purchase agreement": ["purchase", "buy", "sell", "buyer", "seller"],
-        "internship agreement": ["internship", "intern", "supervisor", "internship period"]
-    }
-    
-    # Score each document type
-    scores = {}
-    for doc_type, keywords in patterns.items():
-        score = sum(1 for keyword in keywords if keyword in text_lower)
-        scores[doc_type] = score
+    scores = document_type_scores(text)
     
     # Return highest scoring document type
     if scores:
@@ -158,142 +307,262 @@ def detect_document_type(text):
     
     return "general legal document"
 
+def document_type_label(document_type):
+    """
+    Metrics label value for a document type, from a fixed set: the form's
+    document_type is free text, and each distinct label value is a new series
+
+    Returns:
+        str: A DOCUMENT_TYPE_PATTERNS key, "general legal document" or "other"
+    """
+    value = (document_type or "").strip().lower()
+    if value in DOCUMENT_TYPE_PATTERNS or value == "general legal document":
+        return value
+    return "other"
+
 # Fallback analysis function
 def create_fallback_analysis(text, document_type):
     """
     Create basic analysis when AI analysis fails
     
+    The result is marked ``"fallback": True`` so it is never cached,
+    indexed or reused in place of a model analysis (see reusable_analysis).
+
     Returns:
         dict: Basic analysis structure
     """
     # Extract first few sentences for summary
     sentences = text.split('.')
     summary = '. '.join(sentences[:3]) + '.' if len(sentences) > 3 else text[:500]
+    # Fields the rules can find without a model
+    facts = extract_facts(text)
     
     return {
         "summary": summary,
-        "key_terms": [],
-        "main_clauses": [],
-        "critical_dates": [],
-        "parties": [],
-        "jurisdiction": "Not analyzed",
-        "obligations": [],
+        "key_terms": facts["key_terms"] + amounts_as_terms(facts),
+        "main_clauses": clause_outline(text),
+        "critical_dates": facts["critical_dates"],
+        "parties": facts["parties"],
+        "jurisdiction": facts["jurisdiction"] or "Not analyzed",
+        "obligations": facts["obligations"],
         "risks": [],
         "recommendations": ["Have a legal professional review this document"],
         "missing_clauses": [],
         "compliance_issues": [],
-        "next_steps": ["Review document with legal counsel"]
+        "next_steps": ["Review document with legal counsel"],
+        "fallback": True
     }
 
-# Enhanced document analysis function
-def analyze_legal_document(text, document_type=None):
+def reusable_analysis(analysis):
     """
-    Comprehensive legal document analysis using Gemini AI
-    
-    Args:
-        text (str): Extracted text from legal document
-        document_type (str, optional): Type of document (auto-detected if None)
-    
-    Returns:
-        dict: Structured analysis with 12 categories
+    Whether an analysis may be cached, indexed or reused: not a failed model
+    call (error) and not a degraded rule-based stand-in (fallback)
     """
-    
-    # Auto-detect document type if not provided
-    if not document_type:
-        document_type = detect_document_type(text)
-    
-    # If Vertex AI is not available, use fallback analysis
-    if not VERTEX_AI_AVAILABLE:
-        print("Using fallback analysis - Vertex AI not available")
-        return create_fallback_analysis(text, document_type)
-    
-    # Enhanced prompt engineering for comprehensive analysis
-    prompt = f"""
-    Analyze the following {document_type or 'legal document'} and provide a comprehensive analysis.
-    Return ONLY valid JSON that strictly matches this schema:
-    
-    {{
+    return "error" not in analysis and not analysis.get("fallback")
+
+# Analysis prompt schema (12 categories)
+ANALYSIS_SCHEMA = """
+    {
         "summary": "Brief 2-3 sentence overview of the entire document",
         "key_terms": [
-            {{
+            {
                 "term": "Defined term",
                 "definition": "Clear definition from the document"
-            }}
+            }
         ],
         "main_clauses": [
-            {{
+            {
                 "name": "Clause name/title",
                 "description": "Brief description of what this clause covers"
-            }}
+            }
         ],
         "critical_dates": [
-            {{
+            {
                 "date": "YYYY-MM-DD or date range",
                 "event": "What happens on this date"
-            }}
+            }
         ],
         "parties": [
-            {{
+            {
                 "name": "Party name",
                 "role": "Their role in the agreement"
-            }}
+            }
         ],
         "jurisdiction": "Governing law and jurisdiction information",
         "obligations": [
-            {{
+            {
                 "party": "Which party",
                 "responsibility": "What they must do"
-            }}
+            }
         ],
         "risks": [
-            {{
+            {
                 "risk": "Identified risk",
                 "severity": "high/medium/low",
                 "description": "Explanation of the risk"
-            }}
+            }
         ],
         "recommendations": [
             "Actionable recommendation to address identified issues"
         ],
         "missing_clauses": [
-            {{
+            {
                 "clause": "Missing clause name",
                 "importance": "Why it's important"
-            }}
+            }
         ],
         "compliance_issues": [
-            {{
+            {
                 "issue": "Compliance concern",
                 "regulation": "Relevant law/regulation (if identifiable)"
-            }}
+            }
         ],
         "next_steps": [
             "Action item that should be taken next"
         ]
-    }}
-    
+    }
+"""
+
+GENERATION_CONFIG = {
+    "temperature": 0.4,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+def rule_prefill(text):
+    """
+    Analysis fields found by rule_extractor, for the prompt and the merge after it
+
+    Returns:
+        dict: Non-empty fields only (empty if RULE_PREFILL is off)
+    """
+    if not RULE_PREFILL:
+        return {}
+    facts = extract_facts(text)
+    prefilled = {
+        "key_terms": facts["key_terms"] + amounts_as_terms(facts),
+        "critical_dates": facts["critical_dates"],
+        "parties": facts["parties"],
+        "jurisdiction": facts["jurisdiction"],
+        "obligations": facts["obligations"],
+    }
+    return {field: value for field, value in prefilled.items() if value}
+
+def merge_prefilled(prefilled, analysis):
+    """
+    Model analysis (or some of its fields) with the prefilled items added in front
+
+    Returns:
+        dict: Merged analysis (see merge_analyses); analyses with an error unchanged
+    """
+    if not prefilled or "error" in analysis:
+        return analysis
+    return merge_analyses([prefilled, analysis], summary=analysis.get("summary"))
+
+def build_analysis_prompt(text, document_type, part=None, prefilled=None):
+    """
+    Prompt asking the model for the 12-category JSON analysis
+
+    Args:
+        text (str): Document text (or one chunk of it)
+        document_type (str): Detected or requested document type
+        part (tuple, optional): (index, total) when analyzing one chunk of a long document
+        prefilled (dict, optional): Fields already extracted by rules (see rule_prefill);
+            the model is asked only for the list items they miss
+
+    Returns:
+        str: Prompt text
+    """
+    if part is None:
+        intro = f"Analyze the following {document_type or 'legal document'} and provide a comprehensive analysis."
+    else:
+        intro = (f"The following text is part {part[0]} of {part[1]} of a {document_type or 'legal document'}. "
+                 "Analyze only what this part contains and provide a comprehensive analysis of it.")
+    hints = ""
+    if prefilled:
+        lists = ", ".join(field for field, value in prefilled.items() if isinstance(value, list))
+        hints = f"""
+    These fields were already extracted from the text:
+    {json.dumps(prefilled, ensure_ascii=False)}
+    For {lists}, return only the items missing above (an empty list if none); they are merged afterwards.
+    Use them as context for the other fields.
+    """
+    return f"""
+    {intro}
+    Return ONLY valid JSON that strictly matches this schema:
+    {ANALYSIS_SCHEMA}{hints}
     Document Text:
-    {text[:50000]}  # Limit to prevent token overflow
+    {text}
+    """
+
+def error_analysis(e):
+    """
+    Analysis structure returned when the model call fails
+    """
+    return {
+        "error": f"Analysis failed: {str(e)}",
+        "summary": "Document analysis could not be completed due to technical issues.",
+        "key_terms": [],
+        "main_clauses": [],
+        "critical_dates": [],
+        "parties": [],
+        "jurisdiction": "Not available",
+        "obligations": [],
+        "risks": [],
+        "recommendations": [],
+        "missing_clauses": [],
+        "compliance_issues": [],
+        "next_steps": []
+    }
+
+def stream_analysis_sections(model, prompt, on_section):
+    """
+    Stream the model response, calling on_section(key, value) for each
+    top-level field as soon as it is complete
+
+    Returns:
+        str: The full response text
+    """
+    parser, parts = ObjectMemberParser(), []
+    for chunk in model.generate_content(prompt, generation_config=GENERATION_CONFIG, stream=True):
+        text = chunk_text_or_empty(chunk)
+        parts.append(text)
+        for key, value in parser.feed(text):
+            on_section(key, value)
+    return "".join(parts)
+
+def generate_analysis(prompt, text, document_type, on_section=None, prefilled=None):
+    """
+    Run one analysis prompt through Gemini and parse the JSON it returns
+
+    With on_section the response is streamed and each field is passed to
+    on_section(key, value) as soon as it arrives; the returned analysis is
+    the same either way. Fields in prefilled (the prompt's rule-extracted
+    items) are merged into the response, and into each streamed field.
+
+    Returns:
+        dict: Parsed analysis, the fallback analysis if the response is not
+        valid JSON, or an error structure if the call fails
     """
-    
     try:
-        # Initialize Gemini model
-        model = GenerativeModel("gemini-1.5-flash-001")
+        # Shared Gemini client for this worker
+        model = model_registry.get(GEMINI_MODEL)
         
         # Generate response
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "temperature": 0.4,
-                "top_p": 0.8,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-            }
-        )
+        if on_section is None:
+            response_text = model.generate_content(prompt, generation_config=GENERATION_CONFIG).text
+        else:
+            def on_model_section(key, value):
+                if prefilled and key in prefilled:
+                    value = merge_prefilled(prefilled, {key: value})[key]
+                on_section(key, value)
+
+            response_text = stream_analysis_sections(model, prompt, on_model_section)
         
         # Parse and validate JSON response
-        analysis = json.loads(response.text)
-        return analysis
+        analysis = json.loads(response_text)
+        return merge_prefilled(prefilled, analysis)
         
     except json.JSONDecodeError as e:
         print(f"JSON parsing failed: {e}")
@@ -302,153 +571,934 @@ def analyze_legal_document(text, document_type=None):
     except Exception as e:
         print(f"Analysis failed: {e}")
         # Return error structure
-        return {
-            "error": f"Analysis failed: {str(e)}",
-            "summary": "Document analysis could not be completed due to technical issues.",
-            "key_terms": [],
-            "main_clauses": [],
-            "critical_dates": [],
-            "parties": [],
-            "jurisdiction": "Not available",
-            "obligations": [],
-            "risks": [],
-            "recommendations": [],
-            "missing_clauses": [],
-            "compliance_issues": [],
-            "next_steps": []
-        }
+        return error_analysis(e)
 
-# Enhanced Flask route for document analysis
-@app.route("/enhanced_analysis", methods=["POST"])
-def enhanced_document_analysis():
+def section_chunks(text, max_words=MAP_CHUNK_WORDS, max_chunks=MAP_MAX_CHUNKS):
     """
-    Enhanced document analysis endpoint
+    Split a document into chunks along clause boundaries
+
+    Sections are packed into chunks of up to max_words words; sections
+    that are too long on their own are cut with chunk_text. The chunk size
+    grows if needed so the whole document fits in max_chunks chunks. With
+    REVISION_ANALYSIS on, chunk ends are content-defined (half to full
+    max_words), so revisions of a document share their unchanged chunks.
+
+    Returns:
+        list: Chunk texts in document order
     """
-    print("Received request to enhanced_analysis endpoint")
+    max_words = max(max_words, -(-len(text.split()) // max(1, max_chunks)))
+    return pack_sections(
+        split_sections(text),
+        max_words,
+        lambda section: chunk_text(section, max_words=max_words, max_chunks=len(section.split())),
+        min_words=max_words // 2 if REVISION_ANALYSIS else None
+    )
+
+def summarize_chunks(analyses, document_type):
+    """
+    Reduce step: one short model call that merges the chunk summaries
+
+    Returns:
+        str or None: Document summary, or None if the call fails
+    """
+    summaries = [a.get("summary", "") for a in analyses if "error" not in a and a.get("summary")]
+    if len(summaries) <= 1:
+        return summaries[0] if summaries else None
+    prompt = (f"These are summaries of consecutive parts of one {document_type or 'legal document'}:\n\n"
+              + "\n".join(f"- {s}" for s in summaries)
+              + "\n\nWrite a brief 2-3 sentence overview of the entire document. Return only the overview.")
+    try:
+        model = model_registry.get(GEMINI_MODEL)
+        return model.generate_content(prompt, generation_config=GENERATION_CONFIG).text.strip()
+    except Exception as e:
+        print(f"Summary reduce failed: {e}")
+        return None
+
+def analyze_map_reduce(text, document_type, usage=None, max_words=MAP_CHUNK_WORDS):
+    """
+    Analyze a long document chunk by chunk and merge the results
+
+    Chunks are analyzed concurrently (MAP_CONCURRENCY at a time) so the whole
+    document is covered without one oversized prompt. Chunk analyses are
+    cached by chunk content, so a revised document only sends the chunks
+    that changed to the model.
+
+    Args:
+        usage (dict, optional): Receives the "chunks" and "reused_chunks" counts
+        max_words (int): Chunk size (see section_chunks)
+
+    Returns:
+        dict: Merged analysis with the same 12 categories
+    """
+    chunks = section_chunks(text, max_words=max_words)
+    version = analysis_version()
+    reused = []
+    print(f"Map-reduce analysis over {len(chunks)} chunks")
+
+    def analyze_chunk(chunk, index, total):
+        key = make_cache_key(hashlib.sha256(chunk.encode("utf-8")).hexdigest(), document_type, version)
+        cached = chunk_analysis_cache.get(key)
+        if cached is not None:
+            reused.append(index)
+            return cached
+        prefilled = rule_prefill(chunk)
+        prompt = build_analysis_prompt(chunk, document_type, part=(index, total), prefilled=prefilled)
+        analysis = generate_analysis(prompt, chunk, document_type, prefilled=prefilled)
+        if reusable_analysis(analysis):
+            chunk_analysis_cache.set(key, analysis)
+        return analysis
+
+    analyses = map_chunks(analyze_chunk, chunks, MAP_CONCURRENCY)
+    if reused:
+        print(f"Reused cached analyses for {len(reused)}/{len(chunks)} chunks")
+    if usage is not None:
+        usage.update(chunks=len(chunks), reused_chunks=len(reused))
+    failed = [a for a in analyses if "error" in a]
+    if len(failed) == len(analyses):
+        return failed[0]
+    if failed:
+        print(f"{len(failed)}/{len(analyses)} chunks failed, merging the rest")
+    merged = merge_analyses(analyses, summary=summarize_chunks(analyses, document_type))
+    if any(a.get("fallback") for a in analyses):
+        # Part of the document only has the rule-based analysis
+        merged["fallback"] = True
+    return merged
+
+def use_map_reduce(text):
+    if ANALYSIS_MODE == "mapreduce":
+        return True
+    if ANALYSIS_MODE == "single":
+        return False
+    return len(text) > MAP_REDUCE_THRESHOLD_CHARS
+
+# Enhanced document analysis function
+def analyze_legal_document(text, document_type=None, on_section=None, usage=None, revision=False):
+    """
+    Comprehensive legal document analysis using Gemini AI
+
+    Documents longer than MAP_REDUCE_THRESHOLD_CHARS are analyzed with
+    map-reduce over clause chunks (see ANALYSIS_MODE); shorter ones use a
+    single prompt, unless they are a revision of an earlier document: those
+    are analyzed in chunks of REVISION_CHUNK_WORDS words, so each later
+    version reuses the analyses of the chunks it did not change.
+    
+    Args:
+        text (str): Extracted text from legal document
+        document_type (str, optional): Type of document (auto-detected if None)
+        on_section (callable, optional): Streams single-prompt analyses field by
+            field (see generate_analysis); map-reduce results arrive whole
+        usage (dict, optional): Receives model usage counts (see analyze_map_reduce)
+        revision (bool): Whether an earlier version of the document was analyzed
+    
+    Returns:
+        dict: Structured analysis with 12 categories
+    """
+    
+    # Auto-detect document type if not provided
+    if not document_type:
+        document_type = detect_document_type(text)
     
+    # If no model backend is available, use fallback analysis
+    if not model_available():
+        print("Using fallback analysis - Vertex AI not available")
+        return create_fallback_analysis(text, document_type)
+
+    if use_map_reduce(text):
+        return analyze_map_reduce(text, document_type, usage)
+    if revision and ANALYSIS_MODE != "single":
+        return analyze_map_reduce(text, document_type, usage, max_words=REVISION_CHUNK_WORDS)
+    
+    # Enhanced prompt engineering for comprehensive analysis
+    prefilled = rule_prefill(text[:SINGLE_PROMPT_MAX_CHARS])
+    prompt = build_analysis_prompt(text[:SINGLE_PROMPT_MAX_CHARS], document_type, prefilled=prefilled)
+    return generate_analysis(prompt, text, document_type, on_section, prefilled)
+
+def analysis_version():
+    """
+    Identify the model and prompt that produce analyses right now
+
+    Returns:
+        str: Version string folded into analysis cache keys
+    """
+    if model_available():
+        chunking = "cdc" if REVISION_ANALYSIS else "greedy"
+        prefill = "rules" if RULE_PREFILL else "model"
+        return (f"{MODEL_BACKEND}:{GEMINI_MODEL}:{PROMPT_VERSION}:{ANALYSIS_MODE}:{MAP_REDUCE_THRESHOLD_CHARS}:"
+                f"{MAP_CHUNK_WORDS}:{REVISION_CHUNK_WORDS}:{chunking}:{prefill}")
+    return f"fallback:{PROMPT_VERSION}:rules"
+
+# Upload extensions with an extractor (see get_extractor)
+SUPPORTED_SUFFIXES = (".pdf", ".docx", ".png", ".jpg", ".jpeg")
+
+def get_extractor(filename):
+    """
+    Pick the text extractor for an uploaded file name
+
+    Returns:
+        callable or None: Extraction function, or None if unsupported
+    """
+    if filename.endswith(".pdf"):
+        return extract_pdf
+    if filename.endswith(".docx"):
+        return extract_docx
+    if filename.endswith((".png", ".jpg", ".jpeg")):
+        return extract_image
+    return None
+
+def analysis_response(filename, result, cache_status, include_text=True):
+    """
+    Build the /enhanced_analysis response from a (possibly cached) result
+
+    With include_text=False the extracted text is replaced by its length,
+    which keeps responses for very large documents small.
+    """
+    if not result["accepted"]:
+        response = jsonify({
+            "error": "Rejected: Not a valid agreement.",
+            "details": result["details"]
+        })
+        response.status_code = 400
+    else:
+        payload = {
+            "filename": filename,
+            "document_id": result["document_id"],
+            "analysis": result["analysis"],
+            "timestamp": datetime.now().isoformat()
+        }
+        for key in ("revision", "template"):
+            if result.get(key):
+                payload[key] = result[key]
+        if include_text:
+            payload["extracted_text"] = result["extracted_text"]
+        else:
+            payload["text_length"] = len(result["extracted_text"])
+        response = jsonify(payload)
+    response.headers["X-Analysis-Cache"] = cache_status
+    return response
+
+def get_upload():
+    """
+    Validate the file upload of the current request
+
+    Returns:
+        tuple: (FileStorage, None) if valid, or (None, error response)
+    """
     if "file" not in request.files:
         print("No file uploaded")
-        return jsonify({"error": "No file uploaded"}), 400
+        return None, (jsonify({"error": "No file uploaded"}), 400)
     
     file = request.files["file"]
     print(f"Received file: {file.filename}")
     
     if file.filename == "":
         print("No file selected")
-        return jsonify({"error": "No file selected"}), 400
+        return None, (jsonify({"error": "No file selected"}), 400)
+
+    if get_extractor(file.filename.lower()) is None:
+        print(f"Unsupported file type: {file.filename}")
+        return None, (jsonify({"error": "Unsupported file type"}), 400)
+    return file, None
+
+def run_pipeline(file_stream, filename, document_type=None, content_hash=None, model_slots=None, events=None):
+    """
+    Extraction, classification and analysis of one uploaded document
+
+    Results are cached by the SHA-256 of the upload, the requested
+    document type and the analysis version, so re-uploads of the same
+    document skip extraction and the model call entirely.
+
+    Args:
+        file_stream: Seekable binary stream of the upload
+        filename (str): Original file name (selects the extractor)
+        document_type (str, optional): Type of document (auto-detected if None)
+        content_hash (str, optional): SHA-256 of the upload, if already computed
+        model_slots (Semaphore, optional): Held while the model analyzes the document
+        events (callable, optional): Receives progress event dicts (extracted,
+            classification, section) as the pipeline advances
+
+    Returns:
+        tuple: (result dict, cache status "hit" or "miss")
+    """
+    filename = filename.lower()
+    label(file_type=filename.rsplit(".", 1)[-1])
+    if content_hash is None:
+        with stage("hash"):
+            content_hash = hash_stream(file_stream)
+    cache_key = make_cache_key(content_hash, document_type, analysis_version())
+    with stage("cache"):
+        cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        print("Analysis cache hit")
+        label(document_type=document_type_label(cached.get("document_type")), outcome="cached")
+        if events:
+            events({"event": "classification", "accepted": cached["accepted"], "details": cached["details"],
+                    "document_type": cached.get("document_type")})
+        if cached["accepted"]:
+            with stage("index"):
+                get_passage_index(content_hash, cached["extracted_text"])
+        return cached, "hit"
 
     # Extract text (using existing functions)
-    filename = file.filename.lower()
-    text = ""
+    print(f"Processing {filename.rsplit('.', 1)[-1].upper()} file")
+    with stage("extract"):
+        text, early_rejection = extract_screened(filename, file_stream)
+    print(f"Extracted text length: {len(text)}")
+    if events:
+        events({"event": "extracted", "text_length": len(text)})
     
-    try:
-        if filename.endswith(".pdf"):
-            print("Processing PDF file")
-            text = extract_pdf(file.stream)
-        elif filename.endswith(".docx"):
-            print("Processing DOCX file")
-            text = extract_docx(file.stream)
-        elif filename.endswith((".png", ".jpg", ".jpeg")):
-            print("Processing image file")
-            text = extract_image(file.stream)
+    # Check if it's a valid agreement (using existing function)
+    with stage("classify"):
+        if early_rejection:
+            is_ok, details = False, early_rejection
         else:
-            print(f"Unsupported file type: {filename}")
-            return jsonify({"error": "Unsupported file type"}), 400
-        
-        print(f"Extracted text length: {len(text)}")
-        
-        # Check if it's a valid agreement (using existing function)
-        is_ok, details = classify_agreement(text)
-        print(f"Classification result: {is_ok}, Details: {details}")
-        
-        if not is_ok:
-            return jsonify({
-                "error": "Rejected: Not a valid agreement.",
-                "details": details
-            }), 400
-        
+            is_ok, details = classify_agreement(text)
+        if is_ok:
+            document_type = document_type or detect_document_type(text)
+    print(f"Classification result: {is_ok}, Details: {details}")
+    if events:
+        events({"event": "classification", "accepted": is_ok, "details": details, "document_type": document_type})
+    
+    if not is_ok:
+        label(outcome="rejected")
+        result = {"accepted": False, "details": details}
+        # Empty text may be a transient extraction failure (e.g. OCR unavailable)
+        if details["reason"] != "empty_text":
+            analysis_cache.set(cache_key, result)
+        return result, "miss"
+    
+    # Fingerprint the document to find earlier versions and templates it fills in
+    record, previous, template, analysis = None, None, None, None
+    if REVISION_ANALYSIS or TEMPLATE_MATCHING:
+        with stage("fingerprint"):
+            record = RevisionIndex.record(content_hash, text, document_type)
+    if TEMPLATE_MATCHING:
+        with stage("template"):
+            analysis, template = template_index.match(record, text)
+    if template is not None:
+        print(f"Filled in template {template['template_id'][:12]} ({len(template['substitutions'])} fields)")
+    elif REVISION_ANALYSIS:
+        previous, similarity = revision_index.find_previous(record)
+        if previous is not None:
+            print(f"Revision of {previous['document_id'][:12]} (similarity {similarity})")
+
+    label(document_type=document_type_label(document_type))
+    usage = {}
+    if analysis is not None:
+        label(outcome="template")
+        if events:
+            for key, value in analysis.items():
+                events({"event": "section", "name": key, "value": value})
+    else:
         # Perform enhanced analysis
         print("Performing enhanced analysis")
-        analysis = analyze_legal_document(text)
+        if model_slots is not None:
+            with stage("model_wait"):
+                model_slots.acquire()
+        try:
+            on_section = (lambda key, value: events({"event": "section", "name": key, "value": value})) \
+                if events else None
+            with stage("analysis"):
+                analysis = analyze_legal_document(text, document_type, on_section, usage, previous is not None)
+        finally:
+            if model_slots is not None:
+                model_slots.release()
         print(f"Analysis completed: {analysis.get('summary', 'No summary')[:100]}...")
-        
-        return jsonify({
-            "filename": file.filename,
-            "extracted_text": text,
-            "analysis": analysis,
-            "timestamp": datetime.now().isoformat()
-        })
+        if "error" in analysis:
+            label(outcome="model_error")
+        else:
+            label(outcome="fallback" if analysis.get("fallback") else "analyzed")
+    
+    # Index passages now so /chat questions about this document are cheap
+    with stage("index"):
+        get_passage_index(content_hash, text)
+    
+    result = {
+        "accepted": True,
+        "document_id": content_hash,
+        "document_type": document_type,
+        "details": details,
+        "extracted_text": text,
+        "analysis": analysis
+    }
+    if record is not None and reusable_analysis(analysis):
+        if REVISION_ANALYSIS:
+            revision_index.add(record)
+        if template is not None:
+            result["template"] = template
+        elif TEMPLATE_MATCHING:
+            template_index.add(record, text, analysis)
+        if previous is not None:
+            result["revision"] = {
+                "previous_document_id": previous["document_id"],
+                "similarity": similarity,
+                **diff_clauses(previous, record),
+                **usage
+            }
+    # Failed model calls and unparseable replies are transient, only cache real analyses
+    if reusable_analysis(analysis):
+        analysis_cache.set(cache_key, result)
+    return result, "miss"
+
+# Enhanced Flask route for document analysis
+@app.route("/enhanced_analysis", methods=["POST"])
+def enhanced_document_analysis():
+    """
+    Enhanced document analysis endpoint
+
+    Each stage is timed for /metrics; a client that sends timing=true (query
+    parameter or X-Server-Timing header) also gets the breakdown in a
+    Server-Timing header, unless SERVER_TIMING=false. With stream=sse
+    or stream=ndjson (or Accept: text/event-stream) progress and results
+    are streamed as they happen instead (see stream_upload_analysis).
+    """
+    print("Received request to enhanced_analysis endpoint")
+    stream_format = request.form.get("stream") or request.args.get("stream")
+    if not stream_format and request.accept_mimetypes.best == "text/event-stream":
+        stream_format = "sse"
+    if stream_format:
+        return stream_upload_analysis(stream_format)
+    wants_timing = SERVER_TIMING and \
+        (request.args.get("timing") or request.headers.get("X-Server-Timing", "")).lower() == "true"
+    with trace("enhanced_analysis", timing=wants_timing) as timing:
+        response = app.make_response(analyze_upload())
+    if timing is not None and wants_timing:
+        response.headers["Server-Timing"] = timing.server_timing()
+    return response
+
+def analyze_upload():
+    """
+    Validate the upload of the current request and run the pipeline on it
+
+    Returns:
+        Flask response or (response, status) tuple
+    """
+    with stage("upload"):
+        file, error = get_upload()
+    if error:
+        label(outcome="bad_request")
+        return error
+    document_type = request.form.get("document_type") or None
+    include_text = request.form.get("include_text", "true").lower() != "false"
+    
+    try:
+        result, cache_status = run_pipeline(file.stream, file.filename, document_type)
+        with stage("serialize"):
+            return analysis_response(file.filename, result, cache_status, include_text)
     except Exception as e:
         print(f"Error in enhanced_document_analysis: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
-# File extraction functions
-def extract_pdf(file_stream):
+def take_upload_stream(upload):
+    """
+    Take over an uploaded file's stream for use after the view returns
+
+    The request closes its files when the view returns, before a streamed
+    response has been produced; the caller now closes the stream.
+    """
+    stream = upload.stream
+    upload.stream = io.BytesIO()
+    return stream
+
+def format_event(event, stream_format):
+    data = json.dumps(event)
+    if stream_format == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def stream_upload_analysis(stream_format):
+    """
+    Streaming mode of /enhanced_analysis
+
+    Events, one per SSE message or NDJSON line: started; progress (pages
+    done per extraction phase); extracted; classification; one section
+    per analysis field as the model streams it; done (or rejected/error).
+    The extracted text is not repeated, only its length.
+    """
+    if stream_format not in ("sse", "ndjson"):
+        return jsonify({"error": "stream must be sse or ndjson"}), 400
+    file, error = get_upload()
+    if error:
+        return error
+    filename = file.filename
+    stream = take_upload_stream(file)
+    document_type = request.form.get("document_type") or None
+    events = queue.Queue()
+
+    def work():
+        def on_progress(phase, done, total):
+            events.put({"event": "progress", "phase": phase, "pages_done": done, "pages": total})
+
+        try:
+            with trace("enhanced_analysis_stream"), extraction_progress(on_progress):
+                events.put(run_pipeline(stream, filename, document_type, events=events.put))
+        except Exception as e:
+            print(f"Error in streaming analysis: {e}")
+            events.put({"event": "error", "error": f"Internal server error: {str(e)}"})
+        finally:
+            stream.close()
+            events.put(None)
+
+    def generate():
+        yield format_event({"event": "started", "filename": filename}, stream_format)
+        threading.Thread(target=work, name="stream-analysis", daemon=True).start()
+        sent = set()
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            if isinstance(item, dict):
+                if item["event"] == "section":
+                    sent.add(item["name"])
+                yield format_event(item, stream_format)
+                continue
+            result, cache_status = item
+            if not result["accepted"]:
+                yield format_event({"event": "rejected", "error": "Rejected: Not a valid agreement.",
+                                    "details": result["details"]}, stream_format)
+                continue
+            # Cached, map-reduce and fallback analyses arrive whole
+            for name, value in result["analysis"].items():
+                if name not in sent:
+                    yield format_event({"event": "section", "name": name, "value": value}, stream_format)
+            yield format_event({"event": "done", "document_id": result["document_id"], "cache": cache_status,
+                                "document_type": result.get("document_type"),
+                                "revision": result.get("revision"), "template": result.get("template"),
+                                "text_length": len(result["extracted_text"])}, stream_format)
+
+    response = Response(generate(), mimetype="text/event-stream" if stream_format == "sse" else "application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    # Keep reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# Batch analysis
+def collect_batch_uploads():
+    """
+    Gather the documents of a batch request: every "files"/"file" part,
+    with zip archives expanded to their supported members
+
+    Returns:
+        list: Document dicts with index, filename and stream (None if unsupported)
+    """
+    documents = []
     try:
-        file_stream.seek(0)
-        with pdfplumber.open(file_stream) as pdf:
-            return safe_join_text([p.extract_text() for p in pdf.pages])
+        for upload in request.files.getlist("files") + request.files.getlist("file"):
+            name = upload.filename or ""
+            if name.lower().endswith(".zip"):
+                documents.extend(open_zip_members(upload.stream, SUPPORTED_SUFFIXES,
+                                                  max_files=BATCH_MAX_FILES - len(documents)))
+            elif name.lower().endswith(SUPPORTED_SUFFIXES):
+                documents.append((name, take_upload_stream(upload)))
+            elif name:
+                documents.append((name, None))
+            if len(documents) > BATCH_MAX_FILES:
+                raise BatchError(f"Too many files: a batch is limited to {BATCH_MAX_FILES} documents")
+    except BaseException:
+        for _, stream in documents:
+            if stream is not None:
+                stream.close()
+        raise
+    return [{"index": i, "filename": name, "stream": stream} for i, (name, stream) in enumerate(documents)]
+
+def batch_line(document, result, cache_status, include_text):
+    """
+    NDJSON record for one document of a batch
+    """
+    line = {"index": document["index"], "filename": document["filename"], "cache": cache_status}
+    if not result["accepted"]:
+        line.update(status="rejected", details=result["details"])
+        return line
+    analysis = result["analysis"]
+    line.update(
+        status="failed" if "error" in analysis else "analyzed",
+        document_id=result["document_id"],
+        document_type=result.get("document_type"),
+        analysis=analysis,
+        text_length=len(result["extracted_text"])
+    )
+    for key in ("revision", "template"):
+        if result.get(key):
+            line[key] = result[key]
+    if include_text:
+        line["extracted_text"] = result["extracted_text"]
+    return line
+
+def analyze_batch_document(document, document_type, include_text):
+    with trace("batch"):
+        try:
+            result, cache_status = run_pipeline(
+                document["stream"], document["filename"], document_type,
+                content_hash=document["hash"], model_slots=batch_model_slots
+            )
+        except Exception as e:
+            print(f"Batch document {document['filename']} failed: {e}")
+            return {"index": document["index"], "filename": document["filename"],
+                    "status": "error", "error": str(e)}
+    return batch_line(document, result, cache_status, include_text)
+
+ENDPOINT_UPLOAD_LIMITS["batch_analysis"] = BATCH_MAX_UPLOAD_BYTES
+
+@app.route("/batch_analysis", methods=["POST"])
+def batch_analysis():
+    """
+    Analyze many documents in one request, streaming results as NDJSON
+
+    Send several "files" parts and/or zip archives. Documents are extracted
+    and classified concurrently (BATCH_WORKERS), identical uploads are
+    analyzed once, and at most BATCH_MODEL_CONCURRENCY documents per worker
+    are with the model at a time. Each line is one document's result, in
+    completion order; the last line summarizes the batch.
+    """
+    try:
+        documents = collect_batch_uploads()
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    if not documents:
+        return jsonify({"error": "No files uploaded"}), 400
+    document_type = request.form.get("document_type") or None
+    include_text = request.form.get("include_text", "false").lower() == "true"
+    print(f"Batch of {len(documents)} documents")
+
+    def generate():
+        counts, lines = {}, None
+        try:
+            supported = [d for d in documents if d["stream"] is not None]
+            for document in documents:
+                if document["stream"] is None:
+                    counts["unsupported"] = counts.get("unsupported", 0) + 1
+                    yield json.dumps({"index": document["index"], "filename": document["filename"],
+                                      "status": "unsupported", "error": "Unsupported file type"}) + "\n"
+                else:
+                    document["hash"] = hash_stream(document["stream"])
+            unique, duplicates = group_duplicates(supported)
+            lines = run_concurrently(lambda d: analyze_batch_document(d, document_type, include_text), unique)
+            for line in lines:
+                copies = [dict(line, index=d["index"], filename=d["filename"], duplicate_of=line["index"])
+                          for d in duplicates.get(line["index"], [])]
+                for record in [line] + copies:
+                    counts[record["status"]] = counts.get(record["status"], 0) + 1
+                    yield json.dumps(record) + "\n"
+            yield json.dumps({"done": True, "documents": len(documents), "unique": len(unique),
+                              "counts": counts}) + "\n"
+        finally:
+            # Wait for documents still being analyzed before closing their streams
+            if lines is not None:
+                lines.close()
+            for document in documents:
+                if document["stream"] is not None:
+                    document["stream"].close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# Document chat
+def get_passage_index(document_id, text=None):
+    """
+    Passage index for a document, built on first use and cached by document id
+
+    Args:
+        document_id (str): Upload hash returned by /enhanced_analysis
+        text (str, optional): Document text, used to build the index if it is not cached
+
+    Returns:
+        PassageIndex or None: None if the index is unknown and no text was given
+    """
+    data = passage_index_cache.get(document_id)
+    if data is not None:
+        return PassageIndex.from_dict(data)
+    if text is None:
+        return None
+    index = PassageIndex.build(text)
+    passage_index_cache.set(document_id, index.to_dict())
+    return index
+
+def chat_about_document(index, question):
+    """
+    Answer a question from the passages most relevant to it
+
+    Only the top CHAT_TOP_K passages are sent to the model, so every part
+    of the document is reachable and prompts stay small.
+
+    Returns:
+        tuple: (answer, passages used)
+    """
+    passages = index.context(question, k=CHAT_TOP_K, max_chars=CHAT_MAX_CONTEXT_CHARS)
+    if not model_available():
+        return "AI chat is not available. The most relevant passages are:\n\n" + "\n\n".join(passages), passages
+    excerpts = "\n\n".join(f"[{i + 1}] {p}" for i, p in enumerate(passages))
+    prompt = f"""
+    Based on the following excerpts from a document, answer the question accurately and concisely.
+    If the excerpts do not contain the answer, say so.
+    
+    Excerpts:
+    {excerpts}
+    
+    Question: {question}
+    
+    Answer:
+    """
+    try:
+        model = model_registry.get(GEMINI_MODEL)
+        response = model.generate_content(prompt)
+        return response.text, passages
     except Exception as e:
-        print(f"PDF extract error: {e}")
+        return f"Unable to answer the question due to: {str(e)}", passages
+
+@app.route("/chat", methods=["POST"])
+def document_chat():
+    """
+    Interactive chat about a document
+
+    Send either the document_id returned by /enhanced_analysis or the full
+    document_text, plus the question.
+    """
+    data = request.get_json(silent=True) or {}
+    question = data.get("question", "")
+    document_id = data.get("document_id")
+    document_text = data.get("document_text", "")
+    
+    if not question or not (document_id or document_text):
+        return jsonify({"error": "A question and a document_id or document_text are required"}), 400
+
+    if document_id:
+        index = get_passage_index(document_id, document_text or None)
+        if index is None:
+            return jsonify({"error": "Unknown document_id: upload the document again or send document_text"}), 404
+    else:
+        document_id = "text:" + hashlib.sha256(document_text.encode("utf-8")).hexdigest()
+        index = get_passage_index(document_id, document_text)
+    
+    answer, passages = chat_about_document(index, question)
+    
+    return jsonify({
+        "question": question,
+        "answer": answer,
+        "passages": passages,
+        "timestamp": datetime.now().isoformat()
+    })
+
+# Asynchronous analysis jobs
+def run_job(job):
+    with trace("job"), open(job["upload_path"], "rb") as f:
+        result, _ = run_pipeline(f, job["filename"], job["document_type"])
+    return result
+
+job_runner = JobRunner(run_job)
+
+def timestamp(seconds):
+    return datetime.fromtimestamp(seconds).isoformat() if seconds else None
+
+def job_status(job):
+    status = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "created_at": timestamp(job["created_at"]),
+        "started_at": timestamp(job["started_at"]),
+        "finished_at": timestamp(job["finished_at"]),
+        "status_url": f"/jobs/{job['id']}",
+        "result_url": f"/jobs/{job['id']}/result"
+    }
+    if job["error"]:
+        status["error"] = job["error"]
+    return status
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Queue a document for analysis and return immediately
+
+    Takes the same form fields as /enhanced_analysis and answers 202 with
+    the job id; poll /jobs/<id> and fetch /jobs/<id>/result when done.
+    """
+    file, error = get_upload()
+    if error:
+        return error
+    job = new_job(file.filename, None, request.form.get("document_type") or None)
+    upload_dir = os.path.join(JOB_DIR, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    job["upload_path"] = os.path.join(upload_dir, job["id"] + os.path.splitext(file.filename)[1].lower())
+    file.stream.seek(0)
+    file.save(job["upload_path"])
+    job_runner.submit(job)
+    print(f"Queued job {job['id']} for {file.filename}")
+    return jsonify(job_status(job)), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    """
+    Result of a finished job, in the same shape as /enhanced_analysis
+
+    Answers 202 with the job status while the job is still queued or running.
+    """
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == FAILED:
+        return jsonify({"error": f"Internal server error: {job['error']}"}), 500
+    if job["status"] != DONE:
+        return jsonify(job_status(job)), 202
+    include_text = request.args.get("include_text", "true").lower() != "false"
+    return analysis_response(job["filename"], job["result"], "job", include_text)
+
+# File extraction functions
+def extract_pdf(file_stream):
+    """
+    Extract PDF text, OCRing only the pages without a usable text layer
+
+    Large documents are split across the page extraction pool; results are
+    reassembled in page order. If pdfplumber cannot read the file at all,
+    every page is OCRed.
+    """
+    text = ""
+    for text, _, _ in iter_pdf_text(file_stream):
+        pass
+    return text
+
+def iter_pdf_text(file_stream, first_pages=None):
+    """
+    Extract PDF text lazily, in two steps
+
+    Yields the text of the first first_pages pages, then the text of the
+    whole document, so a caller can stop after the first pages. Without
+    first_pages (or for short documents) only the whole text is yielded.
+
+    Yields:
+        tuple: (text so far, pages extracted, page count)
+    """
+    with materialize_stream(file_stream, ".pdf") as path:
         try:
-            file_stream.seek(0)
-            doc = fitz.open(stream=file_stream.read(), filetype="pdf")
-            texts = []
-            for p in doc:
-                pix = p.get_pixmap(dpi=200)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                texts.append(pytesseract.image_to_string(img))
-            return "\n".join(texts)
-        except Exception as e2:
-            print(f"PDF OCR error: {e2}")
-            return ""
+            page_count = pdf_page_count(path)
+            first = min(first_pages or page_count, page_count)
+            texts = extract_hybrid(path, list(range(first)))
+            if first < page_count:
+                yield safe_join_text(texts), first, page_count
+                texts += extract_hybrid(path, list(range(first, page_count)))
+            full_text = safe_join_text(texts)
+        except Exception as e:
+            print(f"PDF extract error: {e}")
+            try:
+                pages = extract_ocr(path)
+                full_text, page_count = "\n".join(pages), len(pages)
+            except Exception as e2:
+                print(f"PDF OCR error: {e2}")
+                full_text, page_count = "", 0
+        yield full_text, page_count, page_count
+
+def extract_screened(filename, file_stream):
+    """
+    Extract an upload's text, giving up early on long PDFs that are clearly
+    not agreements (see screen_agreement)
+
+    Returns:
+        tuple: (text, early rejection details or None)
+    """
+    if not filename.endswith(".pdf") or EARLY_SCREEN_PAGES <= 0:
+        return get_extractor(filename)(file_stream), None
+    text = ""
+    for text, pages_done, page_count in iter_pdf_text(file_stream, EARLY_SCREEN_PAGES):
+        if pages_done < page_count:
+            details = screen_agreement(text, pages_done, page_count)
+            if details is not None:
+                print(f"Rejected after screening {pages_done}/{page_count} pages")
+                return text, details
+    return text, None
 
 def extract_docx(file_stream):
     try:
         file_stream.seek(0)
-        doc = docx.Document(io.BytesIO(file_stream.read()))
-        return "\n".join(p.text for p in doc.paragraphs if p.text)
+        # Paragraphs and table rows streamed from the document XML (plus headers and footers)
+        return "\n".join(iter_docx_text(file_stream))
     except Exception as e:
         print(f"DOCX extract error: {e}")
         return ""
 
 def extract_image(file_stream):
     try:
-        file_stream.seek(0)
-        img = Image.open(file_stream).convert("RGB")
-        return pytesseract.image_to_string(img)
+        img, dpi = open_upload_image(file_stream)
+        return ocr_image(img, dpi)
     except Exception as e:
         print(f"Image extract error: {e}")
         return ""
 
 # Routes
+@app.errorhandler(413)
+def upload_too_large(e):
+    limit_mb = (request.max_content_length or MAX_UPLOAD_BYTES) // (1024 * 1024)
+    return jsonify({"error": f"File too large: uploads are limited to {limit_mb} MB"}), 413
+
 @app.route("/active", methods=["GET"])
 def active():
     return "active"
 
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(analysis_cache.stats())
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/templates/stats", methods=["GET"])
+def templates_stats():
+    return jsonify(template_index.stats())
+
+@app.route("/models/stats", methods=["GET"])
+def models_stats():
+    return jsonify({"backend": MODEL_BACKEND, **model_registry.stats()})
+
+@app.route("/jobs/stats", methods=["GET"])
+def jobs_stats():
+    return jsonify(job_runner.stats())
+
 @app.route("/export/pdf", methods=["POST"])
 def export_pdf():
-    text = request.form.get("text", "")
-    output = io.BytesIO()
-    doc = SimpleDocTemplate(output)
-    styles = getSampleStyleSheet()
-    story = [Paragraph(line, styles["Normal"]) for line in text.split("\n")]
-    doc.build(story)
-    output.seek(0)
-    return send_file(output, as_attachment=True, download_name="output.pdf")
+    """
+    Export text, and optionally an analysis, as a PDF
+
+    Takes form fields or a JSON body: "text" is rendered one paragraph per
+    line, "analysis" (the analysis object, as JSON in a form field) is
+    rendered first as headed sections and tables.
+    """
+    payload = (request.get_json(silent=True) if request.is_json else request.form) or {}
+    text = payload.get("text") or ""
+    analysis = payload.get("analysis")
+    if isinstance(analysis, str):
+        try:
+            analysis = json.loads(analysis) if analysis.strip() else None
+        except json.JSONDecodeError:
+            return jsonify({"error": "analysis is not valid JSON"}), 400
+    if analysis is not None and not isinstance(analysis, dict):
+        return jsonify({"error": "analysis must be an object"}), 400
+
+    try:
+        output = render_pdf(text, analysis)
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 422
+    return send_export(output, "output.pdf")
 
 @app.route("/export/docx", methods=["POST"])
 def export_docx():
     text = request.form.get("text", "")
-    output = io.BytesIO()
-    d = docx.Document()
-    for line in text.split("\n"):
-        d.add_paragraph(line)
-    d.save(output)
+    return send_export(render_docx(text), "output.docx")
+
+def send_export(output, download_name):
+    """
+    Send a rendered export in blocks from its spooled file, which is closed when the response ends
+    """
+    size = output.seek(0, io.SEEK_END)
     output.seek(0)
-    return send_file(output, as_attachment=True, download_name="output.docx")
+    response = send_file(output, as_attachment=True, download_name=download_name)
+    response.content_length = size
+    return response
 
 if __name__ == "__main__":
     import os
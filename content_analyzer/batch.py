@@ -0,0 +1,126 @@
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from uploads import UPLOAD_SPOOL_DIR
+
+# Batch analysis configuration
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "100"))
+BATCH_MAX_UPLOAD_MB = int(os.environ.get("BATCH_MAX_UPLOAD_MB", "500"))
+BATCH_MAX_UPLOAD_BYTES = BATCH_MAX_UPLOAD_MB * 1024 * 1024
+# Limit on the total uncompressed size of a zip upload (guards against zip bombs)
+BATCH_MAX_UNZIPPED_MB = int(os.environ.get("BATCH_MAX_UNZIPPED_MB", "1000"))
+# Documents extracted and classified at once per request
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "4"))
+# Documents in model analysis at once, shared by every batch in the worker
+BATCH_MODEL_CONCURRENCY = int(os.environ.get("BATCH_MODEL_CONCURRENCY", "4"))
+COPY_BUFFER_SIZE = 1024 * 1024
+
+batch_model_slots = threading.BoundedSemaphore(max(1, BATCH_MODEL_CONCURRENCY))
+
+
+class BatchError(ValueError):
+    """
+    Raised for batch uploads that cannot be processed (too many files, bad zip)
+    """
+
+
+def zip_documents(archive, suffixes):
+    """
+    The members of a zip archive that are documents, from its central directory
+
+    Directories, hidden files and macOS resource forks are skipped, as are
+    members whose extension is not in suffixes.
+
+    Returns:
+        list: ``(ZipInfo, suffix)`` pairs
+    """
+    documents = []
+    for info in archive.infolist():
+        base = os.path.basename(info.filename)
+        if info.is_dir() or not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+            continue
+        suffix = os.path.splitext(base)[1].lower()
+        if suffix in suffixes:
+            documents.append((info, suffix))
+    return documents
+
+
+def open_zip_members(stream, suffixes, max_bytes=BATCH_MAX_UNZIPPED_MB * 1024 * 1024, max_files=BATCH_MAX_FILES):
+    """
+    Copy the supported members of a zip upload to temp files
+
+    Members are counted from the zip directory before anything is
+    extracted, so an archive with more than max_files documents is
+    rejected without expanding it. Sizes are checked while copying, not
+    just from the zip directory, which can lie.
+
+    Returns:
+        list: ``(member name, temp file)`` pairs; the caller closes the files
+    """
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise BatchError(f"Invalid zip file: {e}")
+    members, total = [], 0
+    try:
+        with archive:
+            documents = zip_documents(archive, suffixes)
+            if len(documents) > max_files:
+                raise BatchError(f"Too many files: a batch is limited to {BATCH_MAX_FILES} documents")
+            for info, suffix in documents:
+                target = tempfile.NamedTemporaryFile("w+b", suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+                members.append((info.filename, target))
+                with archive.open(info) as source:
+                    while True:
+                        chunk = source.read(COPY_BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        total += len(chunk)
+                        if total > max_bytes:
+                            raise BatchError(f"Zip contents exceed {max_bytes // (1024 * 1024)} MB")
+                        target.write(chunk)
+                target.seek(0)
+    except BaseException:
+        for _, target in members:
+            target.close()
+        raise
+    return members
+
+
+def group_duplicates(documents):
+    """
+    Split documents into unique ones and duplicates of an earlier one (by content hash)
+
+    Returns:
+        tuple: (unique documents, {index of first copy: [duplicate documents]})
+    """
+    first, unique, duplicates = {}, [], {}
+    for document in documents:
+        original = first.get(document["hash"])
+        if original is None:
+            first[document["hash"]] = document
+            unique.append(document)
+        else:
+            duplicates.setdefault(original["index"], []).append(document)
+    return unique, duplicates
+
+
+def run_concurrently(process, items, workers=BATCH_WORKERS):
+    """
+    Run process(item) for every item on a thread pool
+
+    Yields:
+        Results in completion order. If the consumer stops early, items
+        that have not started are cancelled and closing the generator waits
+        for the running ones, so the caller can then release what they use.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(items) or 1)))
+    try:
+        futures = [pool.submit(process, item) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,142 @@
+"""
+Microbenchmark: single-pass keyword matcher vs the per-cue scans it replaced
+
+Usage:
+    python benchmarks/bench_classification.py [--words 200000] [--repeat 5]
+
+Builds synthetic agreements of increasing size, checks that the new
+heuristic_score / classify_agreement / detect_document_type return exactly
+what the legacy implementations return, and prints timings for both.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app  # noqa: E402
+
+
+# Legacy implementations, kept verbatim for comparison
+def legacy_heuristic_score(text):
+    t = (text or "").lower()
+    found = sum(1 for k in app.SECTION_CUES if re.search(r"\b" + re.escape(k) + r"\b", t))
+    return found / max(1, len(app.SECTION_CUES))
+
+
+def legacy_classify_agreement(text):
+    details = {"chunks": 0, "votes": 0, "vote_ratio": 0.0, "heuristic": 0.0,
+               "avg_chunk_score": 0.0, "reason": ""}
+    if not text.strip():
+        details["reason"] = "empty_text"
+        return False, details
+    chunks = app.chunk_text(text, max_words=300, max_chunks=10)
+    details["chunks"] = len(chunks)
+    votes, per_chunk_scores = 0, []
+    for ch in chunks:
+        score = legacy_heuristic_score(ch)
+        per_chunk_scores.append(score)
+        if score >= 0.5:
+            votes += 1
+    ratio = votes / len(chunks)
+    heur = legacy_heuristic_score(text)
+    details.update({
+        "votes": votes,
+        "vote_ratio": round(ratio, 3),
+        "heuristic": round(heur, 3),
+        "avg_chunk_score": round(sum(per_chunk_scores) / max(1, len(per_chunk_scores)), 3)
+    })
+    accept = (ratio >= 0.4) or (heur >= 0.4)
+    if not accept:
+        details["reason"] = "low_confidence"
+    return accept, details
+
+
+def legacy_detect_document_type(text):
+    text_lower = text.lower()
+    scores = {}
+    for doc_type, keywords in app.DOCUMENT_TYPE_PATTERNS.items():
+        scores[doc_type] = sum(1 for keyword in keywords if keyword in text_lower)
+    best_match = max(scores.items(), key=lambda x: x[1])
+    if best_match[1] > 0:
+        return best_match[0]
+    return "general legal document"
+
+
+FILLER = ("the said party shall within thirty days of receipt provide written confirmation "
+          "of all amounts due under this clause and any schedule annexed hereto").split()
+# Words that contain keywords without being them, to exercise boundaries and overlaps
+NEAR_MISSES = ["parental", "current", "sellers", "interns", "re-agreement", "terminations",
+               "non_disclosure", "agreement_", "leaseholder", "tenantenant", "salary-based"]
+
+
+def make_document(words, seed):
+    """
+    Agreement-like text with cues and type keywords sprinkled in
+
+    Like real agreements, each document only uses part of the keyword
+    vocabulary, so most absent keywords force a full scan.
+    """
+    rng = random.Random(seed)
+    vocabulary = app.SECTION_CUES + [k for ks in app.DOCUMENT_TYPE_PATTERNS.values() for k in ks]
+    vocabulary = rng.sample(vocabulary, rng.randint(1, len(vocabulary) // 3)) + NEAR_MISSES
+    out = []
+    while len(out) < words:
+        if rng.random() < 0.03:
+            out.append(rng.choice(vocabulary).upper() if rng.random() < 0.2 else rng.choice(vocabulary))
+        else:
+            out.append(rng.choice(FILLER))
+        if rng.random() < 0.05:
+            out.append("\n")
+    return " ".join(out)
+
+
+def best_of(fn, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        # Fresh string each run so the keyword scan cache cannot serve it
+        arg = arg[:1] + arg[1:]
+        app.scan_keywords.cache_clear()
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, default=200000, help="largest document size in words")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sizes = sorted({s for s in (1000, 10000, 50000, args.words) if s <= args.words})
+    pairs = [
+        ("heuristic_score", legacy_heuristic_score, app.heuristic_score),
+        ("classify_agreement", legacy_classify_agreement, app.classify_agreement),
+        ("detect_document_type", legacy_detect_document_type, app.detect_document_type),
+        # What /enhanced_analysis runs per document: both share one keyword scan
+        ("classify + detect",
+         lambda t: (legacy_classify_agreement(t), legacy_detect_document_type(t)),
+         lambda t: (app.classify_agreement(t), app.detect_document_type(t))),
+    ]
+
+    # Equivalence on many small random documents before timing anything
+    for seed in range(200):
+        doc = make_document(random.Random(seed).randint(1, 4000), seed)
+        for name, legacy, current in pairs:
+            assert legacy(doc) == current(doc), f"{name} differs for seed {seed}"
+
+    print(f"{'function':<22}{'words':>9}{'legacy ms':>12}{'current ms':>12}{'speedup':>9}")
+    for words in sizes:
+        doc = make_document(words, words)
+        for name, legacy, current in pairs:
+            old = best_of(legacy, doc, args.repeat)
+            new = best_of(current, doc, args.repeat)
+            print(f"{name:<22}{words:>9}{old * 1000:>12.2f}{new * 1000:>12.2f}{old / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
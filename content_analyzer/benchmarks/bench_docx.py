@@ -0,0 +1,143 @@
+"""
+DOCX benchmark: streaming OOXML extraction and export vs the python-docx paths they replaced
+
+Usage:
+    python benchmarks/bench_docx.py [--pages 500] [--repeat 3] [--corpus DIR]
+
+Extracts the text of a corpus .docx and exports the text of an agreement
+(one sentence per line, as text extracted from PDFs comes out) to .docx,
+once with python-docx (the legacy code, kept verbatim below) and once with
+ooxml.py. Each operation and mode runs in a fresh interpreter so peak RSS
+is per run. Extraction output is also checked to match: the streaming path
+adds table rows, headers and footers, which the corpus documents do not
+have, so their text must be identical.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import DEFAULT_CORPUS_DIR, agreement_pages, write_docx  # noqa: E402
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+# Legacy implementations, kept verbatim for comparison
+def legacy_extract_docx(file_stream):
+    import docx
+    file_stream.seek(0)
+    # python-docx reads the zip members it needs straight from the stream
+    doc = docx.Document(file_stream)
+    return "\n".join(p.text for p in doc.paragraphs if p.text)
+
+
+def legacy_export_docx(text):
+    import docx
+    output = io.BytesIO()
+    d = docx.Document()
+    for line in text.split("\n"):
+        d.add_paragraph(line)
+    d.save(output)
+    output.seek(0)
+    return output
+
+
+def current_extract_docx(file_stream):
+    from ooxml import iter_docx_text
+    file_stream.seek(0)
+    return "\n".join(iter_docx_text(file_stream))
+
+
+def current_export_docx(text):
+    from exports import render_docx
+    return render_docx(text)
+
+
+def export_text(pages):
+    return "\n".join(f"{heading}\n" + body.replace(". ", ".\n") for heading, body in agreement_pages(pages))
+
+
+def docx_path(corpus, pages):
+    path = os.path.join(corpus, f"docx-{pages}p-s0.docx")
+    if not os.path.exists(path):
+        os.makedirs(corpus, exist_ok=True)
+        write_docx(path, pages)
+    return path
+
+
+def run_operation(operation, mode, args):
+    """
+    Time one operation in one mode (called in the per-run child interpreter)
+    """
+    legacy = mode == "legacy"
+    if operation == "extract":
+        extract = legacy_extract_docx if legacy else current_extract_docx
+        with open(docx_path(args.corpus, args.pages), "rb") as f:
+            data = io.BytesIO(f.read())
+        run = lambda: extract(data)  # noqa: E731
+    else:
+        export = legacy_export_docx if legacy else current_export_docx
+        text = export_text(args.pages)
+        run = lambda: export(text).read()  # noqa: E731
+    run()  # warm up imports and caches
+    times = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - started)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "ms": round(1000 * sorted(times)[len(times) // 2], 1),
+        "peak_rss_mb": round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "output_kb": round(len(result) / 1024, 1),
+        "output": result if operation == "extract" else None,
+    }
+
+
+def run_isolated(operation, mode, args):
+    command = [sys.executable, os.path.abspath(__file__), "--operation", operation, "--mode", mode,
+               "--pages", str(args.pages), "--repeat", str(args.repeat), "--corpus", args.corpus]
+    proc = subprocess.run(command, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"{operation}/{mode} failed:\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--operation", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.operation:
+        print(RESULT_PREFIX + json.dumps(run_operation(args.operation, args.mode, args)))
+        return 0
+
+    docx_path(args.corpus, args.pages)
+    print(f"{'operation':<11}{'mode':<11}{'p50 ms':>9}{'RSS MB':>9}{'out KB':>9}")
+    status = 0
+    for operation in ("extract", "export"):
+        outputs = {}
+        for mode in ("legacy", "streaming"):
+            result = run_isolated(operation, mode, args)
+            outputs[mode] = result["output"]
+            print(f"{operation:<11}{mode:<11}{result['ms']:>9.1f}{result['peak_rss_mb']:>9.1f}{result['output_kb']:>9.1f}")
+        if operation == "extract" and outputs["legacy"] != outputs["streaming"]:
+            print("extracted text differs between the legacy and streaming paths")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+OCR benchmark: preprocessed grayscale pages vs the fixed 200 dpi RGB path they replaced
+
+Usage:
+    python benchmarks/bench_ocr.py [--pages 5] [--corpus DIR]
+
+OCRs scanned corpus pages three ways, straight, skewed by a few degrees,
+and as an oversized skewed phone photo (JPEG), once with OCR_PREPROCESS
+off (the legacy path, kept verbatim below) and once with it on. Each mode
+runs in a fresh interpreter so peak RSS is per mode.
+
+Reported per input and mode: time per page spent preparing the image and
+in tesseract, the size of the PNG pytesseract writes for each call, and
+word accuracy against the text the corpus was generated from. Without the
+tesseract binary only the preparation columns are measured.
+"""
+import argparse
+import difflib
+import io
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import DEFAULT_CORPUS_DIR, agreement_pages, build_corpus  # noqa: E402
+
+RESULT_PREFIX = "BENCH_RESULT "
+SKEW_DEGREES = 2.5
+# A 12 megapixel phone camera frame
+PHOTO_SIZE = (3024, 4032)
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# Legacy implementation, kept verbatim for comparison
+def legacy_ocr_page(page):
+    import pytesseract
+    from PIL import Image
+    pix = page.get_pixmap(dpi=200)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return img, lambda: pytesseract.image_to_string(img)
+
+
+def legacy_ocr_upload(stream):
+    import pytesseract
+    from PIL import Image
+    stream.seek(0)
+    img = Image.open(stream).convert("RGB")
+    return img, lambda: pytesseract.image_to_string(img)
+
+
+def current_ocr_page(page):
+    import fitz
+    from PIL import Image
+    import ocr_preprocess
+    dpi = ocr_preprocess.page_ocr_dpi(page)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    img, dpi = ocr_preprocess.prepare_for_ocr(Image.frombytes("L", [pix.width, pix.height], pix.samples), dpi)
+    return img, lambda: ocr_preprocess.recognize(img, dpi)
+
+
+def current_ocr_upload(stream):
+    import ocr_preprocess
+    img, dpi = ocr_preprocess.open_upload_image(stream)
+    img, dpi = ocr_preprocess.prepare_for_ocr(img, dpi)
+    return img, lambda: ocr_preprocess.recognize(img, dpi)
+
+
+def word_accuracy(expected, actual):
+    """
+    Fraction of the expected words recognized, in order (difflib matching blocks)
+    """
+    expected_words = WORD_PATTERN.findall(expected.lower())
+    actual_words = WORD_PATTERN.findall(actual.lower())
+    matcher = difflib.SequenceMatcher(None, expected_words, actual_words, autojunk=False)
+    matched = sum(block.size for block in matcher.get_matching_blocks())
+    return matched / max(1, len(expected_words))
+
+
+def make_inputs(scanned_path, pages):
+    """
+    Returns:
+        dict: input name -> list of ("page", fitz page) or ("upload", bytes) items
+    """
+    import fitz
+    from PIL import Image
+    doc = fitz.open(scanned_path)
+    page_numbers = range(min(pages, len(doc)))
+    straight = [("page", doc[n]) for n in page_numbers]
+
+    skewed_doc, photos = fitz.open(), []
+    for n in page_numbers:
+        pix = doc[n].get_pixmap(dpi=150, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+        rotated = image.rotate(SKEW_DEGREES, resample=Image.BICUBIC, expand=True, fillcolor=255)
+        buffer = io.BytesIO()
+        rotated.save(buffer, format="JPEG", quality=75)
+        target = skewed_doc.new_page(width=doc[n].rect.width, height=doc[n].rect.height)
+        target.insert_image(target.rect, stream=buffer.getvalue())
+        photo = io.BytesIO()
+        rotated.convert("RGB").resize(PHOTO_SIZE, Image.BICUBIC).save(photo, format="JPEG", quality=90)
+        photos.append(("upload", photo.getvalue()))
+    return {"scanned": straight, "skewed": [("page", page) for page in skewed_doc], "photo": photos}
+
+
+def run_mode(mode, corpus, pages, run_ocr):
+    """
+    Run one mode over every input (called in the per-mode child interpreter)
+    """
+    ocr_page, ocr_upload = (legacy_ocr_page, legacy_ocr_upload) if mode == "legacy" else \
+        (current_ocr_page, current_ocr_upload)
+    scanned = next(e["path"] for e in build_corpus(corpus, (), (pages,)) if e["kind"] == "scanned")
+    expected = [f"{heading}\n{body}" for heading, body in agreement_pages(pages)]
+    results = {}
+    for name, items in make_inputs(scanned, pages).items():
+        prepare_s = ocr_s = png_bytes = 0.0
+        accuracy = []
+        for i, (kind, item) in enumerate(items):
+            started = time.perf_counter()
+            image, recognize = ocr_page(item) if kind == "page" else ocr_upload(io.BytesIO(item))
+            prepare_s += time.perf_counter() - started
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            png_bytes += buffer.tell()
+            if run_ocr:
+                started = time.perf_counter()
+                text = recognize()
+                ocr_s += time.perf_counter() - started
+                accuracy.append(word_accuracy(expected[i], text))
+        count = len(items)
+        results[name] = {
+            "prepare_ms": round(1000 * prepare_s / count, 1),
+            "ocr_ms": round(1000 * ocr_s / count, 1) if run_ocr else None,
+            "png_kb": round(png_bytes / count / 1024, 1),
+            "accuracy": round(sum(accuracy) / count, 3) if run_ocr else None,
+        }
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"inputs": results, "peak_rss_mb": round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)}
+
+
+def run_isolated(mode, args, run_ocr):
+    command = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--pages", str(args.pages),
+               "--corpus", args.corpus] + ([] if run_ocr else ["--skip-ocr"])
+    env = dict(os.environ, OCR_PREPROCESS="false" if mode == "legacy" else "true")
+    proc = subprocess.run(command, capture_output=True, text=True, env=env)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"{mode} failed:\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--skip-ocr", action="store_true")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    import pytesseract
+    import shutil
+    run_ocr = not args.skip_ocr and shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+    if args.mode:
+        print(RESULT_PREFIX + json.dumps(run_mode(args.mode, args.corpus, args.pages, run_ocr)))
+        return 0
+    if not run_ocr and not args.skip_ocr:
+        print("tesseract not found - measuring image preparation only")
+
+    print(f"{'input':<10}{'mode':<14}{'prep ms':>9}{'ocr ms':>9}{'PNG KB':>9}{'accuracy':>10}{'RSS MB':>9}")
+    for mode in ("legacy", "preprocessed"):
+        result = run_isolated(mode, args, run_ocr)
+        for name, stats in result["inputs"].items():
+            ocr_ms = "-" if stats["ocr_ms"] is None else f"{stats['ocr_ms']:.1f}"
+            accuracy = "-" if stats["accuracy"] is None else f"{stats['accuracy']:.1%}"
+            print(f"{name:<10}{mode:<14}{stats['prepare_ms']:>9.1f}{ocr_ms:>9}{stats['png_kb']:>9.1f}"
+                  f"{accuracy:>10}{result['peak_rss_mb']:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Synthetic agreement corpus for the benchmarks
+
+Usage:
+    python benchmarks/corpus.py [--out DIR] [--sizes 1,10,50,200] [--scanned-sizes 1,10,50]
+
+Generates agreements of a given number of pages and writes them as text
+PDFs, scanned PDFs (pages rendered to images, no text layer), DOCX files
+and single-page PNG/JPG scans. Content is deterministic for a given seed
+and files are reused if they already exist, so runs are reproducible.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+
+import docx
+import fitz
+from PIL import Image
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate
+
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "legalklarity-bench-corpus")
+# Resolution of the rendered page images in scanned PDFs and PNG/JPG files
+SCAN_DPI = 150
+WORDS_PER_PAGE = 380
+
+AGREEMENT_TYPES = {
+    "rental": ("RENTAL AGREEMENT", "Landlord", "Tenant", [
+        "The Tenant shall pay a monthly rent of Rs. {amount} on or before the {day}th day of each month.",
+        "A security deposit of Rs. {amount} shall be refunded within thirty days of the end of the rental period.",
+        "The Landlord shall carry out structural repairs and the Tenant shall keep the premises in good condition.",
+        "Either party may terminate this lease by giving a notice period of {months} months in writing.",
+    ]),
+    "employment": ("EMPLOYMENT CONTRACT", "Employer", "Employee", [
+        "The Employee shall receive a salary of Rs. {amount} per annum, payable monthly.",
+        "The probation period shall be {months} months from the date of joining, {date}.",
+        "The Employee shall maintain confidential information of the Employer during and after employment.",
+        "Compensation for overtime and leaves shall follow the policies of the Employer as amended.",
+    ]),
+    "service": ("SERVICE AGREEMENT", "Client", "Service Provider", [
+        "The Service Provider shall deliver each deliverable described in Schedule {months} by {date}.",
+        "The Client shall pay fees of Rs. {amount} within thirty days of receiving a valid invoice.",
+        "Payment terms, acceptance criteria and service levels are set out in the annexures.",
+        "The Service Provider is liable for damages up to the fees paid in the preceding {months} months.",
+    ]),
+    "nda": ("NON-DISCLOSURE AGREEMENT", "Disclosing Party", "Receiving Party", [
+        "The Receiving Party shall keep all confidential information in strict secrecy.",
+        "Non-disclosure obligations survive for {months} years after the effective date of {date}.",
+        "Confidential information excludes information that is already public through no breach.",
+        "On request the Receiving Party shall return or destroy all confidential material.",
+    ]),
+}
+BOILERPLATE = [
+    "This Agreement is governed by the laws of India and the courts at {city} shall have jurisdiction.",
+    "Any dispute shall be referred to arbitration by a sole arbitrator appointed by both parties.",
+    "Definitions in this clause apply throughout the agreement and its schedules.",
+    "No amendment is effective unless made in writing and signed by an authorized signatory of each party.",
+    "Notices shall be sent by registered post to the addresses of the parties given above.",
+    "In witness whereof the parties have executed this agreement on the date first written above.",
+]
+CITIES = ["Mumbai", "Delhi", "Bengaluru", "Pune", "Chennai", "Hyderabad"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+          "September", "October", "November", "December"]
+
+
+def agreement_pages(pages, seed=0, kind=None):
+    """
+    Text of a synthetic agreement, one (heading, paragraph) pair per page
+
+    Returns:
+        list: ``(heading, body)`` tuples
+    """
+    rng = random.Random(seed)
+    kind = kind or rng.choice(sorted(AGREEMENT_TYPES))
+    title, first, second, clauses = AGREEMENT_TYPES[kind]
+    opening = (f"This {title.title()} is made on {rng.randint(1, 28)} {rng.choice(MONTHS)} {rng.randint(2020, 2026)} "
+               f"between Asha Verma (hereinafter referred to as the \"{first}\") and "
+               f"Rohan Mehta (hereinafter referred to as the \"{second}\"). "
+               "This agreement sets out the parties, definitions, payment terms, termination, arbitration, "
+               "jurisdiction, governing law and notice period, and is signed by each signatory before a witness. ")
+    result = []
+    for page in range(pages):
+        sentences = [opening] if page == 0 else []
+        words = len(opening.split()) if page == 0 else 0
+        while words < WORDS_PER_PAGE:
+            template = rng.choice(clauses + BOILERPLATE)
+            sentence = template.format(
+                amount=f"{rng.randint(5, 500) * 1000:,}",
+                day=rng.randint(1, 10),
+                months=rng.randint(1, 12),
+                date=f"{rng.randint(1, 28)} {rng.choice(MONTHS)} {rng.randint(2020, 2027)}",
+                city=rng.choice(CITIES),
+            )
+            sentences.append(sentence)
+            words += len(sentence.split())
+        heading = title if page == 0 else f"{page}. CLAUSE {page}"
+        result.append((heading, " ".join(sentences)))
+    return result
+
+
+def agreement_text(pages, seed=0):
+    return "\n\n".join(f"{heading}\n{body}" for heading, body in agreement_pages(pages, seed))
+
+
+def write_text_pdf(path, pages, seed=0):
+    styles = getSampleStyleSheet()
+    story = []
+    for heading, body in agreement_pages(pages, seed):
+        story += [Paragraph(heading, styles["Heading2"]), Paragraph(body, styles["Normal"]), PageBreak()]
+    SimpleDocTemplate(path).build(story[:-1])
+
+
+def render_pages(pdf_path, dpi=SCAN_DPI):
+    """
+    Yield each page of a PDF as a grayscale PIL image
+    """
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            yield Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def write_scanned_pdf(path, pages, seed=0):
+    """
+    PDF whose pages are only images of the text PDF, like a scanner produces
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.pdf")
+        write_text_pdf(source, pages, seed)
+        out = fitz.open()
+        with fitz.open(source) as doc:
+            for page, image in zip(doc, render_pages(source)):
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=75)
+                target = out.new_page(width=page.rect.width, height=page.rect.height)
+                target.insert_image(target.rect, stream=buffer.getvalue())
+        out.save(path)
+        out.close()
+
+
+def write_docx(path, pages, seed=0):
+    d = docx.Document()
+    for heading, body in agreement_pages(pages, seed):
+        d.add_heading(heading, level=2)
+        d.add_paragraph(body)
+    d.save(path)
+
+
+def write_image(path, seed=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.pdf")
+        write_text_pdf(source, 1, seed)
+        image = next(render_pages(source))
+    if path.endswith(".jpg"):
+        image.save(path, quality=85)
+    else:
+        image.save(path)
+
+
+def build_corpus(directory=DEFAULT_CORPUS_DIR, sizes=(1, 10, 50, 200), scanned_sizes=(1, 10, 50), seed=0):
+    """
+    Write the corpus files that do not exist yet
+
+    Returns:
+        list: ``{"kind", "pages", "path"}`` dicts, one per file
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    writers = [("text", ".pdf", write_text_pdf, sizes), ("scanned", ".pdf", write_scanned_pdf, scanned_sizes),
+               ("docx", ".docx", write_docx, sizes)]
+    for kind, suffix, writer, kind_sizes in writers:
+        for pages in kind_sizes:
+            path = os.path.join(directory, f"{kind}-{pages}p-s{seed}{suffix}")
+            if not os.path.exists(path):
+                writer(path, pages, seed)
+            entries.append({"kind": kind, "pages": pages, "path": path})
+    for suffix in (".png", ".jpg"):
+        path = os.path.join(directory, f"image-1p-s{seed}{suffix}")
+        if not os.path.exists(path):
+            write_image(path, seed)
+        entries.append({"kind": suffix[1:], "pages": 1, "path": path})
+    return entries
+
+
+def parse_sizes(value):
+    return tuple(int(s) for s in value.split(",") if s.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--sizes", type=parse_sizes, default=(1, 10, 50, 200))
+    parser.add_argument("--scanned-sizes", type=parse_sizes, default=(1, 10, 50))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for entry in build_corpus(args.out, args.sizes, args.scanned_sizes, args.seed):
+        print(f"{entry['kind']:<8}{entry['pages']:>5}  {entry['path']}  {os.path.getsize(entry['path']) // 1024} KB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
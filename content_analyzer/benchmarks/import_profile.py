@@ -0,0 +1,165 @@
+"""
+Cold-start profile: time until the app answers, with lazy and eager dependency imports
+
+Usage:
+    python benchmarks/import_profile.py [--repeat 5] [--top 15] [--corpus DIR]
+
+Each run is a fresh interpreter with the stub model backend:
+
+- eager: imports the heavy dependencies app.py used to import at start-up
+  (those installed; Vertex AI included), then the app
+- lazy: imports the app only; dependencies load on first use
+
+For both it reports the median time to import the app and answer /active,
+and which heavy modules are loaded by then. For lazy mode it also times
+each route's first request, where the deferred imports are paid, and lists
+the modules with the largest cumulative import time (python -X importtime).
+Vertex AI initialization (aiplatform.init) is not measured: it needs
+credentials and is now deferred to the first analysis either way.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+RESULT_PREFIX = "BENCH_RESULT "
+CHILD_ENV = {"MODEL_BACKEND": "stub", "MODEL_STUB_LATENCY_MS": "0", "MODEL_STUB_JITTER_MS": "0",
+             "ANALYSIS_CACHE_DIR": ""}
+# What app.py and its modules imported at start-up before the imports were deferred
+EAGER_IMPORTS = ("pdfplumber", "fitz", "PIL.Image", "pytesseract", "tesserocr", "docx", "reportlab.platypus",
+                 "google.cloud.aiplatform", "vertexai.generative_models")
+HEAVY_MODULES = ("pdfplumber", "fitz", "PIL.Image", "pytesseract", "tesserocr", "docx", "reportlab.platypus",
+                 "vertexai")
+
+
+def corpus_files(corpus):
+    # corpus.py imports the dependencies being measured, so only the parent process uses it
+    from corpus import write_docx, write_text_pdf
+    docx_path = os.path.join(corpus, "docx-1p-s0.docx")
+    pdf_path = os.path.join(corpus, "text-1p-s0.pdf")
+    os.makedirs(corpus, exist_ok=True)
+    if not os.path.exists(docx_path):
+        write_docx(docx_path, 1)
+    if not os.path.exists(pdf_path):
+        write_text_pdf(pdf_path, 1)
+    return docx_path, pdf_path
+
+
+def first_requests(client, corpus):
+    """
+    Time the first request of each route (lazy imports, caches and pools warm up here)
+    """
+    docx_path, pdf_path = os.path.join(corpus, "docx-1p-s0.docx"), os.path.join(corpus, "text-1p-s0.pdf")
+    requests = [
+        ("export_pdf", lambda: client.post("/export/pdf", data={"text": "Agreement"})),
+        ("export_docx", lambda: client.post("/export/docx", data={"text": "Agreement"})),
+        ("analysis_docx", lambda: client.post("/enhanced_analysis", data={"file": (open(docx_path, "rb"), "a.docx")})),
+        ("analysis_pdf", lambda: client.post("/enhanced_analysis", data={"file": (open(pdf_path, "rb"), "a.pdf")})),
+    ]
+    timings = {}
+    for name, run in requests:
+        started = time.perf_counter()
+        response = run()
+        timings[name] = round(1000 * (time.perf_counter() - started), 1)
+        assert response.status_code == 200, (name, response.status_code)
+    return timings
+
+
+def run_child(mode, corpus, routes):
+    """
+    Start the app in this (fresh) interpreter
+
+    Returns:
+        dict: ready_ms, loaded heavy modules, and first_use_ms per route if routes
+    """
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "eager":
+            for name in EAGER_IMPORTS:
+                try:
+                    importlib.import_module(name)
+                except ImportError:
+                    pass
+        import app
+        client = app.app.test_client()
+        assert client.get("/active").status_code == 200
+        result = {"ready_ms": round(1000 * (time.perf_counter() - started), 1),
+                  "loaded": [m for m in HEAVY_MODULES if m in sys.modules]}
+        if routes:
+            result["first_use_ms"] = first_requests(client, corpus)
+    return result
+
+
+def run_isolated(mode, args, routes=False, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + \
+        [os.path.abspath(__file__), "--child", mode, "--corpus", args.corpus] + (["--routes"] if routes else [])
+    proc = subprocess.run(command, capture_output=True, text=True, env=dict(os.environ, **CHILD_ENV))
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):]), proc.stderr
+    raise RuntimeError(f"{mode} start-up failed:\n{proc.stderr[-2000:]}")
+
+
+def heaviest_imports(importtime_log, top):
+    """
+    Modules with the largest cumulative import time, from a -X importtime log
+
+    Returns:
+        list: (milliseconds, module name, nesting depth)
+    """
+    entries = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative) / 1000, name.strip(), (len(name) - len(name.lstrip())) // 2))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--routes", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(RESULT_PREFIX + json.dumps(run_child(args.child, args.corpus, args.routes)))
+        return 0
+
+    from corpus import DEFAULT_CORPUS_DIR
+    args.corpus = args.corpus or DEFAULT_CORPUS_DIR
+    corpus_files(args.corpus)
+    # One discarded run per mode, so .pyc files exist and the page cache is warm
+    ready = {}
+    for mode in ("eager", "lazy"):
+        run_isolated(mode, args)
+        runs = [run_isolated(mode, args)[0] for _ in range(args.repeat)]
+        ready[mode] = sorted(r["ready_ms"] for r in runs)[len(runs) // 2]
+        print(f"{mode:<6} ready in {ready[mode]:>7.1f} ms  loaded: {', '.join(runs[0]['loaded']) or '-'}")
+    print(f"cold start {ready['eager'] / ready['lazy']:.1f}x faster ({ready['eager'] - ready['lazy']:.0f} ms saved)")
+
+    result, _ = run_isolated("lazy", args, routes=True)
+    print("\nfirst request per route (lazy):")
+    for name, ms in result["first_use_ms"].items():
+        print(f"  {name:<15}{ms:>8.1f} ms")
+    _, log = run_isolated("lazy", args, importtime=True)
+    print("\nheaviest imports until ready (lazy, cumulative ms):")
+    for ms, name, depth in heaviest_imports(log, args.top):
+        print(f"  {ms:>8.1f}  {'  ' * depth}{name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Load test: concurrent /enhanced_analysis capacity of the sync and threaded gunicorn setups
+
+Usage:
+    python benchmarks/load_test.py [--modes sync,threaded] [--concurrency 4,16,64]
+                                   [--duration 20] [--latency-ms 3000] [--workers 4] [--min-ratio 10]
+
+Starts gunicorn with the local stub model (MODEL_STUB_LATENCY_MS per call,
+no caching, template and revision reuse off) once per mode:
+
+- sync: the previous Dockerfile command, ``--workers 4`` sync workers
+- threaded: gunicorn.conf.py (gthread workers, PDF extraction offloaded)
+
+Each concurrency level keeps that many clients posting distinct one-page
+.docx agreements for --duration seconds. Every request waits for at least
+one model call, so throughput x model latency is the number of requests
+the server had in service at once; the best level of each mode is its
+capacity. The script exits with status 1 if threaded capacity is below
+--min-ratio times sync capacity.
+"""
+import argparse
+import http.client
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import agreement_text, parse_sizes  # noqa: E402
+from ooxml import write_docx  # noqa: E402
+from run_benchmarks import percentile  # noqa: E402
+
+# Stub model, nothing cached or reused: every request calls the model
+SERVER_ENV = {
+    "MODEL_BACKEND": "stub",
+    "MODEL_STUB_JITTER_MS": "0",
+    "ANALYSIS_CACHE_SIZE": "0",
+    "ANALYSIS_CACHE_DIR": "",
+    "CHUNK_CACHE_SIZE": "0",
+    "PASSAGE_INDEX_CACHE_SIZE": "0",
+    "TEMPLATE_MATCHING": "false",
+    "REVISION_ANALYSIS": "false",
+    "METRICS_ENABLED": "false",
+}
+STARTUP_TIMEOUT_S = 60
+REQUEST_TIMEOUT_S = 300
+
+
+def server_command(mode, port, workers):
+    if mode == "sync":
+        # An empty config: gunicorn would otherwise pick up ./gunicorn.conf.py
+        return ["gunicorn", "--config", os.devnull, "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+                "--timeout", "120", "app:app"]
+    return ["gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers), "app:app"]
+
+
+def start_server(mode, port, args, log):
+    env = dict(os.environ, **SERVER_ENV, MODEL_STUB_LATENCY_MS=str(args.latency_ms))
+    server = subprocess.Popen([sys.executable, "-m"] + server_command(mode, port, args.workers), cwd=APP_DIR,
+                              env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with status {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/active")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"{mode} server did not start in {STARTUP_TIMEOUT_S}s")
+
+
+def multipart_docx(lines):
+    """
+    multipart/form-data body uploading the lines as a .docx file
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    document = io.BytesIO()
+    write_docx(lines, document)
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"agreement.docx\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + document.getvalue() + \
+        f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Documents:
+    """
+    Distinct uploads, so neither the cache nor request coalescing can answer a request
+    """
+
+    def __init__(self):
+        self.lines = agreement_text(1).split("\n")
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            self.count += 1
+            number = self.count
+        return multipart_docx(self.lines + [f"Agreement reference LT-{number}-{uuid.uuid4().hex[:8]}."])
+
+
+def run_client(port, documents, stop_at, results):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=REQUEST_TIMEOUT_S)
+    while time.monotonic() < stop_at:
+        body, content_type = documents.next()
+        started = time.monotonic()
+        try:
+            connection.request("POST", "/enhanced_analysis", body=body, headers={"Content-Type": content_type})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except OSError:
+            ok = False
+            connection.close()
+        results.append((ok, started, time.monotonic()))
+    connection.close()
+
+
+def run_level(port, concurrency, args):
+    """
+    Load the server with a number of clients for args.duration seconds
+
+    Only requests started and finished within the window count, so
+    requests still queued when it closes do not skew the latencies.
+    """
+    documents = Documents()
+    results = []
+    started = time.monotonic()
+    stop_at = started + args.duration
+    clients = [threading.Thread(target=run_client, args=(port, documents, stop_at, results))
+               for _ in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    done = [(ok, end - start) for ok, start, end in results if end <= stop_at]
+    latencies = sorted(seconds for ok, seconds in done if ok)
+    throughput = len(latencies) / args.duration
+    return {
+        "concurrency": concurrency,
+        "completed": len(latencies),
+        "errors": sum(1 for ok, _ in done if not ok),
+        "rps": round(throughput, 2),
+        "p50_ms": round(1000 * percentile(latencies, 0.5)) if latencies else 0,
+        "p95_ms": round(1000 * percentile(latencies, 0.95)) if latencies else 0,
+        "in_service": round(throughput * args.latency_ms / 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default="sync,threaded")
+    parser.add_argument("--concurrency", type=parse_sizes, default=(4, 16, 64))
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--latency-ms", type=float, default=3000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8731)
+    parser.add_argument("--min-ratio", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'clients':>8}{'done':>7}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'in service':>12}")
+    capacity = {}
+    for mode in args.modes.split(","):
+        with tempfile.TemporaryFile() as log:
+            server = start_server(mode, args.port, args, log)
+            try:
+                for concurrency in args.concurrency:
+                    r = run_level(args.port, concurrency, args)
+                    capacity[mode] = max(capacity.get(mode, 0), r["in_service"])
+                    print(f"{mode:<10}{concurrency:>8}{r['completed']:>7}{r['errors']:>8}{r['rps']:>8.2f}"
+                          f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['in_service']:>12.1f}")
+            finally:
+                server.terminate()
+                server.wait()
+
+    if "sync" not in capacity or "threaded" not in capacity:
+        return 0
+    ratio = capacity["threaded"] / capacity["sync"] if capacity["sync"] else float("inf")
+    print(f"capacity: sync {capacity['sync']:.1f}, threaded {capacity['threaded']:.1f} requests in service "
+          f"({ratio:.1f}x, target {args.min_ratio:g}x)")
+    return 0 if ratio >= args.min_ratio else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
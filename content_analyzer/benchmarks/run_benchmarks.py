@@ -0,0 +1,254 @@
+"""
+Pipeline benchmarks over the synthetic corpus, with a regression baseline
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 1,10,50,200] [--repeat 5] [--filter extract_pdf]
+                                        [--baseline benchmarks/baseline.json] [--update-baseline]
+
+Times the extractors, classification, the export routes and the whole
+/enhanced_analysis request (with the stub model backend, no latency) on
+the corpus from corpus.py. Each case runs in a fresh interpreter so peak
+RSS is per case; it is the benchmark process's high-water mark and does
+not include page pool worker processes. OCR cases are skipped when the
+tesseract binary is not installed.
+
+Results are compared with the baseline file: a case regresses when its
+p50 latency or peak RSS grows by more than the tolerance, and the script
+exits with status 1. Baselines are machine-specific; regenerate them with
+--update-baseline on the machine that runs the comparison.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import DEFAULT_CORPUS_DIR, agreement_text, build_corpus, parse_sizes  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+RESULT_PREFIX = "BENCH_RESULT "
+# Run the pipeline case against the local stub model, without caching
+CASE_ENV = {
+    "MODEL_BACKEND": "stub",
+    "MODEL_STUB_LATENCY_MS": "0",
+    "MODEL_STUB_JITTER_MS": "0",
+    "ANALYSIS_CACHE_SIZE": "0",
+    "ANALYSIS_CACHE_DIR": "",
+    "PASSAGE_INDEX_CACHE_SIZE": "0",
+    "CHUNK_CACHE_SIZE": "0",
+}
+
+
+def tesseract_available():
+    import pytesseract
+    return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+
+def list_cases(entries):
+    """
+    Benchmark cases for the corpus entries
+
+    Returns:
+        list: ``{"name", "kind", "pages", "path", "ocr"}`` dicts
+    """
+    cases = []
+    for entry in entries:
+        kind, pages = entry["kind"], entry["pages"]
+        if kind in ("text", "scanned"):
+            cases.append({"name": f"extract_pdf/{kind}-{pages}p", "ocr": kind == "scanned", **entry})
+        elif kind == "docx":
+            cases.append({"name": f"extract_docx/docx-{pages}p", "ocr": False, **entry})
+        else:
+            cases.append({"name": f"extract_image/{kind}", "ocr": True, **entry})
+    for entry in entries:
+        if entry["kind"] != "text":
+            continue
+        for func in ("classify_agreement", "detect_document_type", "export_pdf", "export_docx", "enhanced_analysis"):
+            cases.append({"name": f"{func}/text-{entry['pages']}p", "ocr": False, **entry})
+    return cases
+
+
+def case_runner(app, case):
+    """
+    Zero-argument callable that performs one iteration of a case
+    """
+    func, path, pages = case["name"].split("/")[0], case["path"], case["pages"]
+    if func.startswith("extract_"):
+        extractor = getattr(app, func)
+
+        def run():
+            with open(path, "rb") as f:
+                return extractor(f)
+        return run
+
+    text = agreement_text(pages)
+    if func in ("classify_agreement", "detect_document_type"):
+        target = getattr(app, func)
+
+        def run():
+            # Measure the scan itself, not the keyword scan cache
+            app.scan_keywords.cache_clear()
+            return target(text)
+        return run
+
+    client = app.app.test_client()
+    if func == "enhanced_analysis":
+        def run():
+            with open(path, "rb") as f:
+                response = client.post("/enhanced_analysis", data={"file": (f, os.path.basename(path))})
+            assert response.status_code == 200, response.status_code
+        return run
+
+    route = "/export/pdf" if func == "export_pdf" else "/export/docx"
+
+    def run():
+        response = client.post(route, data={"text": text})
+        assert response.status_code == 200, response.status_code
+        return response.data
+    return run
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(case, repeat):
+    """
+    Run one case in this process (called in the per-case child interpreter)
+
+    Returns:
+        dict: Latency statistics, throughput and peak RSS
+    """
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        run = case_runner(app, case)
+        run()  # warm up: imports, pools, caches
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    return {
+        "pages": case["pages"],
+        "runs": repeat,
+        "p50_ms": round(1000 * percentile(timings, 0.5), 2),
+        "p95_ms": round(1000 * percentile(timings, 0.95), 2),
+        "mean_ms": round(1000 * mean, 2),
+        "pages_per_s": round(case["pages"] / mean, 1) if mean else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_isolated(case, args):
+    command = [sys.executable, os.path.abspath(__file__), "--case", case["name"], "--repeat", str(args.repeat),
+               "--corpus", args.corpus, "--sizes", ",".join(map(str, args.sizes)),
+               "--scanned-sizes", ",".join(map(str, args.scanned_sizes))]
+    env = dict(os.environ, **CASE_ENV)
+    proc = subprocess.run(command, capture_output=True, text=True, env=env)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"{case['name']} failed:\n{proc.stderr[-2000:]}")
+
+
+def compare(results, baseline, latency_tolerance, rss_tolerance, min_delta_ms):
+    """
+    Cases that got slower or bigger than the baseline allows
+
+    Returns:
+        list: Human-readable regression descriptions
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p50_ms"] > base["p50_ms"] * (1 + latency_tolerance) and \
+                result["p50_ms"] - base["p50_ms"] > min_delta_ms:
+            regressions.append(f"{name}: p50 {base['p50_ms']} -> {result['p50_ms']} ms")
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_tolerance):
+            regressions.append(f"{name}: peak RSS {base['peak_rss_mb']} -> {result['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--sizes", type=parse_sizes, default=(1, 10, 50, 200))
+    parser.add_argument("--scanned-sizes", type=parse_sizes, default=(1, 10, 50))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--skip-ocr", action="store_true")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25)
+    parser.add_argument("--rss-tolerance", type=float, default=0.2)
+    parser.add_argument("--min-delta-ms", type=float, default=15.0,
+                        help="ignore latency changes smaller than this (timer noise on tiny cases)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    cases = list_cases(build_corpus(args.corpus, args.sizes, args.scanned_sizes))
+    if args.case:
+        case = next(c for c in cases if c["name"] == args.case)
+        print(RESULT_PREFIX + json.dumps(run_case(case, args.repeat)))
+        return 0
+
+    skip_ocr = args.skip_ocr or not tesseract_available()
+    if skip_ocr and not args.skip_ocr:
+        print("tesseract not found - skipping OCR cases")
+    cases = [c for c in cases if args.filter in c["name"] and not (skip_ocr and c["ocr"])]
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("cases", {})
+
+    print(f"{'case':<34}{'p50 ms':>10}{'p95 ms':>10}{'pages/s':>10}{'RSS MB':>9}{'vs base':>9}")
+    results = {}
+    for case in cases:
+        result = results[case["name"]] = run_isolated(case, args)
+        base = baseline.get(case["name"])
+        change = f"{result['p50_ms'] / base['p50_ms'] - 1:+.0%}" if base and base["p50_ms"] else ""
+        print(f"{case['name']:<34}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['pages_per_s']:>10.1f}{result['peak_rss_mb']:>9.1f}{change:>9}")
+
+    if args.update_baseline:
+        merged = dict(baseline, **results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": {"python": platform.python_version(), "platform": platform.platform(),
+                                   "cpus": os.cpu_count()},
+                       "cases": dict(sorted(merged.items()))}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.latency_tolerance, args.rss_tolerance, args.min_delta_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import os
+import tempfile
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from ooxml import write_docx
+from uploads import UPLOAD_SPOOL_DIR
+
+# Exports up to this size are built in memory; larger ones spill to a temp file
+EXPORT_SPOOL_MAX_BYTES = int(os.environ.get("EXPORT_SPOOL_MAX_BYTES", str(4 * 1024 * 1024)))
+# Flowables created ahead of the page layout
+FLOWABLE_LOOKAHEAD = 64
+
+# Analysis sections in export order: (field, title, table columns as
+# (key, header, width fraction)); fields without columns are text or bullets
+ANALYSIS_SECTIONS = [
+    ("summary", "Summary", None),
+    ("parties", "Parties", (("name", "Name", 0.4), ("role", "Role", 0.6))),
+    ("jurisdiction", "Jurisdiction", None),
+    ("key_terms", "Key Terms", (("term", "Term", 0.3), ("definition", "Definition", 0.7))),
+    ("main_clauses", "Main Clauses", (("name", "Clause", 0.3), ("description", "Description", 0.7))),
+    ("critical_dates", "Critical Dates", (("date", "Date", 0.25), ("event", "Event", 0.75))),
+    ("obligations", "Obligations", (("party", "Party", 0.25), ("responsibility", "Responsibility", 0.75))),
+    ("risks", "Risks", (("risk", "Risk", 0.3), ("severity", "Severity", 0.12), ("description", "Description", 0.58))),
+    ("missing_clauses", "Missing Clauses", (("clause", "Clause", 0.3), ("importance", "Importance", 0.7))),
+    ("compliance_issues", "Compliance Issues", (("issue", "Issue", 0.6), ("regulation", "Regulation", 0.4))),
+    ("recommendations", "Recommendations", None),
+    ("next_steps", "Next Steps", None),
+]
+
+
+# reportlab is imported on the first PDF export, not at start-up
+@lru_cache(maxsize=None)
+def export_styles():
+    """
+    Paragraph styles shared by every export (built once per process)
+    """
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle("Cell", parent=styles["Normal"], fontSize=9, leading=11))
+    styles.add(ParagraphStyle("HeaderCell", parent=styles["Cell"], fontName="Helvetica-Bold"))
+    return styles
+
+
+@lru_cache(maxsize=None)
+def table_style():
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+    return TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e8e8e8")),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ])
+
+
+class ExportError(ValueError):
+    """
+    Raised for content that cannot be laid out on a page, even without tables
+    """
+
+
+class FlowableStream(list):
+    """
+    Story for SimpleDocTemplate.build that pulls flowables from an iterator
+
+    build() takes flowables from the front of its list (putting split parts
+    back there) and checks len() before each one. Refilling the buffer in
+    __len__ keeps FLOWABLE_LOOKAHEAD flowables alive instead of one per
+    line of the whole document, and removing from the front of a short
+    list stays cheap.
+    """
+
+    def __init__(self, flowables, lookahead=FLOWABLE_LOOKAHEAD):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+
+    def __len__(self):
+        size = super().__len__()
+        while size < self._lookahead:
+            flowable = next(self._source, None)
+            if flowable is None:
+                break
+            self.append(flowable)
+            size += 1
+        return size
+
+
+def _text(value):
+    # Model output may hold markup characters; Paragraph parses its text as XML
+    return escape("" if value is None else str(value))
+
+
+def text_flowables(text, styles):
+    """
+    One paragraph per line of text
+    """
+    from reportlab.platypus import Paragraph
+    for line in text.split("\n"):
+        yield Paragraph(_text(line), styles["Normal"])
+
+
+def analysis_table(items, columns, styles, width):
+    """
+    Table of list items, one row per item (items that are not objects fill the first column)
+    """
+    from reportlab.platypus import Paragraph, Table
+    rows = [[Paragraph(_text(header), styles["HeaderCell"]) for _, header, _ in columns]]
+    for item in items:
+        if isinstance(item, dict):
+            values = [item.get(key) for key, _, _ in columns]
+        else:
+            values = [item] + [""] * (len(columns) - 1)
+        rows.append([Paragraph(_text(value), styles["Cell"]) for value in values])
+    return Table(rows, colWidths=[width * fraction for _, _, fraction in columns], repeatRows=1, splitInRow=1,
+                 style=table_style())
+
+
+def item_text(item, columns):
+    # A table row as one line of text, for layouts without tables
+    if not isinstance(item, dict):
+        return _text(item)
+    return "; ".join(f"<b>{_text(header)}:</b> {_text(item.get(key))}"
+                     for key, header, _ in columns if item.get(key) not in (None, ""))
+
+
+def analysis_flowables(analysis, styles, width, tables=True):
+    """
+    The 12 analysis categories: text fields as paragraphs, lists of objects
+    as tables and lists of strings as bullets (empty categories are left out)
+
+    With tables=False lists of objects are bullets too, one "Header: value"
+    line per item: a paragraph splits between pages anywhere, a table row
+    only where its cells can split.
+    """
+    from reportlab.platypus import Paragraph
+    yield Paragraph("Document Analysis", styles["Title"])
+    for field, title, columns in ANALYSIS_SECTIONS:
+        value = analysis.get(field)
+        if not value:
+            continue
+        yield Paragraph(title, styles["Heading2"])
+        if isinstance(value, list) and columns and tables:
+            yield analysis_table(value, columns, styles, width)
+        elif isinstance(value, list) and columns:
+            for item in value:
+                yield Paragraph(item_text(item, columns), styles["Normal"], bulletText="•")
+        elif isinstance(value, list):
+            for item in value:
+                yield Paragraph(_text(item), styles["Normal"], bulletText="•")
+        else:
+            yield Paragraph(_text(value), styles["Normal"])
+
+
+def render_pdf(text="", analysis=None):
+    """
+    Render an export PDF into a spooled temporary file
+
+    The analysis (if any) comes first as tables, then the text one
+    paragraph per line. Flowables are generated while the pages are laid
+    out (see FlowableStream); the PDF stays in memory up to
+    EXPORT_SPOOL_MAX_BYTES and is written to disk beyond that. Table rows
+    split between pages; if the layout still fails, the analysis is
+    rendered again without tables.
+
+    Args:
+        text (str): Document text
+        analysis (dict, optional): Analysis with the 12 categories
+
+    Returns:
+        file: Spooled file positioned at the start of the PDF (the caller closes it)
+
+    Raises:
+        ExportError: If the content cannot be laid out even without tables
+    """
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate
+    from reportlab.platypus.doctemplate import LayoutError
+    styles = export_styles()
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES, dir=UPLOAD_SPOOL_DIR)
+
+    def build(tables):
+        doc = SimpleDocTemplate(output)
+
+        def story():
+            if analysis:
+                yield from analysis_flowables(analysis, styles, doc.width, tables)
+                if not text:
+                    return
+                yield PageBreak()
+                yield Paragraph("Document Text", styles["Heading1"])
+            yield from text_flowables(text, styles)
+
+        output.seek(0)
+        output.truncate()
+        doc.build(FlowableStream(story()))
+
+    try:
+        try:
+            build(tables=True)
+        except LayoutError as e:
+            print(f"PDF export layout failed: {str(e)[:200]}")
+            if not analysis:
+                raise ExportError("The content does not fit on a PDF page") from e
+            try:
+                build(tables=False)
+            except LayoutError as e:
+                raise ExportError("The content does not fit on a PDF page, even without tables") from e
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def render_docx(text=""):
+    """
+    Render an export .docx (one paragraph per line of text) into a spooled temporary file
+
+    The document XML is written directly (see ooxml.write_docx) rather than
+    through python-docx objects.
+
+    Returns:
+        file: Spooled file positioned at the start of the .docx (the caller closes it)
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES, dir=UPLOAD_SPOOL_DIR)
+    try:
+        write_docx(text.split("\n"), output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
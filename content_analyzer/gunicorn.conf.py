@@ -0,0 +1,58 @@
+"""
+Gunicorn settings for the analyzer service
+
+Requests spend most of their time waiting on the model, so each worker
+serves many requests at once on threads (gthread workers) instead of one
+at a time: a thread blocked on a model call releases the GIL to the
+others. CPU-bound extraction of all but the smallest PDFs runs in the page
+extraction process pool (EXTRACT_OFFLOAD), so it does not hold the serving
+threads' GIL either.
+Workers x threads is the number of requests served concurrently.
+"""
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# Processes; each has its own model clients, caches and extraction pool
+# (the pools split the CPUs between the workers, see PDF_EXTRACT_WORKERS)
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "gthread"
+# Requests served concurrently per worker
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+# Idle keep-alive connections hold a thread, so keep them short
+keepalive = 5
+# Connections accepted beyond the busy threads wait in the listen queue
+backlog = 2048
+
+# Load the app in the master and fork the workers from it, with the heavy
+# dependencies imported (see app.preload_dependencies): workers start in
+# milliseconds and share those modules' memory copy-on-write. Off by default,
+# so a worker start does not pay for dependencies its routes may never use
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false").lower() == "true"
+
+# Defaults for the threaded workers (set in the environment to override):
+# send PDF extraction (of EXTRACT_OFFLOAD_MIN_PAGES pages or more) to the
+# process pool and allow one model call in flight per serving thread
+os.environ.setdefault("EXTRACT_OFFLOAD", "true")
+os.environ.setdefault("MODEL_MAX_IN_FLIGHT", str(threads))
+# /metrics sums the metrics every worker writes to METRICS_DIR; a fresh
+# directory per server run, so counters start from zero on each start
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="legalklarity-metrics-")
+
+
+def on_starting(server):
+    # A configured METRICS_DIR may hold the files of an earlier run
+    directory = os.environ["METRICS_DIR"]
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if name.endswith(".json"):
+            os.remove(os.path.join(directory, name))
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before workers are forked
+    if preload_app:
+        import app
+        server.log.info("Preloaded %s", ", ".join(app.preload_dependencies()))
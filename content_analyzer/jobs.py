@@ -0,0 +1,418 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+
+# Job configuration
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "sqlite")
+JOB_DIR = os.environ.get("JOB_DIR", "/tmp/legalklarity-jobs")
+# Worker threads per gunicorn worker; extraction itself fans out to the page pool
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+# Running jobs whose worker has not renewed their lease for this long are
+# assumed lost (e.g. the worker was killed) and requeued
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "900"))
+# Seconds between lease renewals of running jobs
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "0")) or JOB_STALE_SECONDS / 5
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+# While the queue stays empty the poll interval doubles up to this (submits in the same process wake it)
+JOB_IDLE_POLL_MAX = float(os.environ.get("JOB_IDLE_POLL_MAX", "5"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def new_job(filename, upload_path, document_type=None):
+    """
+    Build a queued job record
+
+    Returns:
+        dict: Job with a fresh id
+    """
+    return {
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "filename": filename,
+        "document_type": document_type,
+        "upload_path": upload_path,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        # Claim token: incremented on every claim, so a requeued job's first run can tell it lost the job
+        "attempt": 0,
+        "heartbeat_at": None
+    }
+
+
+class MemoryJobBackend:
+    """
+    Job queue and store private to one process
+
+    Suitable for ``python app.py`` or a single gunicorn worker; with several
+    workers a status poll can land on a worker that never saw the job.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+        self._queue.put(job["id"])
+
+    def claim(self, timeout):
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            now = time.time()
+            job.update(status=RUNNING, started_at=now, heartbeat_at=now, attempt=job["attempt"] + 1)
+            return dict(job)
+
+    def _owned(self, job_id, attempt):
+        job = self._jobs.get(job_id)
+        return job is not None and job["status"] == RUNNING and job["attempt"] == attempt
+
+    def renew(self, job_id, attempt):
+        with self._lock:
+            if not self._owned(job_id, attempt):
+                return False
+            self._jobs[job_id]["heartbeat_at"] = time.time()
+            return True
+
+    def finish(self, job_id, attempt, status, result=None, error=None):
+        with self._lock:
+            if not self._owned(job_id, attempt):
+                return False
+            self._jobs[job_id].update(status=status, result=result, error=error,
+                                      finished_at=time.time())
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def purge(self, older_than):
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job["status"] in (DONE, FAILED) and job["finished_at"] < older_than]
+            for job in expired:
+                del self._jobs[job["id"]]
+        return expired
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+class SqliteJobBackend:
+    """
+    Job queue and store in a SQLite file shared by every worker on the host
+
+    Any gunicorn worker can accept a submission, run it, or answer a status
+    poll. Claims happen inside an immediate transaction, so each job is
+    run once. The worker running a job renews its lease (``heartbeat_at``);
+    jobs whose lease is older than JOB_STALE_SECONDS (e.g. the worker was
+    killed) are claimed again. Each claim increments ``attempt``, and only
+    the latest attempt can renew or finish the job. Idle workers only
+    read: the write lock is taken once a job is waiting, and polls slow
+    down (up to JOB_IDLE_POLL_MAX) while the queue stays empty.
+    """
+
+    COLUMNS = ["id", "status", "filename", "document_type", "upload_path", "result",
+               "error", "created_at", "started_at", "finished_at", "attempt", "heartbeat_at"]
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT, filename TEXT, document_type TEXT, "
+                "upload_path TEXT, result TEXT, error TEXT, created_at REAL, "
+                "started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            # Queues created before leases existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "attempt" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempt INTEGER DEFAULT 0")
+            if "heartbeat_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        # Set on submit, so this process's idle workers claim the job without waiting for the next poll
+        self._submitted = threading.Event()
+
+    def _connect(self):
+        # One connection per call: sqlite3 connections must not cross threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def submit(self, job):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [job[c] for c in self.COLUMNS]
+            )
+        self._submitted.set()
+
+    def _next_job(self, conn, now):
+        return conn.execute(
+            "SELECT * FROM jobs WHERE status = ? OR (status = ? AND COALESCE(heartbeat_at, started_at) < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (QUEUED, RUNNING, now - JOB_STALE_SECONDS)
+        ).fetchone()
+
+    def _claim_next(self, now):
+        """
+        Mark the oldest claimable job running
+
+        Returns:
+            sqlite3.Row or None: The claimed job, or None if none is waiting
+        """
+        with closing(self._connect()) as conn:
+            # A plain read first: WAL readers take no lock, so an idle queue costs no write lock
+            if self._next_job(conn, now) is None:
+                return None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Read again under the lock: another worker may have claimed it meanwhile
+                row = self._next_job(conn, now)
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, "
+                                 "attempt = COALESCE(attempt, 0) + 1 WHERE id = ?",
+                                 (RUNNING, now, now, row["id"]))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                # Only roll back a transaction that is still open (a failed COMMIT may have ended it)
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            return row
+
+    def claim(self, timeout):
+        deadline = time.time() + timeout
+        interval = JOB_POLL_INTERVAL
+        while True:
+            now = time.time()
+            row = self._claim_next(now)
+            if row is not None:
+                job = self._to_job(row)
+                job.update(status=RUNNING, started_at=now, heartbeat_at=now, attempt=(job["attempt"] or 0) + 1)
+                return job
+            if now >= deadline:
+                return None
+            if self._submitted.wait(min(interval, max(0.0, deadline - now))):
+                self._submitted.clear()
+                interval = JOB_POLL_INTERVAL
+            else:
+                interval = min(interval * 2, max(JOB_POLL_INTERVAL, JOB_IDLE_POLL_MAX))
+
+    def renew(self, job_id, attempt):
+        """
+        Extend the lease of a running job
+
+        Returns:
+            bool: False if the job was requeued and claimed again meanwhile
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND attempt = ?",
+                (time.time(), job_id, RUNNING, attempt)
+            ).rowcount > 0
+
+    def finish(self, job_id, attempt, status, result=None, error=None):
+        """
+        Record the outcome of a job, if this attempt still owns it
+
+        Returns:
+            bool: False if a later attempt claimed the job meanwhile
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND status = ? AND attempt = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(),
+                 job_id, RUNNING, attempt)
+            ).rowcount > 0
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            return self._to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def purge(self, older_than):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, upload_path FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, older_than)
+            ).fetchall()
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, older_than)
+            )
+            return [dict(row) for row in rows]
+
+    def depth(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+
+# Queue backends selectable with JOB_BACKEND; register others here
+JOB_BACKENDS = {
+    "memory": lambda: MemoryJobBackend(),
+    "sqlite": lambda: SqliteJobBackend(os.path.join(JOB_DIR, "jobs.sqlite3")),
+}
+
+
+class JobRunner:
+    """
+    Local worker pool that runs queued jobs in background threads
+
+    Threads are started lazily in the process that first submits or needs
+    them, so they exist in every gunicorn worker rather than the master.
+    A heartbeat thread renews the leases of the jobs running in this
+    process every JOB_HEARTBEAT_SECONDS.
+
+    Args:
+        handler (callable): ``handler(job) -> result dict``, run for each job
+        backend: Queue backend instance (defaults to JOB_BACKEND)
+        workers (int): Number of worker threads
+    """
+
+    def __init__(self, handler, backend=None, workers=JOB_WORKERS):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self._backend = backend
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._running = 0
+        # Attempt of each job running in this process, for the heartbeat
+        self._leases = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    os.makedirs(JOB_DIR, exist_ok=True)
+                    self._backend = JOB_BACKENDS[JOB_BACKEND]()
+        return self._backend
+
+    def start(self):
+        """
+        Start the worker threads in this process if they are not running
+        """
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job):
+        """
+        Queue a job and make sure workers are running
+
+        Returns:
+            dict: The queued job
+        """
+        self.start()
+        self.purge()
+        self.backend.submit(job)
+        return job
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    def purge(self):
+        for job in self.backend.purge(time.time() - JOB_TTL_SECONDS):
+            remove_upload(job)
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "workers": self.workers,
+            "running": self._running,
+            "queued": self.backend.depth()
+        }
+
+    def _work(self):
+        while True:
+            try:
+                job = self.backend.claim(timeout=60)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+            if job is None:
+                continue
+            with self._lock:
+                self._running += 1
+                self._leases[job["id"]] = job["attempt"]
+            owned = False
+            try:
+                result = self.handler(job)
+                owned = self.backend.finish(job["id"], job["attempt"], DONE, result=result)
+            except Exception as e:
+                print(f"Job {job['id']} failed: {e}")
+                traceback.print_exc()
+                owned = self.backend.finish(job["id"], job["attempt"], FAILED, error=str(e))
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._leases.pop(job["id"], None)
+            # A later attempt of a requeued job still needs the upload
+            if owned:
+                remove_upload(job)
+            else:
+                print(f"Job {job['id']} was claimed again, discarding attempt {job['attempt']}")
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._lock:
+                leases = list(self._leases.items())
+            for job_id, attempt in leases:
+                try:
+                    if not self.backend.renew(job_id, attempt):
+                        print(f"Job {job_id} lease lost")
+                        with self._lock:
+                            if self._leases.get(job_id) == attempt:
+                                del self._leases[job_id]
+                except Exception as e:
+                    print(f"Job lease renewal failed: {e}")
+
+
+def remove_upload(job):
+    path = job.get("upload_path")
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,70 @@
+import json
+
+
+class ObjectMemberParser:
+    """
+    Incremental parser for a JSON object that arrives in pieces
+
+    ``feed`` returns the top-level members completed by each piece, so a
+    streamed model response can be shown key by key before it ends. Text
+    before the opening brace (e.g. a markdown code fence) is skipped. The
+    scan keeps its state between pieces, so the total work is linear in
+    the response length.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        Add the next piece of the response
+
+        Returns:
+            list: ``(key, value)`` pairs completed by this piece, in order
+        """
+        self.buffer += chunk
+        members = []
+        buffer, pos = self.buffer, self._pos
+        while pos < len(buffer) and not self.done:
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == "\"":
+                    self._in_string = False
+            elif self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._member_start = pos + 1
+            elif char == "\"":
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    members.extend(self._member(buffer[self._member_start:pos]))
+                    self.done = True
+            elif char == "," and self._depth == 1:
+                members.extend(self._member(buffer[self._member_start:pos]))
+                self._member_start = pos + 1
+            pos += 1
+        self._pos = pos
+        return members
+
+    def _member(self, text):
+        if not text.strip():
+            return []
+        try:
+            return list(json.loads("{" + text + "}").items())
+        except json.JSONDecodeError:
+            # Not valid JSON; the caller sees the error when parsing the full response
+            return []
@@ -0,0 +1,141 @@
+import re
+
+
+def _is_word_char(c):
+    # Same definition as \b in a str regex
+    return c.isalnum() or c == "_"
+
+
+def _boundary_at(text, pos):
+    before = pos > 0 and _is_word_char(text[pos - 1])
+    after = pos < len(text) and _is_word_char(text[pos])
+    return before != after
+
+
+def _trie_pattern(node):
+    """
+    Regex for a keyword trie, preferring longer keywords at each position
+
+    Children come before the node's own terminals, so backtracking returns
+    the longest keyword whose trailing condition holds.
+    """
+    alternatives = [re.escape(ch) + _trie_pattern(node[ch]) for ch in sorted(k for k in node if k)]
+    ends = node.get("", ())
+    if True in ends:
+        alternatives.append(r"\b")
+    if False in ends:
+        alternatives.append("")
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+class KeywordMatcher:
+    """
+    Find many keywords in one scan of the text
+
+    All keywords are compiled into a single trie-shaped regex, so the regex
+    engine makes one pass over the text instead of one pass per keyword.
+    Overlapping occurrences are still reported: after each hit the scan
+    resumes one character later, and shorter keywords that are prefixes of
+    the one matched at the same position are checked directly.
+
+    ``words`` only match as whole words, like
+    ``re.search(r"\\b" + re.escape(k) + r"\\b", text)``; ``substrings``
+    match like ``k in text``. Keywords and text are expected lowercase.
+    Hits are reported as ``(keyword, whole_word)`` entries, so the same
+    keyword can be registered in both modes.
+    """
+
+    def __init__(self, words=(), substrings=()):
+        self.entries = list(dict.fromkeys(
+            [(k, True) for k in words] + [(k, False) for k in substrings]
+        ))
+        trie = {}
+        for keyword, whole_word in self.entries:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node.setdefault("", set()).add(whole_word)
+        self._pattern = re.compile(_trie_pattern(trie))
+        # Entries that can match wherever a keyword matched, longest first
+        self._candidates = {}
+        for keyword, _ in self.entries:
+            self._candidates[keyword] = sorted(
+                (entry for entry in self.entries if keyword.startswith(entry[0])),
+                key=lambda entry: -len(entry[0])
+            )
+
+    def iter_hits(self, text, start=0, end=None):
+        """
+        Yield every keyword occurrence in ``text[start:end]``
+
+        Yields:
+            tuple: ``(position, (keyword, whole_word))``, positions in increasing order
+        """
+        end = len(text) if end is None else end
+        search = self._pattern.search
+        pos = start
+        while True:
+            match = search(text, pos, end)
+            if match is None:
+                return
+            hit = match.start()
+            pos = hit + 1
+            leading = None
+            for entry in self._candidates[match.group()]:
+                keyword, whole_word = entry
+                if whole_word:
+                    if leading is None:
+                        leading = _boundary_at(text, hit)
+                    # At the scan end the boundary is judged as re.search(text, pos, end) would
+                    stop = hit + len(keyword)
+                    if stop == end:
+                        trailing = _is_word_char(keyword[-1])
+                    else:
+                        trailing = _boundary_at(text, stop)
+                    if not (leading and trailing):
+                        continue
+                yield hit, entry
+
+    def found(self, text):
+        """
+        Entries present anywhere in the text
+
+        Returns:
+            set: Matched ``(keyword, whole_word)`` entries (the scan stops once all have been seen)
+        """
+        seen = set()
+        total = len(self.entries)
+        for _, entry in self.iter_hits(text):
+            seen.add(entry)
+            if len(seen) == total:
+                break
+        return seen
+
+    def found_in_spans(self, text, spans):
+        """
+        Entries present inside each ``(start, end)`` span, in a single scan
+
+        An entry counts for a span only if it lies entirely inside it, as
+        if each span had been matched as a separate string. Spans must be
+        sorted and separated by non-word characters.
+
+        Returns:
+            list: One set of entries per span
+        """
+        results = [set() for _ in spans]
+        if not spans:
+            return results
+        index = 0
+        span_start, span_end = spans[0]
+        for hit, entry in self.iter_hits(text, spans[0][0], spans[-1][1]):
+            while hit >= span_end:
+                index += 1
+                if index == len(spans):
+                    return results
+                span_start, span_end = spans[index]
+            if hit < span_start or hit + len(entry[0]) > span_end:
+                continue
+            results[index].add(entry)
+        return results
@@ -25,6 +25,7 @@ import textwrap
 from datetime import datetime
 import google.cloud.aiplatform as aiplatform
 from vertexai.generative_models import GenerativeModel, Part
+from passage_index import PassageIndex
 
 # Configuration (add to environment variables)
 GOOGLE_CLOUD_PROJECT = "your-google-cloud-project-id"  # Add to .env
@@ -227,6 +228,11 @@ def chat_about_document(text, question):
     """
     Interactive chat about the document
     
+    Only the passages most relevant to the question are sent to the model
+    (BM25 over clause/sentence passages, see passage_index.py), so the
+    whole document is reachable with a small prompt. In app.py the index
+    is built once on upload and cached by document hash.
+    
     Args:
         text (str): Document text
         question (str): User's question about the document
@@ -234,11 +240,12 @@ def chat_about_document(text, question):
     Returns:
         str: AI-generated answer
     """
+    excerpts = "\n\n".join(PassageIndex.build(text).context(question, k=6))
     prompt = f"""
-    Based on the following document, answer the question accurately and concisely.
+    Based on the following excerpts from a document, answer the question accurately and concisely.
     
-    Document:
-    {text[:10000]}  # Limit for context window
+    Excerpts:
+    {excerpts}
     
     Question: {question}
     
@@ -0,0 +1,180 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Headings that start a new section: numbered clauses, ARTICLE/SECTION/CLAUSE/SCHEDULE
+# headings and short all-caps title lines
+SECTION_HEADING = re.compile(
+    r"^[ \t]*(?:"
+    r"(?i:article|section|clause|schedule|annexure|appendix|exhibit)\b[^\n]{0,80}"
+    r"|\d{1,3}(?:\.\d{1,3})*[.)][ \t]+\S[^\n]{0,120}"
+    r"|[A-Z][A-Z0-9 ,&/'()-]{3,80}"
+    r")$",
+    re.MULTILINE
+)
+
+# How list fields are deduplicated when chunk analyses are merged
+LIST_FIELD_KEYS = {
+    "key_terms": ("term",),
+    "main_clauses": ("name",),
+    "critical_dates": ("date", "event"),
+    "parties": ("name",),
+    "obligations": ("party", "responsibility"),
+    "risks": ("risk",),
+    "missing_clauses": ("clause",),
+    "compliance_issues": ("issue",),
+}
+STRING_LIST_FIELDS = ["recommendations", "next_steps"]
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2}
+# With content-defined packing, about one section in this many can end a chunk
+BOUNDARY_SPACING = 3
+
+
+def split_sections(text):
+    """
+    Split a document into sections at clause headings
+
+    Returns:
+        list: Section texts in document order (text before the first heading is its own section)
+    """
+    starts = [m.start() for m in SECTION_HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts + [len(text)]
+    sections = [text[bounds[i]:bounds[i + 1]].strip() for i in range(len(starts))]
+    return [s for s in sections if s]
+
+
+def is_chunk_boundary(section):
+    digest = hashlib.sha1(" ".join(section.lower().split()).encode("utf-8")).digest()
+    return digest[0] % BOUNDARY_SPACING == 0
+
+
+def pack_sections(sections, max_words, split, min_words=None):
+    """
+    Greedily pack consecutive sections into chunks of at most max_words words
+
+    Sections longer than max_words are cut with ``split(section)``. With
+    min_words, chunk ends are chosen by content: once a chunk holds
+    min_words words it ends after the next section that is a boundary (see
+    is_chunk_boundary). An edit then only moves the chunk ends next to it,
+    so the unchanged parts of a revised document give identical chunks.
+
+    Returns:
+        list: Chunk texts in document order
+    """
+    chunks, current, current_words = [], [], 0
+    for section in sections:
+        words = len(section.split())
+        if words > max_words:
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_words = [], 0
+            chunks.extend(split(section))
+            continue
+        if current and current_words + words > max_words:
+            chunks.append("\n\n".join(current))
+            current, current_words = [], 0
+        current.append(section)
+        current_words += words
+        if min_words is not None and current_words >= min_words and is_chunk_boundary(section):
+            chunks.append("\n\n".join(current))
+            current, current_words = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def map_chunks(analyze_chunk, chunks, concurrency):
+    """
+    Analyze chunks concurrently
+
+    Args:
+        analyze_chunk (callable): ``analyze_chunk(chunk, index, total) -> dict``
+        chunks (list): Chunk texts
+        concurrency (int): Maximum number of chunks analyzed at once
+
+    Returns:
+        list: Chunk analyses in chunk order
+    """
+    total = len(chunks)
+    if total == 1 or concurrency <= 1:
+        return [analyze_chunk(chunk, i + 1, total) for i, chunk in enumerate(chunks)]
+    with ThreadPoolExecutor(max_workers=min(concurrency, total)) as pool:
+        return list(pool.map(lambda args: analyze_chunk(args[1], args[0] + 1, total), enumerate(chunks)))
+
+
+def _normalize(value):
+    return re.sub(r"[^a-z0-9]+", " ", str(value or "").lower()).strip()
+
+
+def _item_key(item, fields):
+    if isinstance(item, dict):
+        return tuple(_normalize(item.get(f)) for f in fields)
+    return (_normalize(item),)
+
+
+def merge_analyses(analyses, summary=None):
+    """
+    Merge per-chunk analyses into one analysis with the same 12-category schema
+
+    List fields are concatenated in document order and deduplicated on
+    their identifying fields; for duplicate risks the highest severity
+    wins. Missing clauses reported by one chunk but present as a main
+    clause in another are dropped. Chunks that failed are skipped.
+
+    Args:
+        analyses (list): Chunk analyses in document order
+        summary (str, optional): Document summary; defaults to the chunk summaries joined
+
+    Returns:
+        dict: Merged analysis
+    """
+    usable = [a for a in analyses if isinstance(a, dict) and "error" not in a]
+    merged = {}
+
+    for field, key_fields in LIST_FIELD_KEYS.items():
+        seen, items = {}, []
+        for analysis in usable:
+            for item in analysis.get(field) or []:
+                key = _item_key(item, key_fields)
+                if not any(key):
+                    continue
+                if key in seen:
+                    if field == "risks" and isinstance(item, dict):
+                        kept = items[seen[key]]
+                        if SEVERITY_RANK.get(str(item.get("severity", "")).lower(), -1) > \
+                                SEVERITY_RANK.get(str(kept.get("severity", "")).lower(), -1):
+                            items[seen[key]] = item
+                    continue
+                seen[key] = len(items)
+                items.append(item)
+        merged[field] = items
+
+    present = {_normalize(c.get("name")) for c in merged["main_clauses"] if isinstance(c, dict)}
+    merged["missing_clauses"] = [
+        c for c in merged["missing_clauses"]
+        if not (isinstance(c, dict) and any(_normalize(c.get("clause")) in name for name in present if name))
+    ]
+
+    for field in STRING_LIST_FIELDS:
+        seen, items = set(), []
+        for analysis in usable:
+            for item in analysis.get(field) or []:
+                key = _normalize(item)
+                if key and key not in seen:
+                    seen.add(key)
+                    items.append(item)
+        merged[field] = items
+
+    jurisdictions = [a.get("jurisdiction") for a in usable if a.get("jurisdiction")]
+    specific = [j for j in jurisdictions if not _normalize(j).startswith(("not ", "none", "n a", "unknown"))]
+    merged["jurisdiction"] = (specific or jurisdictions or ["Not specified"])[0]
+
+    if summary is None:
+        summary = " ".join(a.get("summary", "").strip() for a in usable if a.get("summary"))
+    merged["summary"] = summary
+
+    order = ["summary", "key_terms", "main_clauses", "critical_dates", "parties", "jurisdiction",
+             "obligations", "risks", "recommendations", "missing_clauses", "compliance_issues", "next_steps"]
+    return {field: merged[field] for field in order}
@@ -0,0 +1,388 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Aggregate per-stage timings into the histograms served on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+# Let clients ask for a Server-Timing header with the per-stage breakdown of
+# their request (timing=true query parameter or X-Server-Timing: true header)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "true").lower() != "false"
+# Directory shared by the worker processes: each writes its metrics there and
+# /metrics serves the sum over all of them (gunicorn.conf.py sets one per run)
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+# Seconds between writes of a worker's metrics to METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "1"))
+METRIC_PREFIX = "legalklarity_"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus data model, one series per label set
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS, on_change=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.on_change = on_change
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+        if self.on_change:
+            self.on_change()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [list(counts), count, total] for key, (counts, count, total) in self._series.items()}
+
+    @staticmethod
+    def combine(first, second):
+        return [[a + b for a, b in zip(first[0], second[0])], first[1] + second[1], first[2] + second[2]]
+
+    def render(self, series=None):
+        series = self.snapshot() if series is None else series
+        lines = []
+        for key, (counts, count, total) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", repr(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Counter:
+    """
+    Monotonic counter, one series per label set
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames, on_change=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.on_change = on_change
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+        if self.on_change:
+            self.on_change()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    @staticmethod
+    def combine(first, second):
+        return first + second
+
+    def render(self, series=None):
+        series = self.snapshot() if series is None else series
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(series.items())]
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down (queue depth, calls in flight), one series per label set
+
+    Across workers the values of the running workers are summed.
+    """
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._series[key] = value
+        if self.on_change:
+            self.on_change()
+
+
+def _process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in Prometheus text format
+
+    Without a directory these are the metrics of this worker process. With
+    one (see METRICS_DIR), every worker writes its series to <pid>.json there
+    at most every METRICS_FLUSH_SECONDS, and render serves the sum over all
+    files, like prometheus_client's multiprocess mode: counters and
+    histograms of exited workers still count, gauges only of running ones.
+    Another worker's updates show up within METRICS_FLUSH_SECONDS.
+    """
+
+    def __init__(self, prefix=METRIC_PREFIX, directory=METRICS_DIR):
+        self.prefix = prefix
+        self._metrics = []
+        self.directory = directory or None
+        self._flushed = 0.0
+        self._flush_lock = threading.Lock()
+        self._pending = None
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"Metrics directory unavailable, metrics kept per worker: {e}")
+                self.directory = None
+
+    def _add(self, metric):
+        if self.directory:
+            metric.on_change = self._changed
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        return self._add(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames):
+        return self._add(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(self.prefix + name, documentation, labelnames))
+
+    def _changed(self):
+        wait = self._flushed + METRICS_FLUSH_SECONDS - time.monotonic()
+        if wait <= 0:
+            self.flush()
+        elif self._pending is None:
+            # Write the latest updates once the interval is up, even if no more come
+            timer = threading.Timer(wait, self._flush_pending)
+            timer.daemon = True
+            self._pending = timer
+            timer.start()
+
+    def _flush_pending(self):
+        self._pending = None
+        self.flush()
+
+    def flush(self):
+        """
+        Write this worker's series to the metrics directory
+        """
+        # Another thread writing the same file already covers this update
+        if not self.directory or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._flushed = time.monotonic()
+            data = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                    for metric in self._metrics}
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Metrics write failed: {e}")
+        finally:
+            self._flush_lock.release()
+
+    def _collect(self):
+        # Series of every worker's file, summed per metric and label set
+        merged = {metric.name: {} for metric in self._metrics}
+        kinds = {metric.name: metric for metric in self._metrics}
+        for name in os.listdir(self.directory):
+            stem, extension = os.path.splitext(name)
+            if extension != ".json" or not stem.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            running = int(stem) == os.getpid() or _process_running(int(stem))
+            for metric_name, series in data.items():
+                metric = kinds.get(metric_name)
+                if metric is None or (metric.kind == "gauge" and not running):
+                    continue
+                target = merged[metric_name]
+                for key, value in series:
+                    key = tuple(key)
+                    target[key] = metric.combine(target[key], value) if key in target else value
+        return merged
+
+    def render(self):
+        merged = None
+        if self.directory:
+            self.flush()
+            try:
+                merged = self._collect()
+            except OSError as e:
+                print(f"Metrics directory unreadable, serving this worker's metrics: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(None if merged is None else merged[metric.name]))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+STAGE_SECONDS = registry.histogram(
+    "stage_duration_seconds", "Time spent in one pipeline stage",
+    ("operation", "stage", "document_type", "file_type")
+)
+OPERATION_SECONDS = registry.histogram(
+    "operation_duration_seconds", "End-to-end time of an instrumented operation",
+    ("operation", "document_type", "file_type", "outcome")
+)
+DOCUMENTS = registry.counter(
+    "documents_total", "Documents processed by outcome",
+    ("operation", "document_type", "file_type", "outcome")
+)
+
+
+class Trace:
+    """
+    Stage timings of one operation (e.g. one /enhanced_analysis request)
+
+    Stages are recorded as they finish; labels such as the document type
+    are only known part-way through, so histograms are updated once, when
+    the trace finishes.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.labels = {"document_type": "unknown", "file_type": "unknown", "outcome": "error"}
+        self.spans = []
+        self.started = time.perf_counter()
+        self.duration = None
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, time.perf_counter() - started))
+
+    def label(self, **labels):
+        self.labels.update({k: v for k, v in labels.items() if v})
+
+    def stage_totals(self):
+        """
+        Seconds per stage name, summed over repeated stages, in first-seen order
+        """
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self):
+        """
+        Server-Timing header value with each stage and the total, in milliseconds
+        """
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stage_totals().items()]
+        total = self.duration if self.duration is not None else time.perf_counter() - self.started
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        if not METRICS_ENABLED:
+            return
+        document_type, file_type = self.labels["document_type"], self.labels["file_type"]
+        for name, seconds in self.stage_totals().items():
+            STAGE_SECONDS.observe(seconds, operation=self.operation, stage=name,
+                                  document_type=document_type, file_type=file_type)
+        OPERATION_SECONDS.observe(self.duration, operation=self.operation, **self.labels)
+        DOCUMENTS.inc(operation=self.operation, **self.labels)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+@contextmanager
+def trace(operation, timing=False):
+    """
+    Record the stages of an operation run in this context
+
+    Args:
+        timing (bool): Whether the client asked for a Server-Timing header
+
+    Yields the Trace, or None when metrics are off and no Server-Timing
+    header is wanted, in which case ``stage`` and ``label`` do nothing.
+    """
+    if not (METRICS_ENABLED or (SERVER_TIMING and timing)):
+        yield None
+        return
+    current = Trace(operation)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.finish()
+
+
+def stage(name):
+    """
+    Context manager timing one stage of the current trace (no-op outside a trace)
+    """
+    current = _current_trace.get()
+    return NULL_STAGE if current is None else current.stage(name)
+
+
+def label(**labels):
+    """
+    Set labels (document_type, file_type, outcome) on the current trace
+    """
+    current = _current_trace.get()
+    if current is not None:
+        current.label(**labels)
+
+
+def render_metrics():
+    return registry.render()
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from mapreduce import split_sections
+from model_clients import vertex_model_factory
+
+# Model backend: "vertex" (Gemini on Vertex AI), "stub" (local deterministic
+# stand-in) or "replay" (responses recorded earlier with MODEL_RECORD_PATH)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "vertex")
+# Stub behaviour: mean latency, +/- jitter (milliseconds) and fraction of calls that fail
+MODEL_STUB_LATENCY_MS = float(os.environ.get("MODEL_STUB_LATENCY_MS", "800"))
+MODEL_STUB_JITTER_MS = float(os.environ.get("MODEL_STUB_JITTER_MS", "200"))
+MODEL_STUB_FAILURE_RATE = float(os.environ.get("MODEL_STUB_FAILURE_RATE", "0"))
+MODEL_STUB_SEED = os.environ.get("MODEL_STUB_SEED", "0")
+# Stub quota: calls per minute per process beyond which calls fail with a 429 (0: no quota)
+MODEL_STUB_QUOTA_RPM = float(os.environ.get("MODEL_STUB_QUOTA_RPM", "0"))
+# Replay: JSONL file of recorded responses; prompts not in it fail unless
+# MODEL_REPLAY_FALLBACK=stub
+MODEL_REPLAY_PATH = os.environ.get("MODEL_REPLAY_PATH", "")
+MODEL_REPLAY_FALLBACK = os.environ.get("MODEL_REPLAY_FALLBACK", "")
+# Append every prompt/response pair of the active backend to this JSONL file
+MODEL_RECORD_PATH = os.environ.get("MODEL_RECORD_PATH", "")
+
+STREAM_CHUNK_CHARS = 256
+TERM_PATTERN = re.compile(r"\b[A-Za-z][a-z]{5,}\b")
+DATE_PATTERN = re.compile(
+    r"\b(?:\d{4}-\d{2}-\d{2}|\d{1,2}(?:st|nd|rd|th)? (?:January|February|March|April|May|June|July|"
+    r"August|September|October|November|December),? \d{4})\b"
+)
+
+
+class ModelBackendError(Exception):
+    """
+    Raised by the stub and replay backends in place of a model API error
+    """
+
+
+class ModelRateLimitError(ModelBackendError):
+    """
+    Raised by the stub backend when its simulated quota is used up (like a 429 from the API)
+    """
+    code = 429
+
+
+class ModelResponse:
+    """
+    Minimal stand-in for a Vertex AI response: only ``text`` is used
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+def chunk_text_or_empty(chunk):
+    # Streamed chunks without text parts (e.g. the final safety chunk) raise on .text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()
+
+
+def stream_response(text):
+    for start in range(0, len(text), STREAM_CHUNK_CHARS):
+        yield ModelResponse(text[start:start + STREAM_CHUNK_CHARS])
+
+
+def _document_text(prompt):
+    marker = prompt.rfind("Document Text:")
+    return prompt[marker + len("Document Text:"):] if marker != -1 else prompt
+
+
+def stub_analysis(text, digest):
+    """
+    Deterministic analysis in the 12-category schema, derived from the text
+
+    Sizes are in line with real model output, so serialization, caching
+    and merging are exercised realistically.
+    """
+    counts = Counter(w.lower() for w in TERM_PATTERN.findall(text))
+    terms = [w for w, _ in counts.most_common(6)]
+    headings = [s.splitlines()[0].strip()[:80] for s in split_sections(text)][:8]
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", " ".join(text.split())) if s.strip()]
+    severity = ["low", "medium", "high"][int(digest[:2], 16) % 3]
+    return {
+        "summary": " ".join(sentences[:2])[:400] or "Empty document.",
+        "key_terms": [{"term": t.title(), "definition": f"Used {counts[t]} times in the document"} for t in terms],
+        "main_clauses": [{"name": h, "description": f"Covers {h.lower()}"} for h in headings],
+        "critical_dates": [{"date": d, "event": "Date referenced in the document"}
+                           for d in dict.fromkeys(DATE_PATTERN.findall(text))][:5],
+        "parties": [{"name": "First Party", "role": "Party to the agreement"},
+                    {"name": "Second Party", "role": "Counterparty"}],
+        "jurisdiction": "Not specified",
+        "obligations": [{"party": "First Party", "responsibility": f"Comply with the {t} terms"} for t in terms[:3]],
+        "risks": [{"risk": f"Ambiguous {terms[0] if terms else 'terms'}", "severity": severity,
+                   "description": "Stub risk derived from the most frequent term"}],
+        "recommendations": ["Have a legal professional review this document"],
+        "missing_clauses": [{"clause": "Force majeure", "importance": "Covers events outside either party's control"}],
+        "compliance_issues": [],
+        "next_steps": ["Review document with legal counsel"]
+    }
+
+
+class StubModel:
+    """
+    Local stand-in for Gemini with configurable latency, jitter and failures
+
+    Analysis prompts get a deterministic JSON analysis of the document
+    text; other prompts (summaries, chat) get a short deterministic answer.
+    Lets the whole pipeline run and be load-tested offline without quota.
+
+    Args:
+        name (str): Model name (reported only)
+        latency_ms (float): Mean simulated call latency
+        jitter_ms (float): Latency varies uniformly by up to this much either way
+        failure_rate (float): Fraction of calls that raise ModelBackendError
+        seed: Seed for the latency/failure random sequence
+        quota_rpm (float): Calls per minute before calls raise ModelRateLimitError (0: no quota)
+    """
+
+    def __init__(self, name, latency_ms=None, jitter_ms=None, failure_rate=None, seed=None, quota_rpm=None):
+        self.name = name
+        self.latency_ms = MODEL_STUB_LATENCY_MS if latency_ms is None else latency_ms
+        self.jitter_ms = MODEL_STUB_JITTER_MS if jitter_ms is None else jitter_ms
+        self.failure_rate = MODEL_STUB_FAILURE_RATE if failure_rate is None else failure_rate
+        self._random = random.Random(f"{MODEL_STUB_SEED if seed is None else seed}:{name}")
+        self.quota_rpm = MODEL_STUB_QUOTA_RPM if quota_rpm is None else quota_rpm
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _within_quota(self):
+        # Sliding one-minute window of accepted calls (call with the lock held)
+        if not self.quota_rpm:
+            return True
+        now = time.monotonic()
+        while self._calls and now - self._calls[0] >= 60:
+            self._calls.popleft()
+        if len(self._calls) >= self.quota_rpm:
+            return False
+        self._calls.append(now)
+        return True
+
+    def respond(self, prompt):
+        digest = prompt_key(prompt)
+        if "Return ONLY valid JSON" in prompt:
+            return json.dumps(stub_analysis(_document_text(prompt), digest))
+        if "summaries of consecutive parts" in prompt:
+            return "Stub overview of the whole document, merged from its part summaries."
+        return f"Stub answer {digest[:8]} based on the provided excerpts."
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            fail = self._random.random() < self.failure_rate
+            within_quota = self._within_quota()
+        if not within_quota:
+            raise ModelRateLimitError("429 Resource exhausted: simulated quota (stub backend)")
+        if stream:
+            # Like a real streaming call: a short wait for the first chunk, the rest spread out
+            return self._stream(prompt, delay, fail)
+        time.sleep(delay)
+        if fail:
+            raise ModelBackendError("Simulated model failure (stub backend)")
+        return ModelResponse(self.respond(str(prompt)))
+
+    def _stream(self, prompt, delay, fail):
+        time.sleep(delay * 0.1)
+        if fail:
+            raise ModelBackendError("Simulated model failure (stub backend)")
+        chunks = list(stream_response(self.respond(str(prompt))))
+        for chunk in chunks:
+            yield chunk
+            time.sleep(delay * 0.9 / len(chunks))
+
+
+class ReplayModel:
+    """
+    Serves responses recorded by RecordingModel, matched on the exact prompt
+
+    Args:
+        name (str): Model name; records for other models are ignored
+        path (str): JSONL file written with MODEL_RECORD_PATH
+        fallback: Model used for prompts that were never recorded (None to fail)
+    """
+
+    def __init__(self, name, path=None, fallback=None):
+        self.name = name
+        self.path = path or MODEL_REPLAY_PATH
+        self.fallback = fallback
+        self.responses = {}
+        self.misses = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("model", name) == name:
+                    self.responses[record["prompt_sha256"]] = record["text"]
+        print(f"Replay backend loaded {len(self.responses)} responses from {self.path}")
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        text = self.responses.get(prompt_key(prompt))
+        if text is None:
+            self.misses += 1
+            if self.fallback is None:
+                raise ModelBackendError("No recorded response for this prompt (replay backend)")
+            return self.fallback.generate_content(prompt, generation_config=generation_config,
+                                                  stream=stream, **kwargs)
+        return stream_response(text) if stream else ModelResponse(text)
+
+
+class RecordingModel:
+    """
+    Wraps a model and appends each prompt's response to a JSONL file for replay
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, name, model, path=None):
+        self.name = name
+        self.model = model
+        self.path = path or MODEL_RECORD_PATH
+
+    def _record(self, prompt, text):
+        line = json.dumps({"model": self.name, "prompt_sha256": prompt_key(prompt), "text": text})
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        response = self.model.generate_content(prompt, generation_config=generation_config,
+                                               stream=stream, **kwargs)
+        if not stream:
+            self._record(prompt, response.text)
+            return response
+        return self._record_stream(prompt, response)
+
+    def _record_stream(self, prompt, chunks):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk_text_or_empty(chunk))
+            yield chunk
+        self._record(prompt, "".join(parts))
+
+
+def _replay_model(name, **options):
+    fallback = StubModel(name) if MODEL_REPLAY_FALLBACK == "stub" else None
+    return ReplayModel(name, fallback=fallback)
+
+
+# Backends selectable with MODEL_BACKEND; register others here
+MODEL_BACKENDS = {
+    "vertex": vertex_model_factory,
+    "stub": lambda name, **options: StubModel(name),
+    "replay": _replay_model,
+}
+
+
+def create_model(name, **options):
+    """
+    Model factory for ModelRegistry using the MODEL_BACKEND backend
+
+    Returns:
+        Model object with a Vertex-compatible ``generate_content``
+    """
+    model = MODEL_BACKENDS[MODEL_BACKEND](name, **options)
+    if MODEL_RECORD_PATH:
+        model = RecordingModel(name, model)
+    return model
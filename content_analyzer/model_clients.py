@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from importlib.util import find_spec
+
+from model_scheduler import call_key
+
+# Latency samples kept per client for percentiles
+LATENCY_WINDOW = 256
+# Google Cloud configuration for Vertex AI, which is initialized on first use
+GOOGLE_CLOUD_PROJECT = os.environ.get("GOOGLE_CLOUD_PROJECT", "your-google-cloud-project-id")
+GOOGLE_CLOUD_LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
+# Whether the Vertex AI SDK is installed (checked without importing it, which takes seconds)
+VERTEX_AI_INSTALLED = find_spec("vertexai") is not None
+
+_vertex_ready = None
+_vertex_lock = threading.Lock()
+
+
+def init_vertex():
+    """
+    Import and initialize Vertex AI, once per process, when a model first needs it
+
+    Deferring this keeps the SDK import and credential lookup out of
+    start-up, and out of the gunicorn master when the app is preloaded.
+
+    Returns:
+        bool: Whether Vertex AI is ready (False if it is not installed or failed to initialize)
+    """
+    global _vertex_ready
+    with _vertex_lock:
+        if _vertex_ready is None:
+            _vertex_ready = False
+            if not VERTEX_AI_INSTALLED:
+                print("Vertex AI not available - using fallback analysis")
+                return False
+            try:
+                import google.cloud.aiplatform as aiplatform
+                aiplatform.init(project=GOOGLE_CLOUD_PROJECT, location=GOOGLE_CLOUD_LOCATION)
+                _vertex_ready = True
+                print("Vertex AI initialized successfully")
+            except Exception as e:
+                print(f"Vertex AI initialization failed: {e}")
+        return _vertex_ready
+
+
+def vertex_model_factory(name, **options):
+    """
+    Create a Vertex AI GenerativeModel
+
+    The model owns its prediction client, so reusing one model object keeps
+    its transport (and the connections behind it) warm across requests.
+    """
+    init_vertex()
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(name, **options)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ModelClient:
+    """
+    A model instance shared by every request in the worker, with call statistics
+
+    Exposes the same ``generate_content`` call as the wrapped model.
+    Streaming calls count as in flight until the stream is exhausted. With
+    a scheduler, calls go through its limits, retries and coalescing (see
+    model_scheduler.ModelScheduler).
+    """
+
+    def __init__(self, name, model, options=None, scheduler=None):
+        self.name = name
+        self.model = model
+        self.options = options or {}
+        self.scheduler = scheduler
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+
+    def _begin(self):
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        return time.perf_counter()
+
+    def _end(self, started, failed):
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies.append(time.perf_counter() - started)
+            if failed:
+                self._errors += 1
+
+    def generate_content(self, *args, **kwargs):
+        if self.scheduler is None:
+            return self._generate(*args, **kwargs)
+        if kwargs.get("stream"):
+            return self.scheduler.stream(lambda: self._generate(*args, **kwargs))
+        key = call_key(self.name, args, kwargs)
+        return self.scheduler.call(lambda: self._generate(*args, **kwargs), key)
+
+    def _generate(self, *args, **kwargs):
+        started = self._begin()
+        try:
+            response = self.model.generate_content(*args, **kwargs)
+        except BaseException:
+            self._end(started, True)
+            raise
+        if kwargs.get("stream"):
+            return self._track_stream(response, started)
+        self._end(started, False)
+        return response
+
+    def _track_stream(self, chunks, started):
+        failed = True
+        try:
+            for chunk in chunks:
+                yield chunk
+            failed = False
+        finally:
+            self._end(started, failed)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "model": self.name,
+                "options": sorted(self.options),
+                "requests": self._requests,
+                "errors": self._errors,
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+            }
+        stats.update({
+            "latency_avg_ms": round(1000 * sum(latencies) / len(latencies), 1) if latencies else 0.0,
+            "latency_p50_ms": round(1000 * _percentile(latencies, 0.5), 1),
+            "latency_p95_ms": round(1000 * _percentile(latencies, 0.95), 1),
+        })
+        return stats
+
+
+_registries = weakref.WeakSet()
+
+
+class ModelRegistry:
+    """
+    Process-wide registry that creates each model client once per worker
+
+    Clients are keyed by model name and options, so several models or
+    configurations can be used side by side. The registry empties itself
+    in a forked child (and whenever the pid changes), so gunicorn workers
+    never share a client - or its connections - with the master.
+
+    Args:
+        factory (callable): ``factory(name, **options) -> model``; pass a fake for tests
+        scheduler (ModelScheduler, optional): Limits shared by every client's calls
+    """
+
+    def __init__(self, factory=vertex_model_factory, scheduler=None):
+        self.factory = factory
+        self.scheduler = scheduler
+        self._clients = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        _registries.add(self)
+
+    def get(self, name, **options):
+        """
+        Client for a model name and options, created on first use
+
+        Returns:
+            ModelClient: Shared client
+        """
+        key = (name, tuple(sorted((k, repr(v)) for k, v in options.items())))
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clients.clear()
+                self._pid = os.getpid()
+            client = self._clients.get(key)
+            if client is None:
+                client = ModelClient(name, self.factory(name, **options), options, self.scheduler)
+                self._clients[key] = client
+            return client
+
+    def reset(self):
+        """
+        Drop every client (they are re-created on next use)
+        """
+        with self._lock:
+            self._clients.clear()
+            self._pid = os.getpid()
+
+    def stats(self):
+        with self._lock:
+            clients = list(self._clients.values())
+        stats = {"pid": self._pid, "clients": [client.stats() for client in clients]}
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+
+def _reset_after_fork():
+    for registry in list(_registries):
+        registry._clients.clear()
+        registry._pid = os.getpid()
+        registry._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,460 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import weakref
+
+from metrics import registry, stage
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): limits that span worker processes are off
+    fcntl = None
+
+# In-flight model calls per worker process; calls beyond it queue
+# (gunicorn.conf.py sets it to the worker's thread count)
+MODEL_MAX_IN_FLIGHT = int(os.environ.get("MODEL_MAX_IN_FLIGHT", "8"))
+# In-flight model calls across all workers of this host (0: no limit)
+MODEL_GLOBAL_MAX_IN_FLIGHT = int(os.environ.get("MODEL_GLOBAL_MAX_IN_FLIGHT", "0"))
+# Model calls per minute across all workers of this host (0: no limit) and
+# the burst allowed on top; the rate halves on each rate-limit error and
+# recovers by MODEL_RATE_RECOVERY per minute-rate unit on each success
+MODEL_RATE_LIMIT_RPM = float(os.environ.get("MODEL_RATE_LIMIT_RPM", "0"))
+MODEL_RATE_BURST = float(os.environ.get("MODEL_RATE_BURST", "5"))
+MODEL_RATE_MIN_RPM = float(os.environ.get("MODEL_RATE_MIN_RPM", "6"))
+MODEL_RATE_RECOVERY = float(os.environ.get("MODEL_RATE_RECOVERY", "0.05"))
+# Where workers share the token bucket and global in-flight slots
+MODEL_SCHEDULER_DIR = os.environ.get("MODEL_SCHEDULER_DIR") or os.path.join(
+    tempfile.gettempdir(), "legalklarity-model-scheduler")
+# Retries of rate-limited calls, with full-jitter exponential backoff
+MODEL_MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", "4"))
+MODEL_RETRY_BASE_MS = float(os.environ.get("MODEL_RETRY_BASE_MS", "500"))
+MODEL_RETRY_MAX_MS = float(os.environ.get("MODEL_RETRY_MAX_MS", "20000"))
+# Longest a call waits for a slot or a token before failing
+MODEL_QUEUE_TIMEOUT_S = float(os.environ.get("MODEL_QUEUE_TIMEOUT_S", "300"))
+# Identical prompts in flight at the same time share one model call
+MODEL_COALESCE = os.environ.get("MODEL_COALESCE", "true").lower() != "false"
+
+# Poll interval while waiting for a global slot
+SLOT_POLL_S = 0.02
+# Rate-limit errors are recognized by status code (HTTP 429, gRPC RESOURCE_EXHAUSTED) and
+# exception type; messages only for the exact status texts, since "quota" or "429" can
+# appear in unrelated errors (e.g. a 400 about a quota project, a request id)
+RATE_LIMIT_CODES = {429, "429", "RESOURCE_EXHAUSTED"}
+RATE_LIMIT_NAMES = {"ResourceExhausted", "TooManyRequests"}
+RATE_LIMIT_MESSAGES = ("RESOURCE_EXHAUSTED", "429 Too Many Requests")
+
+MODEL_CALLS_QUEUED = registry.gauge("model_calls_queued", "Model calls waiting for a slot or rate-limit token")
+MODEL_CALLS_IN_FLIGHT = registry.gauge("model_calls_in_flight", "Model calls running")
+MODEL_CALL_EVENTS = registry.counter(
+    "model_call_events_total", "Model calls coalesced, rate limited, retried or timed out in the queue", ("event",)
+)
+# Scheduler counters exported as events, and gauges kept in step with their counter
+EVENT_COUNTERS = {"coalesced", "rate_limited", "retries", "timeouts"}
+GAUGES = {"queued": MODEL_CALLS_QUEUED, "in_flight": MODEL_CALLS_IN_FLIGHT}
+
+
+class ModelQueueTimeout(Exception):
+    """
+    Raised when a model call waits longer than MODEL_QUEUE_TIMEOUT_S for a slot or token
+    """
+
+
+def is_rate_limit_error(error):
+    """
+    Whether a model call failed on quota or rate limits (HTTP 429 / RESOURCE_EXHAUSTED)
+    """
+    for code in (getattr(error, "code", None), getattr(error, "grpc_status_code", None)):
+        if callable(code):
+            # grpc.RpcError.code()
+            try:
+                code = code()
+            except Exception:
+                continue
+        # HTTPStatus and grpc.StatusCode members carry the code in .value / .name
+        if code in RATE_LIMIT_CODES or getattr(code, "value", None) in RATE_LIMIT_CODES \
+                or getattr(code, "name", None) in RATE_LIMIT_CODES:
+            return True
+    if type(error).__name__ in RATE_LIMIT_NAMES:
+        return True
+    message = str(error)
+    return any(text in message for text in RATE_LIMIT_MESSAGES)
+
+
+def backoff_delay(attempt, base_ms=MODEL_RETRY_BASE_MS, max_ms=MODEL_RETRY_MAX_MS):
+    """
+    Full-jitter exponential backoff: uniform over [0, min(max, base * 2^attempt)] seconds
+    """
+    return random.uniform(0, min(max_ms, base_ms * 2 ** attempt)) / 1000
+
+
+def call_key(name, args, kwargs):
+    """
+    Key under which identical model calls are coalesced
+    """
+    payload = json.dumps([name, [str(a) for a in args], {k: repr(v) for k, v in sorted(kwargs.items())}])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _LockedFile:
+    # An exclusive flock on a file, held for a with block
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, "a+")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self.file
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        return False
+
+
+class SharedTokenBucket:
+    """
+    Token bucket shared by the worker processes of one host through a locked state file
+
+    The state (tokens, refill time, current rate) lives in a small JSON
+    file; each take or adjustment holds an exclusive flock for the read
+    and rewrite, a few microseconds. The rate is adaptive: a rate-limit
+    error halves it (down to min_rpm) and empties the bucket, and each
+    successful call raises it again by recovery * configured rate, up to
+    the configured rate.
+    """
+
+    def __init__(self, rate_per_minute, burst, path, min_rpm=MODEL_RATE_MIN_RPM, recovery=MODEL_RATE_RECOVERY):
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(1.0, burst)
+        self.path = path
+        self.min_rpm = min(min_rpm, rate_per_minute)
+        self.recovery = recovery
+
+    def _update(self, change):
+        # Apply change(state, now) to the refilled state under the file lock
+        with _LockedFile(self.path) as f:
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            now = time.time()
+            rate = min(self.rate_per_minute, state.get("rate", self.rate_per_minute))
+            elapsed = max(0.0, now - state.get("updated", now))
+            state = {"rate": rate, "updated": now,
+                     "tokens": min(self.burst, state.get("tokens", self.burst) + elapsed * rate / 60)}
+            result = change(state)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            return result
+
+    def try_take(self):
+        """
+        Take a token if one is available
+
+        Returns:
+            float: 0 if a token was taken, else the seconds until one will be
+        """
+        def take(state):
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return 0.0
+            return (1 - state["tokens"]) * 60 / state["rate"]
+        return self._update(take)
+
+    def penalize(self):
+        def halve(state):
+            state["rate"] = max(self.min_rpm, state["rate"] / 2)
+            state["tokens"] = 0.0
+        self._update(halve)
+
+    def reward(self):
+        def recover(state):
+            state["rate"] = min(self.rate_per_minute, state["rate"] + self.recovery * self.rate_per_minute)
+        self._update(recover)
+
+    def current_rate(self):
+        return round(self._update(lambda state: state["rate"]), 2)
+
+
+class GlobalSlots:
+    """
+    At most `size` holders across the worker processes of one host
+
+    Each slot is a file; holding an exclusive non-blocking flock on it
+    holds the slot. The kernel releases the lock if a worker dies, so
+    slots cannot leak.
+    """
+
+    def __init__(self, size, directory):
+        self.size = size
+        self.directory = directory
+
+    def try_acquire(self):
+        """
+        Returns:
+            file or None: The locked slot file (pass it to release), or None if all are taken
+        """
+        for i in range(self.size):
+            f = open(os.path.join(self.directory, f"slot-{i}"), "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    @staticmethod
+    def release(slot):
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+
+class _PendingCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_schedulers = weakref.WeakSet()
+
+
+class ModelScheduler:
+    """
+    Admission control for model calls: concurrency caps, rate limit, coalescing and retries
+
+    Each call waits, in order, for a slot of this worker (max_in_flight),
+    a host-wide slot (global_max_in_flight, file locks) and a token of
+    the host-wide bucket (rate_per_minute). While an identical call is in
+    flight, a new one waits for its result instead of calling the model
+    again. Rate-limit errors are retried with jittered exponential backoff,
+    releasing the slots while waiting, and slow the shared bucket down.
+    """
+
+    def __init__(self, max_in_flight=MODEL_MAX_IN_FLIGHT, global_max_in_flight=MODEL_GLOBAL_MAX_IN_FLIGHT,
+                 rate_per_minute=MODEL_RATE_LIMIT_RPM, burst=MODEL_RATE_BURST, directory=MODEL_SCHEDULER_DIR,
+                 max_retries=MODEL_MAX_RETRIES, queue_timeout=MODEL_QUEUE_TIMEOUT_S, coalesce=MODEL_COALESCE):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max(0, max_retries)
+        self.queue_timeout = queue_timeout
+        self.coalesce = coalesce
+        self.global_slots = self.bucket = None
+        if fcntl is not None and (global_max_in_flight > 0 or rate_per_minute > 0):
+            os.makedirs(directory, exist_ok=True)
+            if global_max_in_flight > 0:
+                self.global_slots = GlobalSlots(global_max_in_flight, directory)
+            if rate_per_minute > 0:
+                self.bucket = SharedTokenBucket(rate_per_minute, burst, os.path.join(directory, "bucket.json"))
+        self._reset()
+        _schedulers.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._pending = {}
+        self._stats = {"calls": 0, "queued": 0, "in_flight": 0, "max_queued": 0, "coalesced": 0,
+                       "rate_limited": 0, "retries": 0, "timeouts": 0}
+        for gauge in GAUGES.values():
+            gauge.set(0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+            if name == "queued":
+                self._stats["max_queued"] = max(self._stats["max_queued"], self._stats["queued"])
+            if name in GAUGES:
+                GAUGES[name].set(self._stats[name])
+        if name in EVENT_COUNTERS:
+            MODEL_CALL_EVENTS.inc(amount, event=name)
+
+    def _acquire(self, deadline):
+        # Wait for a worker slot, a global slot and a token; returns the global slot (or None)
+        self._count("queued")
+        try:
+            with stage("model_queue"):
+                if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    raise ModelQueueTimeout("Timed out waiting for a model call slot")
+                try:
+                    slot = self._wait_global_slot(deadline)
+                    try:
+                        self._wait_token(deadline)
+                    except BaseException:
+                        if slot is not None:
+                            GlobalSlots.release(slot)
+                        raise
+                except BaseException:
+                    self._slots.release()
+                    raise
+        except ModelQueueTimeout:
+            self._count("timeouts")
+            raise
+        finally:
+            self._count("queued", -1)
+        self._count("in_flight")
+        return slot
+
+    def _wait_global_slot(self, deadline):
+        if self.global_slots is None:
+            return None
+        while True:
+            slot = self.global_slots.try_acquire()
+            if slot is not None:
+                return slot
+            if time.monotonic() >= deadline:
+                raise ModelQueueTimeout("Timed out waiting for a global model call slot")
+            time.sleep(SLOT_POLL_S * random.uniform(0.5, 1.5))
+
+    def _wait_token(self, deadline):
+        if self.bucket is None:
+            return
+        while True:
+            wait = self.bucket.try_take()
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise ModelQueueTimeout("Timed out waiting for the model rate limit")
+            # Jitter so waiting workers do not all retry at the same instant
+            time.sleep(wait * random.uniform(1.0, 1.2))
+
+    def _release(self, slot):
+        if slot is not None:
+            GlobalSlots.release(slot)
+        self._slots.release()
+        self._count("in_flight", -1)
+
+    def _succeeded(self):
+        if self.bucket is not None:
+            self.bucket.reward()
+
+    def _rate_limited(self, error, attempt):
+        # Whether to retry a failed attempt (after backing off)
+        if not is_rate_limit_error(error):
+            return False
+        self._count("rate_limited")
+        if self.bucket is not None:
+            self.bucket.penalize()
+        if attempt >= self.max_retries:
+            return False
+        self._count("retries")
+        delay = backoff_delay(attempt)
+        print(f"Model call rate limited, retrying in {delay:.2f}s ({attempt + 1}/{self.max_retries})")
+        time.sleep(delay)
+        return True
+
+    def call(self, fn, key=None):
+        """
+        Run a model call under the limits, coalescing it with an identical call in flight
+
+        Args:
+            fn (callable): Makes the call and returns its response
+            key (str, optional): Calls with the same key share one response (see call_key)
+
+        Returns:
+            The response of fn
+        """
+        if key is None or not self.coalesce:
+            return self._call(fn)
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _PendingCall()
+        if not leader:
+            self._count("coalesced")
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+        try:
+            pending.result = self._call(fn)
+            return pending.result
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.done.set()
+
+    def _call(self, fn):
+        self._count("calls")
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            slot = self._acquire(deadline)
+            try:
+                result = fn()
+            except Exception as e:
+                self._release(slot)
+                if self._rate_limited(e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            self._release(slot)
+            self._succeeded()
+            return result
+
+    def stream(self, fn):
+        """
+        Run a streaming model call under the limits
+
+        The slots are held until the stream is exhausted. A rate-limit
+        error before the first chunk is retried like in call; later errors
+        are raised to the reader. Streams are not coalesced.
+
+        Yields:
+            The chunks of the iterator fn returns
+        """
+        self._count("calls")
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            slot = self._acquire(deadline)
+            try:
+                chunks = iter(fn())
+                first = next(chunks, None)
+            except Exception as e:
+                self._release(slot)
+                if self._rate_limited(e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            break
+        try:
+            if first is not None:
+                yield first
+                yield from chunks
+            self._succeeded()
+        finally:
+            self._release(slot)
+
+    def stats(self):
+        """
+        Queue depth, in-flight calls and retry counters of this worker
+
+        Returns:
+            dict: Counters and limits (rate_per_minute is the bucket's current adaptive rate)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_in_flight"] = self.max_in_flight
+        stats["global_max_in_flight"] = self.global_slots.size if self.global_slots else 0
+        stats["rate_per_minute"] = self.bucket.current_rate() if self.bucket else 0
+        return stats
+
+
+def _reset_after_fork():
+    for scheduler in list(_schedulers):
+        scheduler._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,143 @@
+import os
+import threading
+from importlib.util import find_spec
+
+# Optional in-process tesseract binding; without it every page spawns a tesseract process.
+# Both bindings are imported on first OCR, not at start-up
+TESSEROCR_AVAILABLE = find_spec("tesserocr") is not None
+
+# OCR engine: "auto" (tesserocr when installed, else pytesseract), "tesserocr" or "pytesseract"
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto")
+# Directory with the *.traineddata files, if tesserocr cannot find them itself
+TESSDATA_PREFIX = os.environ.get("TESSDATA_PREFIX", "")
+# Tesseract language(s) used for every page, e.g. "eng+hin"
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+class PytesseractEngine:
+    """
+    Runs the tesseract command once per image (the original OCR path)
+
+    Each call writes the image to a temporary PNG and starts a tesseract
+    process, which loads the language model again.
+    """
+
+    name = "pytesseract"
+
+    def recognize(self, image, lang=None, psm=None, dpi=None, variables=None):
+        """
+        OCR one image
+
+        Args:
+            image (Image): PIL image
+            lang (str, optional): Tesseract language (default: tesseract's)
+            psm (int, optional): Page segmentation mode (default: tesseract's)
+            dpi (float, optional): Resolution of the image, if known
+            variables (dict, optional): Tesseract variables to set
+
+        Returns:
+            str: Recognized text
+        """
+        config = []
+        if psm is not None:
+            config.append(f"--psm {psm}")
+        if dpi:
+            config.append(f"--dpi {int(dpi)}")
+        config.extend(f"-c {key}={value}" for key, value in (variables or {}).items())
+        options = {"lang": lang} if lang else {}
+        import pytesseract
+        return pytesseract.image_to_string(image, config=" ".join(config), **options)
+
+
+class TesserocrEngine:
+    """
+    Keeps tesseract loaded in this process and passes images to it in memory
+
+    A tesseract API handle is not thread-safe, so a call takes an idle
+    handle (or creates one) and returns it afterwards. Handles are reused
+    for every later page, so each page pool worker loads the language model
+    once for its lifetime instead of once per page, and short-lived request
+    threads share the handles of the ones before them.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, lang):
+        with self._lock:
+            idle = self._idle.get(lang)
+            if idle:
+                return idle.pop()
+        options = {"path": TESSDATA_PREFIX} if TESSDATA_PREFIX else {}
+        import tesserocr
+        return tesserocr.PyTessBaseAPI(lang=lang, **options)
+
+    def _release(self, lang, api):
+        with self._lock:
+            self._idle.setdefault(lang, []).append(api)
+
+    def recognize(self, image, lang=None, psm=None, dpi=None, variables=None):
+        """
+        OCR one image (same arguments as PytesseractEngine.recognize)
+        """
+        import tesserocr
+        lang = lang or "eng"
+        api = self._acquire(lang)
+        try:
+            # Settings persist on the handle: set them all, and put variables back afterwards
+            api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else psm)
+            api.SetVariable("user_defined_dpi", str(int(dpi)) if dpi else "0")
+            previous = {key: api.GetVariableAsString(key) for key in (variables or {})}
+            for key, value in (variables or {}).items():
+                api.SetVariable(key, str(value))
+            try:
+                api.SetImage(image)
+                return api.GetUTF8Text()
+            finally:
+                api.Clear()
+                for key, value in previous.items():
+                    if value is not None:
+                        api.SetVariable(key, value)
+        finally:
+            self._release(lang, api)
+
+
+def create_engine(name=None):
+    """
+    OCR engine for OCR_ENGINE, falling back to pytesseract
+
+    tesserocr is used only if it is installed and can load the OCR_LANG
+    language data; otherwise the pytesseract engine is returned.
+    """
+    name = name or OCR_ENGINE
+    if name in ("auto", "tesserocr") and TESSEROCR_AVAILABLE:
+        engine = TesserocrEngine()
+        try:
+            # Load the model pages will use now, so a broken install falls back instead of failing every page
+            engine._release(OCR_LANG, engine._acquire(OCR_LANG))
+            return engine
+        except Exception as e:
+            print(f"tesserocr could not load its language data, using pytesseract: {e}")
+    elif name == "tesserocr":
+        print("tesserocr is not installed, using pytesseract")
+    return PytesseractEngine()
+
+
+def get_engine():
+    """
+    OCR engine shared by this process (re-created after a fork)
+    """
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = create_engine()
+            _engine_pid = os.getpid()
+            print(f"OCR engine: {_engine.name}")
+        return _engine
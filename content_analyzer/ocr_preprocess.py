@@ -0,0 +1,216 @@
+import os
+
+from ocr_engine import OCR_LANG, get_engine
+
+# OCR image preprocessing (adaptive resolution, deskew, Otsu binarization).
+# Off by default, plain RGB images at OCR_DPI, until benchmarks/bench_ocr.py
+# shows its accuracy and time against the plain path with tesseract installed
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "false").lower() == "true"
+# Fixed render resolution for pages without an embedded scan, and the range
+# the adaptive resolution is kept in
+OCR_DPI = 200
+OCR_MIN_DPI = int(os.environ.get("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.environ.get("OCR_MAX_DPI", "300"))
+# Longest side of the image handed to tesseract; larger photos are downscaled
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", "3300"))
+OCR_DESKEW = os.environ.get("OCR_DESKEW", "true").lower() != "false"
+# Skew angles searched by deskew, in degrees either way
+OCR_MAX_SKEW = float(os.environ.get("OCR_MAX_SKEW", "5"))
+# Page segmentation: 3 = automatic layout (multi-column pages), 6 = one block of text (faster)
+OCR_PSM = int(os.environ.get("OCR_PSM", "3"))
+
+# Deskew works on a reduced copy of the page; smaller skews are not corrected
+DESKEW_SIDE = 1000
+MIN_SKEW = 0.3
+# Size of a letter page in inches, used to guess the resolution of photos
+PAGE_LONG_SIDE_INCHES = 11.0
+
+
+def page_ocr_dpi(page):
+    """
+    Render resolution for OCRing a PDF page (PyMuPDF page)
+
+    Scanned pages are rendered at the resolution of the scan they embed:
+    rendering above it adds pixels but no detail, below it loses detail.
+    Pages without an embedded image use OCR_DPI. Either way the result is
+    kept within OCR_MIN_DPI..OCR_MAX_DPI and small enough that the longest
+    side fits in OCR_MAX_SIDE pixels.
+
+    Returns:
+        int: Dots per inch
+    """
+    if not OCR_PREPROCESS:
+        return OCR_DPI
+    rect = page.rect
+    dpi = OCR_DPI
+    native = []
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        width_in, height_in = abs(x1 - x0) / 72, abs(y1 - y0) / 72
+        # Only images covering most of the page are the scan itself
+        if width_in * height_in * 72 * 72 >= 0.5 * rect.width * rect.height:
+            native.append(max(info["width"] / width_in, info["height"] / height_in))
+    if native:
+        dpi = max(native)
+    longest_in = max(rect.width, rect.height) / 72 or 1
+    dpi = min(dpi, OCR_MAX_SIDE / longest_in)
+    return int(max(OCR_MIN_DPI, min(OCR_MAX_DPI, dpi)))
+
+
+def otsu_threshold(image):
+    """
+    Gray level that best separates ink from paper (Otsu's method)
+
+    Args:
+        image (Image): Grayscale ("L") image
+
+    Returns:
+        int: Threshold; pixels above it are background
+    """
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background_count, background_sum = 0, 0.0
+    best_level, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        mean_dark = background_sum / background_count
+        mean_light = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (mean_dark - mean_light) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def binarize(image, threshold=None):
+    if threshold is None:
+        threshold = otsu_threshold(image)
+    return image.point(lambda v: 255 if v > threshold else 0)
+
+
+def _line_contrast(image, angle):
+    # Text lines aligned with the rows give sharply alternating row darkness;
+    # squeezing to one column yields the row means at C speed
+    from PIL import Image
+    rotated = image.rotate(angle, resample=Image.NEAREST, fillcolor=255)
+    rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((r - mean) ** 2 for r in rows)
+
+
+def estimate_skew(image, threshold=None):
+    """
+    Angle (degrees, counter-clockwise) that makes the text lines horizontal
+
+    Uses the projection profile of a reduced, binarized copy: coarse 1
+    degree steps over +/- OCR_MAX_SKEW, then 0.2 degree steps around the
+    best angle.
+
+    Args:
+        image (Image): Grayscale image
+        threshold (int, optional): Binarization threshold (default: Otsu)
+    """
+    small = image.copy()
+    small.thumbnail((DESKEW_SIDE, DESKEW_SIDE))
+    small = binarize(small, threshold)
+    span = int(OCR_MAX_SKEW)
+    best = max(range(-span, span + 1), key=lambda a: _line_contrast(small, a))
+    fine = [best + step / 5 for step in range(-4, 5)]
+    return max(fine, key=lambda a: _line_contrast(small, a))
+
+
+def deskew(image, threshold=None):
+    from PIL import Image
+    angle = estimate_skew(image, threshold)
+    if abs(angle) < MIN_SKEW:
+        return image
+    return image.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255)
+
+
+def prepare_for_ocr(image, dpi):
+    """
+    Grayscale, bounded size, binarized and deskewed copy of an image for tesseract
+
+    Binary images also make the PNG that pytesseract writes for every call
+    several times smaller than the RGB page it replaces.
+
+    Args:
+        image (Image): Page image in any mode
+        dpi (float): Resolution of the image
+
+    Returns:
+        tuple: (preprocessed "L" image, its resolution)
+    """
+    from PIL import Image
+    if image.mode != "L":
+        image = image.convert("L")
+    if max(image.size) > OCR_MAX_SIDE:
+        dpi *= OCR_MAX_SIDE / max(image.size)
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.BILINEAR, reducing_gap=2.0)
+    threshold = otsu_threshold(image)
+    # Rotate before thresholding so the page stays purely black and white
+    if OCR_DESKEW:
+        image = deskew(image, threshold)
+    return binarize(image, threshold), dpi
+
+
+def open_upload_image(file_stream):
+    """
+    Decode an uploaded photo or scan for OCR
+
+    Phone photos are turned upright from their EXIF orientation, and JPEGs
+    are decoded straight to grayscale at a reduced scale when they are
+    larger than OCR_MAX_SIDE, which is much faster and lighter than
+    decoding the full-size colour image and shrinking it afterwards.
+
+    Returns:
+        tuple: (Image, estimated dots per inch)
+    """
+    from PIL import Image, ImageOps
+    file_stream.seek(0)
+    image = Image.open(file_stream)
+    dpi = image.info.get("dpi", (0, 0))[0]
+    full_width = image.width
+    if OCR_PREPROCESS:
+        image.draft("L", (OCR_MAX_SIDE, OCR_MAX_SIDE))
+        dpi *= image.width / full_width
+    image = ImageOps.exif_transpose(image)
+    # Cameras record 72 dpi whatever the subject; assume the page fills the frame
+    if not dpi or dpi <= 72:
+        dpi = max(image.size) / PAGE_LONG_SIDE_INCHES
+    return image, max(70, min(dpi, 1200))
+
+
+def recognize(image, dpi=None):
+    """
+    OCR an image prepared by prepare_for_ocr
+
+    Passing the resolution spares tesseract its own estimate, and the
+    inverted-text pass is skipped because binarized pages are always dark
+    text on white.
+    """
+    return get_engine().recognize(image, lang=OCR_LANG, psm=OCR_PSM, dpi=dpi,
+                                  variables={"tessedit_do_invert": "0"})
+
+
+def ocr_image(image, dpi=None):
+    """
+    OCR one page image, preprocessing it first unless OCR_PREPROCESS is off
+
+    Args:
+        image (Image): Page image in any mode
+        dpi (float, optional): Resolution of the image, if known
+
+    Returns:
+        str: Recognized text
+    """
+    if not OCR_PREPROCESS:
+        return get_engine().recognize(image.convert("RGB"), lang=OCR_LANG)
+    image, dpi = prepare_for_ocr(image, dpi or OCR_DPI)
+    return recognize(image, dpi)
@@ -0,0 +1,185 @@
+import io
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from importlib.util import find_spec
+from xml.sax.saxutils import escape
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+P, R, TBL, TR, TC, BODY = W + "p", W + "r", W + "tbl", W + "tr", W + "tc", W + "body"
+# Run content and its text (w:br is a line break only when it is not a page or column break)
+RUN_TEXT = {W + "tab": "\t", W + "ptab": "\t", W + "cr": "\n", W + "noBreakHyphen": "-"}
+BR, T, BR_TYPE = W + "br", W + "t", W + "type"
+HEADER_PART = re.compile(r"word/(header|footer)(\d*)\.xml")
+# Characters XML 1.0 cannot hold (python-docx rejects them too)
+INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+# Paragraphs encoded per write to the document part
+WRITE_BATCH = 256
+
+
+def iter_part_text(stream):
+    """
+    Paragraphs and table rows of one WordprocessingML part, in document order
+
+    The part is parsed incrementally (iterparse) and each paragraph and
+    table is dropped from the tree once its text is out, so memory does
+    not grow with the document. A table row is one line with its cells
+    joined by " | "; text boxes (paragraphs inside paragraphs) and deleted
+    text are skipped.
+
+    Args:
+        stream (file): XML part, e.g. an open zip member
+
+    Yields:
+        str: Non-empty paragraph and row texts
+    """
+    depth, in_run, parts = 0, 0, []
+    # Open table cells and rows; paragraphs inside a cell go to it instead of the output
+    cells, rows = [], []
+    # Element holding the top-level paragraphs and tables (w:body, or the root of a header)
+    container = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if container is None or tag == BODY:
+                container = elem
+            elif tag == P:
+                depth += 1
+                if depth == 1:
+                    parts = []
+            elif tag == R:
+                in_run += 1
+            elif tag == TC:
+                cells.append([])
+            elif tag == TR:
+                rows.append([])
+            continue
+
+        if tag == T:
+            if depth == 1 and in_run:
+                parts.append(elem.text or "")
+        elif tag in RUN_TEXT:
+            if depth == 1 and in_run:
+                parts.append(RUN_TEXT[tag])
+        elif tag == BR:
+            if depth == 1 and in_run and elem.get(BR_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif tag == R:
+            in_run -= 1
+        elif tag == P:
+            depth -= 1
+            if depth == 0:
+                text = "".join(parts)
+                if cells:
+                    if text:
+                        cells[-1].append(text)
+                    continue
+                container.clear()
+                if text:
+                    yield text
+        elif tag == TC:
+            text = " ".join(cells.pop())
+            if rows:
+                rows[-1].append(text)
+        elif tag == TR:
+            text = " | ".join(cell for cell in rows.pop() if cell)
+            elem.clear()
+            if text and cells:
+                cells[-1].append(text)
+            elif text:
+                yield text
+        elif tag == TBL and not cells:
+            container.clear()
+
+
+def _part_order(name):
+    m = HEADER_PART.fullmatch(name)
+    return m.group(1), int(m.group(2) or 0)
+
+
+def iter_docx_text(file_stream):
+    """
+    Text of a .docx file read straight from its XML, without building python-docx objects
+
+    Headers come first, then the body (paragraphs and table rows in order),
+    then footers. Identical header or footer lines (the same header on
+    first, odd and even pages) are listed once.
+
+    Args:
+        file_stream (file): Seekable .docx stream
+
+    Yields:
+        str: Non-empty paragraph and row texts
+    """
+    with zipfile.ZipFile(file_stream) as package:
+        names = package.namelist()
+        extras = sorted((n for n in names if HEADER_PART.fullmatch(n)), key=_part_order)
+        headers = [n for n in extras if _part_order(n)[0] == "header"]
+        footers = [n for n in extras if _part_order(n)[0] == "footer"]
+        seen = set()
+        for part in headers + ["word/document.xml"] + footers:
+            with package.open(part) as stream:
+                for text in iter_part_text(stream):
+                    if part != "word/document.xml":
+                        if text in seen:
+                            continue
+                        seen.add(text)
+                    yield text
+
+
+@lru_cache(maxsize=None)
+def _docx_template():
+    # python-docx's default package minus its document part (as zip bytes),
+    # and the document part's XML before and after the body content
+    # (located without importing python-docx itself)
+    package_dir = find_spec("docx").submodule_search_locations[0]
+    path = os.path.join(package_dir, "templates", "default.docx")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as package:
+        document = source.read("word/document.xml").decode("utf-8")
+        for info in source.infolist():
+            if info.filename != "word/document.xml":
+                package.writestr(info.filename, source.read(info))
+    body = document.index("<w:body>") + len("<w:body>")
+    return buffer.getvalue(), document[:body].encode("utf-8"), document[document.index("<w:sectPr"):].encode("utf-8")
+
+
+def paragraph_xml(line):
+    """
+    One body paragraph in the markup python-docx's add_paragraph produces
+    (tabs become w:tab, characters XML cannot hold are dropped)
+    """
+    line = INVALID_XML_CHARS.sub("", line.replace("\r", ""))
+    if not line:
+        return "<w:p/>"
+    runs = '</w:t><w:tab/><w:t xml:space="preserve">'.join(escape(part) for part in line.split("\t"))
+    return f'<w:p><w:r><w:t xml:space="preserve">{runs}</w:t></w:r></w:p>'
+
+
+def write_docx(lines, output):
+    """
+    Write a .docx with one paragraph per line, emitting the document XML directly
+
+    The package is python-docx's default template (same styles and page
+    setup as docx.Document()), copied already compressed; only the
+    document part is written, streamed into the zip in batches.
+
+    Args:
+        lines (iterable): Paragraph texts
+        output (file): Empty seekable binary file
+    """
+    template, head, tail = _docx_template()
+    output.write(template)
+    with zipfile.ZipFile(output, "a", zipfile.ZIP_DEFLATED) as package:
+        with package.open("word/document.xml", "w") as document:
+            document.write(head)
+            batch = []
+            for line in lines:
+                batch.append(paragraph_xml(line))
+                if len(batch) >= WRITE_BATCH:
+                    document.write("".join(batch).encode("utf-8"))
+                    batch.clear()
+            document.write("".join(batch).encode("utf-8"))
+            document.write(tail)
@@ -0,0 +1,320 @@
+import contextvars
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from metrics import stage
+from ocr_preprocess import OCR_PREPROCESS, ocr_image, page_ocr_dpi
+
+# Page-parallel extraction configuration. Every gunicorn worker has its own
+# pool, so by default they split the CPUs (WEB_CONCURRENCY workers)
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", "0")) or \
+    max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+# Below these page counts pool start-up and IPC cost more than they save
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "16"))
+OCR_PARALLEL_MIN_PAGES = int(os.environ.get("OCR_PARALLEL_MIN_PAGES", "2"))
+PDF_POOL_START_METHOD = os.environ.get("PDF_POOL_START_METHOD", "forkserver")
+# Run extractions in the pool even below the parallel thresholds, so they do
+# not hold the GIL of a threaded server's request threads (set by gunicorn.conf.py)
+EXTRACT_OFFLOAD = os.environ.get("EXTRACT_OFFLOAD", "false").lower() == "true"
+# Smaller jobs stay in the request thread: they hold the GIL for about 50 ms
+# a page, less than waiting behind a large job in the pool can take
+EXTRACT_OFFLOAD_MIN_PAGES = int(os.environ.get("EXTRACT_OFFLOAD_MIN_PAGES", "3"))
+# Batches per worker: more batches balance uneven pages, fewer re-open the PDF less often
+BATCHES_PER_WORKER = 4
+# A page's text layer is trusted only if it has enough readable characters
+MIN_TEXT_LAYER_CHARS = int(os.environ.get("MIN_TEXT_LAYER_CHARS", "32"))
+MIN_READABLE_RATIO = 0.6
+# Pages mostly covered by images are OCRed unless their text layer is substantial
+IMAGE_COVERAGE_RATIO = 0.5
+IMAGE_PAGE_MAX_CHARS = 200
+CID_PATTERN = re.compile(r"\(cid:\d+\)")
+COPY_BUFFER_SIZE = 1024 * 1024
+# Serial extraction is split into this many batches when progress is reported
+PROGRESS_BATCHES = 12
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_progress_callback = contextvars.ContextVar("extraction_progress", default=None)
+
+
+def get_pool():
+    """
+    Process pool shared by all extractions in this worker
+
+    The pool is created on first use and re-created after a fork, so a
+    gunicorn worker never inherits its master's executor.
+
+    Returns:
+        ProcessPoolExecutor: Pool with PDF_EXTRACT_WORKERS processes
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            methods = multiprocessing.get_all_start_methods()
+            method = PDF_POOL_START_METHOD if PDF_POOL_START_METHOD in methods else None
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context(method)
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def reset_pool():
+    """
+    Drop the current pool (e.g. after a worker process crashed)
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_pid = None
+
+
+@contextmanager
+def materialize_stream(file_stream, suffix=""):
+    """
+    Yield a file system path holding the contents of a file-like object
+
+    Pool workers cannot share an open stream, so in-memory uploads are
+    copied to a temporary file that is removed on exit. Streams that are
+    already backed by a named file are used in place.
+    """
+    name = getattr(file_stream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        file_stream.seek(0)
+        yield name
+        return
+
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            file_stream.seek(0)
+            shutil.copyfileobj(file_stream, f, COPY_BUFFER_SIZE)
+        file_stream.seek(0)
+        yield path
+    finally:
+        os.remove(path)
+
+
+@contextmanager
+def extraction_progress(callback):
+    """
+    Report page progress of extractions run in this context
+
+    Args:
+        callback (callable): ``callback(phase, pages_done, pages_total)``, where
+            phase is "text_layer" or "ocr"; called in the extracting thread
+    """
+    token = _progress_callback.set(callback)
+    try:
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+
+def split_batches(page_numbers, count):
+    """
+    Split page numbers into at most count contiguous batches
+
+    Returns:
+        list: Lists of page numbers, in page order
+    """
+    count = max(1, min(len(page_numbers), count))
+    size, extra = divmod(len(page_numbers), count)
+    batches, start = [], 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            batches.append(page_numbers[start:end])
+        start = end
+    return batches
+
+
+def map_pages(worker, path, page_numbers, min_parallel_pages):
+    """
+    Run a page worker over the given pages, fanning out to the pool for large jobs
+
+    With EXTRACT_OFFLOAD, smaller jobs of at least EXTRACT_OFFLOAD_MIN_PAGES
+    pages also run in the pool, as one batch.
+
+    Args:
+        worker (callable): Module-level function ``worker(path, page_numbers) -> list``
+        path (str): Path of the PDF
+        page_numbers (list): Zero-based page numbers to process
+        min_parallel_pages (int): Smallest job worth sending to the pool
+
+    Returns:
+        list: One result per requested page, in the same order
+    """
+    progress = _progress_callback.get()
+    phase = worker.__name__.replace("_pages", "")
+    parallel = PDF_EXTRACT_WORKERS > 1 and len(page_numbers) >= max(2, min_parallel_pages)
+    offload = EXTRACT_OFFLOAD and len(page_numbers) >= max(1, EXTRACT_OFFLOAD_MIN_PAGES)
+    if not parallel and not offload:
+        if progress is None:
+            return worker(path, page_numbers)
+        results = []
+        for batch in split_batches(page_numbers, PROGRESS_BATCHES):
+            results.extend(worker(path, batch))
+            progress(phase, len(results), len(page_numbers))
+        return results
+
+    batches = split_batches(page_numbers, PDF_EXTRACT_WORKERS * BATCHES_PER_WORKER if parallel else 1)
+    try:
+        futures = [get_pool().submit(worker, path, batch) for batch in batches]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+            if progress is not None:
+                progress(phase, len(results), len(page_numbers))
+        return results
+    except BrokenProcessPool as e:
+        print(f"Extraction pool failed, retrying serially: {e}")
+        reset_pool()
+        return worker(path, page_numbers)
+
+
+def text_layer_usable(text, image_coverage=0.0):
+    """
+    Decide whether a page's text layer can be used instead of OCR
+
+    Scanned pages have no text layer, a few stray characters (headers,
+    page numbers), or glyph garbage such as ``(cid:12)`` sequences from
+    fonts without a Unicode map.
+
+    Args:
+        text (str): Text extracted from the page's text layer
+        image_coverage (float): Fraction of the page area covered by images
+
+    Returns:
+        bool: True if the text layer is good enough
+    """
+    if not text:
+        return False
+    stripped = CID_PATTERN.sub("", text).strip()
+    if len(stripped) < len(text.strip()) / 2:
+        return False
+    readable = sum(1 for c in stripped if c.isalnum())
+    if readable < MIN_TEXT_LAYER_CHARS:
+        return False
+    printable = sum(1 for c in stripped if c.isalnum() or c.isspace() or c in ".,;:'\"()-/%&$")
+    if printable / len(stripped) < MIN_READABLE_RATIO:
+        return False
+    if image_coverage >= IMAGE_COVERAGE_RATIO and readable < IMAGE_PAGE_MAX_CHARS:
+        return False
+    return True
+
+
+# Page workers (run inside pool processes, so they must stay module-level)
+def image_coverage(page):
+    area = float(page.width * page.height) or 1.0
+    covered = sum(abs((img["x1"] - img["x0"]) * (img["bottom"] - img["top"])) for img in page.images)
+    return min(1.0, covered / area)
+
+
+def text_layer_pages(path, page_numbers):
+    """
+    Returns:
+        list: ``(text, usable)`` per page, where usable is False if the page needs OCR
+    """
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        results = []
+        for n in page_numbers:
+            page = pdf.pages[n]
+            text = page.extract_text()
+            results.append((text, text_layer_usable(text, image_coverage(page))))
+            # Release the page's parsed layout; pdfplumber keeps it otherwise
+            page.close()
+        return results
+
+
+def ocr_pages(path, page_numbers):
+    import fitz
+    from PIL import Image
+    doc = fitz.open(path)
+    try:
+        texts = []
+        for n in page_numbers:
+            page = doc[n]
+            dpi = page_ocr_dpi(page)
+            if OCR_PREPROCESS:
+                pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+            else:
+                pix = page.get_pixmap(dpi=dpi)
+                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            del pix
+            texts.append(ocr_image(img, dpi))
+        return texts
+    finally:
+        doc.close()
+
+
+# Document-level extraction
+def pdf_page_count(path):
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_hybrid(path, page_numbers=None):
+    """
+    Text layer for every page, OCR only for pages whose text layer is unusable
+
+    Mixed PDFs (typed body with scanned annexures or signature pages) only
+    pay for OCR on the scanned pages. If OCR fails the page keeps whatever
+    text layer it had.
+
+    Args:
+        path (str): Path of the PDF
+        page_numbers (list, optional): Zero-based pages to extract (default: all)
+
+    Returns:
+        list: Page texts in page order (None for pages without text)
+    """
+    if page_numbers is None:
+        page_numbers = list(range(pdf_page_count(path)))
+    with stage("text_layer"):
+        layers = map_pages(text_layer_pages, path, page_numbers, PDF_PARALLEL_MIN_PAGES)
+    texts = [text for text, _ in layers]
+    ocr_needed = [i for i, (_, usable) in enumerate(layers) if not usable]
+    if not ocr_needed:
+        return texts
+
+    print(f"OCR needed for {len(ocr_needed)}/{len(page_numbers)} pages")
+    try:
+        with stage("ocr"):
+            ocr_texts = map_pages(ocr_pages, path, [page_numbers[i] for i in ocr_needed], OCR_PARALLEL_MIN_PAGES)
+    except Exception as e:
+        print(f"PDF OCR error: {e}")
+        return texts
+    for i, ocr_text in zip(ocr_needed, ocr_texts):
+        if ocr_text and ocr_text.strip():
+            texts[i] = ocr_text
+    return texts
+
+
+def extract_ocr(path):
+    """
+    OCR of every page, rasterized with fitz and read with tesseract
+
+    Returns:
+        list: Page texts in page order
+    """
+    import fitz
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    with stage("ocr"):
+        return map_pages(ocr_pages, path, list(range(page_count)), OCR_PARALLEL_MIN_PAGES)
@@ -0,0 +1,122 @@
+import math
+import re
+from collections import Counter
+
+from mapreduce import split_sections
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SENTENCE_BREAK = re.compile(r"(?<=[.;:!?])\s+|\n\s*\n")
+STOPWORDS = frozenset(
+    "a an and are as at be by does for from has have how i in is it its of on or shall "
+    "that the their there this to under was what when where which who will with would".split()
+)
+# Target passage size in words; passages never cross a section heading
+PASSAGE_WORDS = 80
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def split_passages(text, target_words=PASSAGE_WORDS):
+    """
+    Split a document into clause/sentence passages of at most target_words words
+
+    Sentences are packed into passages; a sentence longer than target_words
+    (OCR output or table text without punctuation) is cut into pieces of
+    target_words words.
+
+    Returns:
+        list: Passage texts in document order
+    """
+    passages = []
+    for section in split_sections(text):
+        current, words = [], 0
+        for sentence in SENTENCE_BREAK.split(section):
+            sentence_words = sentence.split()
+            if not sentence_words:
+                continue
+            if current and words + len(sentence_words) > target_words:
+                passages.append(" ".join(current))
+                current, words = [], 0
+            while len(sentence_words) > target_words:
+                passages.append(" ".join(sentence_words[:target_words]))
+                sentence_words = sentence_words[target_words:]
+            current.append(" ".join(sentence_words))
+            words += len(sentence_words)
+        if current:
+            passages.append(" ".join(current))
+    return passages
+
+
+class PassageIndex:
+    """
+    BM25 index over the passages of one document
+
+    Built once per document and cached; ``to_dict``/``from_dict`` give a
+    JSON form for the shared disk cache.
+    """
+
+    def __init__(self, passages, term_counts=None):
+        self.passages = passages
+        if term_counts is None:
+            term_counts = [Counter(tokenize(p)) for p in passages]
+        self.term_counts = term_counts
+        self.lengths = [sum(tc.values()) for tc in term_counts]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.postings = {}
+        for i, tc in enumerate(term_counts):
+            for term, count in tc.items():
+                self.postings.setdefault(term, []).append((i, count))
+
+    @classmethod
+    def build(cls, text):
+        return cls(split_passages(text))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["passages"], [Counter(tc) for tc in data["term_counts"]])
+
+    def to_dict(self):
+        return {"passages": self.passages, "term_counts": [dict(tc) for tc in self.term_counts]}
+
+    def search(self, query, k=5):
+        """
+        Top-k passages for a query by BM25 score
+
+        Returns:
+            list: ``(passage index, score)`` pairs, best first
+        """
+        n = len(self.passages)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, count in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / (self.avg_length or 1))
+                scores[i] = scores.get(i, 0.0) + idf * count * (BM25_K1 + 1) / (count + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def context(self, query, k=5, max_chars=6000):
+        """
+        Most relevant passages for a query, in document order, within a size budget
+
+        Falls back to the opening passages when nothing matches, so broad
+        questions ("summarize this") still get context. The passages never
+        exceed max_chars in total: a best passage longer than that is cut.
+
+        Returns:
+            list: Passage texts
+        """
+        ranked = [i for i, _ in self.search(query, k)] or list(range(min(k, len(self.passages))))
+        chosen, size = {}, 0
+        for i in ranked:
+            if size + len(self.passages[i]) > max_chars and chosen:
+                break
+            chosen[i] = self.passages[i][:max_chars - size]
+            size += len(chosen[i])
+        return [chosen[i] for i in sorted(chosen)]
@@ -0,0 +1,271 @@
+import difflib
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from mapreduce import split_sections
+
+# Revision detection: an upload is a revision of an earlier document when
+# their estimated shingle similarity is at least REVISION_MIN_SIMILARITY
+REVISION_ANALYSIS = os.environ.get("REVISION_ANALYSIS", "true").lower() != "false"
+REVISION_MIN_SIMILARITY = float(os.environ.get("REVISION_MIN_SIMILARITY", "0.8"))
+# Documents remembered for revision detection (shared through ANALYSIS_CACHE_DIR when set)
+REVISION_INDEX_SIZE = int(os.environ.get("REVISION_INDEX_SIZE", "2000"))
+# Words per shingle and MinHash signature length
+SHINGLE_WORDS = 5
+SIGNATURE_SIZE = 128
+# Clause changes listed in a change summary (the counts cover all of them)
+MAX_LISTED_CHANGES = 50
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+DIGITS = re.compile(r"\d+")
+EMPTY_BIN = 2 ** 64
+
+
+def normalize_words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+def signature_words(text):
+    # Numbers are masked so filled-in amounts and dates barely move the signature
+    return [DIGITS.sub("#", word) for word in normalize_words(text)]
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash_signature(words, size=SIGNATURE_SIZE, shingle_words=SHINGLE_WORDS):
+    """
+    MinHash signature of a word sequence's shingles
+
+    Uses one-permutation hashing: each shingle is hashed once and the hash
+    space is split into ``size`` bins, keeping the smallest value in each.
+    Equal bins estimate the Jaccard similarity of the shingle sets like
+    ``size`` independent permutations would, for one hash per shingle.
+
+    Args:
+        words (list): Normalized words
+        size (int): Number of bins
+        shingle_words (int): Words per shingle
+
+    Returns:
+        list: ``size`` integers (EMPTY_BIN for bins no shingle fell into)
+    """
+    signature = [EMPTY_BIN] * size
+    count = max(1, len(words) - shingle_words + 1)
+    for i in range(count):
+        value = _hash64(" ".join(words[i:i + shingle_words]))
+        slot, rest = value % size, value // size
+        if rest < signature[slot]:
+            signature[slot] = rest
+    return signature
+
+
+def estimate_similarity(first, second):
+    """
+    Estimated Jaccard similarity of the shingle sets behind two signatures
+    """
+    pairs = [(a, b) for a, b in zip(first, second) if a != EMPTY_BIN or b != EMPTY_BIN]
+    if not pairs:
+        return 0.0
+    return sum(1 for a, b in pairs if a == b) / len(pairs)
+
+
+def clause_fingerprints(text):
+    """
+    The clauses of a document, identified by their normalized content
+
+    Returns:
+        tuple: (clause hashes, clause headings), in document order
+    """
+    hashes, headings = [], []
+    for section in split_sections(text):
+        hashes.append(hashlib.sha1(" ".join(normalize_words(section)).encode("utf-8")).hexdigest()[:16])
+        headings.append(section.splitlines()[0].strip()[:80])
+    return hashes, headings
+
+
+def diff_clauses(previous, current):
+    """
+    Clause-level change summary between two document records
+
+    Args:
+        previous (dict): Record of the earlier version (see RevisionIndex.record)
+        current (dict): Record of the new version
+
+    Returns:
+        dict: Counts of unchanged/changed/added/removed clauses and the
+            changed clauses with their headings
+    """
+    counts = {"unchanged": 0, "changed": 0, "added": 0, "removed": 0}
+    changes = []
+
+    def note(change, headings, indexes):
+        counts[change] += len(indexes)
+        changes.extend({"change": change, "clause": headings[i]} for i in indexes)
+
+    matcher = difflib.SequenceMatcher(None, previous["clauses"], current["clauses"], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            counts["unchanged"] += i2 - i1
+        elif tag == "delete":
+            note("removed", previous["headings"], range(i1, i2))
+        elif tag == "insert":
+            note("added", current["headings"], range(j1, j2))
+        else:
+            # Pair replaced clauses up in order; any surplus was added or removed
+            paired = min(i2 - i1, j2 - j1)
+            note("changed", current["headings"], range(j1, j1 + paired))
+            note("added", current["headings"], range(j1 + paired, j2))
+            note("removed", previous["headings"], range(i1 + paired, i2))
+    return {"clauses": counts, "changes": changes[:MAX_LISTED_CHANGES]}
+
+
+class RevisionIndex:
+    """
+    Recently analyzed documents, for finding earlier versions
+
+    Holds the MinHash signature and clause fingerprints of up to
+    max_entries documents (least recently added are dropped) and finds the
+    most similar one by scanning the signatures.
+
+    With a directory, each record is also stored there as one JSON file,
+    so every gunicorn worker sharing it finds versions uploaded through the
+    others: lookups first load the records other workers added (and drop
+    those they pruned), then scan the signatures in memory.
+    """
+
+    def __init__(self, max_entries=REVISION_INDEX_SIZE, min_similarity=REVISION_MIN_SIMILARITY, directory=""):
+        self.max_entries = max(0, max_entries)
+        self.min_similarity = min_similarity
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self.directory = directory or None
+        # Records on disk as of the last sync or add, to prune only once past the cap
+        self._disk_count = 0
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"Revision index directory unavailable, index kept per worker: {e}")
+                self.directory = None
+
+    @staticmethod
+    def record(document_id, text, document_type=None):
+        """
+        Fingerprint of one document: signature and clause hashes/headings
+
+        Returns:
+            dict: JSON-serializable record
+        """
+        clauses, headings = clause_fingerprints(text)
+        return {
+            "document_id": document_id,
+            "document_type": document_type,
+            "signature": minhash_signature(signature_words(text)),
+            "clauses": clauses,
+            "headings": headings,
+        }
+
+    def _path(self, document_id):
+        return os.path.join(self.directory, document_id + ".json")
+
+    def _disk_ids(self):
+        try:
+            return {name[:-5] for name in os.listdir(self.directory) if name.endswith(".json")}
+        except OSError as e:
+            print(f"Revision index directory unreadable: {e}")
+            return None
+
+    def _sync(self):
+        # Mirror the shared directory: load records other workers added, forget pruned ones
+        on_disk = self._disk_ids()
+        if on_disk is None:
+            return
+        with self._lock:
+            known = set(self._records)
+        loaded = []
+        for document_id in on_disk - known:
+            try:
+                with open(self._path(document_id), encoding="utf-8") as f:
+                    loaded.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed meanwhile, or still being written
+                continue
+        with self._lock:
+            for document_id in known - on_disk:
+                self._records.pop(document_id, None)
+            for record in loaded:
+                self._records[record["document_id"]] = record
+            self._disk_count = len(on_disk)
+
+    def add(self, record):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._records[record["document_id"]] = record
+            self._records.move_to_end(record["document_id"])
+            # With a directory the records mirror it, and pruning the directory bounds them
+            while not self.directory and len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+            self._disk_count += 1
+            prune = self._disk_count > self.max_entries + max(1, self.max_entries // 10)
+        if self.directory:
+            path = self._path(record["document_id"])
+            try:
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(record, f)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"Revision index write failed: {e}")
+            if prune:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        # Oldest records beyond max_entries; runs once per max_entries / 10 adds, not on every add
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, name in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_count = min(len(entries), self.max_entries)
+
+    def find_previous(self, record):
+        """
+        Most similar earlier document of the same type, if similar enough
+
+        Returns:
+            tuple: (record, similarity), or (None, 0.0)
+        """
+        if self.directory:
+            self._sync()
+        with self._lock:
+            candidates = list(self._records.values())
+        best, best_similarity = None, 0.0
+        for candidate in candidates:
+            if candidate["document_id"] == record["document_id"] or \
+                    candidate["document_type"] != record["document_type"]:
+                continue
+            similarity = estimate_similarity(candidate["signature"], record["signature"])
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None or best_similarity < self.min_similarity:
+            return None, 0.0
+        return best, round(best_similarity, 3)
+
+    def __len__(self):
+        return len(self._records)
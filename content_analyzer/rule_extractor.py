@@ -0,0 +1,223 @@
+import bisect
+import re
+from datetime import date
+
+from mapreduce import SECTION_HEADING, split_sections
+
+# Items of each kind kept per document
+MAX_ITEMS = 20
+CONTEXT_CHARS = 160
+
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august",
+          "september", "october", "november", "december"]
+MONTH_NAMES = r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|" \
+              r"Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)"
+NAME_WORD = r"[A-Z][A-Za-z'&-]*\.?"
+# ISO, day-first numeric and written-out dates
+DATE = (r"\b(?:\d{4}-\d{2}-\d{2}"
+        r"|\d{1,2}[/.-]\d{1,2}[/.-]\d{4}"
+        r"|\d{1,2}(?:st|nd|rd|th)?\s+(?:day\s+of\s+)?" + MONTH_NAMES + r",?\s+\d{4}"
+        r"|" + MONTH_NAMES + r"\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})\b")
+
+# Every kind of fact is one named alternative of a single pattern, so the
+# whole document is scanned once. Patterns that introduce longer text
+# (obligations, definitions) match only their head; the rest of the
+# sentence is sliced from the text so dates and amounts inside it are
+# still found by the same scan.
+FACT_PATTERN = re.compile(
+    r"(?P<party>\(?\s*(?i:hereinafter|hereafter)\s+(?i:referred\s+to\s+as|called)\s+(?:the\s+)?[\"“']?"
+    r"(?P<role>[A-Z][A-Za-z -]{1,40}?)[\"”']?\s*(?:\)|,|;|\.|$))"
+    r"|(?P<alias>\((?:the\s+)?[\"“](?P<alias_term>[A-Z][^\"”\n]{1,40})[\"”]\))"
+    r"|(?P<defined>[\"“](?P<term>[A-Z][^\"”\n]{1,40})[\"”]\s+(?i:shall\s+mean|means|shall\s+refer\s+to|refers\s+to)\b)"
+    r"|(?P<law>(?i:governed\s+by|construed\s+in\s+accordance\s+with|subject\s+to)\s+(?:the\s+)?(?i:laws?)\s+of\s+"
+    r"(?:the\s+)?(?P<law_place>[A-Z][A-Za-z]+(?:\s+[A-Z][A-Za-z]+){0,3}))"
+    r"|(?P<court>(?i:courts?\s+(?:at|in|of)\s+)(?P<court_place>[A-Z][A-Za-z]+(?:\s+[A-Z][A-Za-z]+){0,2})"
+    r"(?=[^.;]{0,40}?(?i:jurisdiction)))"
+    r"|(?P<date>" + DATE + r")"
+    r"|(?P<amount>(?:(?i:Rs\.?|INR|USD|EUR|GBP)\s?|[₹$€£]\s?)(?:\d{1,3}(?:,\d{2,3})+|\d+)(?:\.\d+)?(?!\d)"
+    r"(?:\s?(?i:lakhs?|crores?|thousand|million|billion)\b)?(?:\s?/-)?)"
+    r"|(?P<obligation>\b(?:[Tt]he\s+)?(?P<obligor>[A-Z][a-z]+(?:\s+[A-Z][a-z]+){0,2})\s+"
+    r"(?=(?:shall|must|agrees\s+to|undertakes\s+to)\b))"
+)
+DATE_PATTERN = re.compile(DATE)
+# Sentence ends, except after common abbreviations (Rs., Mr., Ltd. ...)
+SENTENCE_END = re.compile(
+    r"\.(?<!\bRs\.)(?<!\bMr\.)(?<!\bMs\.)(?<!\bDr\.)(?<!\bNo\.)(?<!\bMrs\.)(?<!\bSmt\.)(?<!\bLtd\.)"
+    r"(?<!\bPvt\.)(?<!\bCo\.)(?<!\bSt\.)\s+(?=[A-Z\"“(])|[;!?]\s+|\n"
+)
+# Where the name before a party definition starts; the name itself ends
+# at the first word that is not capitalized (", residing at ...")
+PARTY_NAME_START = re.compile(r"\b(?i:between|and|by|with)\b|[\n;:]")
+PARTY_NAME = re.compile(r"(?:(?:M/s\.?|Mr\.?|Mrs\.?|Ms\.?|Dr\.?|Shri|Smt\.?)\s+)?" + NAME_WORD +
+                        r"(?:\s+(?:" + NAME_WORD + r"|of|&))*")
+ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+NUMERIC_DATE = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})")
+WORD_DATE = re.compile(r"(\d{1,2})(?:st|nd|rd|th)?\s+(?:day\s+of\s+)?([A-Za-z]+),?\s+(\d{4})")
+MONTH_FIRST_DATE = re.compile(r"([A-Za-z]+)\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})")
+# Obligors that are not parties
+NON_PARTIES = {"this", "this agreement", "agreement", "the agreement", "notices", "notice", "payment"}
+GROUP_OBLIGORS = {"either party", "each party", "both parties", "neither party", "parties", "the parties"}
+
+
+def _month(name):
+    name = name.lower()
+    for number, month in enumerate(MONTHS, 1):
+        if month.startswith(name[:3]):
+            return number
+    return None
+
+
+def normalize_date(value):
+    """
+    ISO form of a date found in the text (day-first for numeric dates)
+
+    Returns:
+        str or None: None if the text is not a valid calendar date (e.g. "00/00/0000", "2024-13-45")
+    """
+    for pattern, order in ((ISO_DATE, "ymd"), (NUMERIC_DATE, "dmy"), (WORD_DATE, "dMy"), (MONTH_FIRST_DATE, "Mdy")):
+        m = pattern.fullmatch(value.strip())
+        if not m:
+            continue
+        parts = dict(zip(order, m.groups()))
+        month = _month(parts["M"]) if "M" in parts else int(parts["m"])
+        try:
+            return date(int(parts["y"]), month or 0, int(parts["d"])).isoformat()
+        except ValueError:
+            return None
+    return None
+
+
+class _Sentences:
+    """
+    Sentence boundaries of a text, for slicing the context of a match
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.ends = [m.end() for m in SENTENCE_END.finditer(text)]
+
+    def start(self, pos):
+        i = bisect.bisect_right(self.ends, pos) - 1
+        return self.ends[i] if i >= 0 else 0
+
+    def end(self, pos):
+        i = bisect.bisect_right(self.ends, pos)
+        return self.ends[i] if i < len(self.ends) else len(self.text)
+
+    def around(self, start, end):
+        return _clip(self.text[self.start(start):self.end(end)])
+
+    def rest(self, pos):
+        return _clip(self.text[pos:self.end(pos)])
+
+
+def _clip(text, limit=CONTEXT_CHARS):
+    text = " ".join(text.split()).rstrip(" .;,")
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "..."
+
+
+def _party_name(text, pos):
+    window = text[max(0, pos - 200):pos]
+    starts = [m.end() for m in PARTY_NAME_START.finditer(window)]
+    segment = window[starts[-1]:] if starts else window
+    m = PARTY_NAME.search(segment)
+    return " ".join(m.group().split()).rstrip(" ,(") if m else ""
+
+
+def _add(items, seen, key, item):
+    if key not in seen and len(items) < MAX_ITEMS:
+        seen.add(key)
+        items.append(item)
+
+
+def extract_facts(text):
+    """
+    Rule-based extraction of the facts a regex can find reliably
+
+    One scan finds dates, monetary amounts, parties ("hereinafter referred
+    to as"), defined terms ("X" means ..., (the "X")), governing law,
+    jurisdiction and "X shall ..." obligations. Fields use the analysis
+    schema, so they can fill an analysis directly.
+
+    Returns:
+        dict: critical_dates, parties, key_terms, obligations, amounts (lists)
+            and jurisdiction (str or None)
+    """
+    sentences = _Sentences(text)
+    facts = {"critical_dates": [], "parties": [], "key_terms": [], "obligations": [], "amounts": []}
+    seen = {field: set() for field in facts}
+    laws, courts, obligations = [], [], []
+
+    for m in FACT_PATTERN.finditer(text):
+        kind = m.lastgroup
+        if m.group("party"):
+            role = " ".join(m.group("role").split())
+            name = _party_name(text, m.start()) or role
+            _add(facts["parties"], seen["parties"], role.lower(), {"name": name, "role": role})
+        elif m.group("alias"):
+            term = m.group("alias_term").strip()
+            definition = _clip(text[sentences.start(m.start()):m.start()])
+            if definition:
+                _add(facts["key_terms"], seen["key_terms"], term.lower(), {"term": term, "definition": definition})
+        elif m.group("defined"):
+            term = m.group("term").strip()
+            _add(facts["key_terms"], seen["key_terms"], term.lower(),
+                 {"term": term, "definition": sentences.rest(m.end())})
+        elif m.group("law"):
+            laws.append(m.group("law_place"))
+        elif m.group("court"):
+            courts.append(m.group("court_place"))
+        elif m.group("date"):
+            value = normalize_date(m.group("date"))
+            if value is None:
+                # Placeholders and typos ("00/00/0000", "31/02/2024") are not dates
+                continue
+            _add(facts["critical_dates"], seen["critical_dates"], value,
+                 {"date": value, "event": sentences.around(m.start(), m.end())})
+        elif m.group("amount"):
+            amount = " ".join(m.group("amount").split())
+            _add(facts["amounts"], seen["amounts"], amount,
+                 {"amount": amount, "context": sentences.around(m.start(), m.end())})
+        elif kind == "obligation" or m.group("obligor"):
+            obligations.append((m.group("obligor"), sentences.rest(m.end())))
+
+    roles = {p["role"].lower() for p in facts["parties"]} | {p["name"].lower() for p in facts["parties"]}
+    for obligor, responsibility in obligations:
+        key = obligor.lower()
+        if key in NON_PARTIES or (roles and key not in roles and key not in GROUP_OBLIGORS):
+            continue
+        _add(facts["obligations"], seen["obligations"], (key, responsibility.lower()),
+             {"party": obligor, "responsibility": responsibility})
+
+    jurisdiction = []
+    if laws:
+        jurisdiction.append(f"Governed by the laws of {laws[0]}")
+    if courts:
+        jurisdiction.append(f"courts at {courts[0]} have jurisdiction")
+    facts["jurisdiction"] = "; ".join(jurisdiction) or None
+    return facts
+
+
+def amounts_as_terms(facts):
+    """
+    Monetary amounts in the key_terms shape, for analyses (the schema has no amounts field)
+    """
+    return [{"term": a["amount"], "definition": a["context"]} for a in facts["amounts"]]
+
+
+def clause_outline(text, limit=MAX_ITEMS):
+    """
+    main_clauses from the document's own clause headings
+
+    Returns:
+        list: ``{"name": heading, "description": first sentence}`` items
+    """
+    clauses = []
+    for section in split_sections(text):
+        heading, _, body = section.partition("\n")
+        if body.strip() and SECTION_HEADING.match(heading):
+            description = _Sentences(body.strip()).around(0, 0)
+            clauses.append({"name": heading.strip(), "description": description})
+            if len(clauses) >= limit:
+                break
+    return clauses
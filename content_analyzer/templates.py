@@ -0,0 +1,403 @@
+import bisect
+import copy
+import difflib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from revisions import estimate_similarity
+from rule_extractor import DATE_PATTERN, normalize_date
+
+# Template matching: uploads that are an earlier document with only a few
+# fields (names, amounts, dates) filled in differently reuse its analysis
+TEMPLATE_MATCHING = os.environ.get("TEMPLATE_MATCHING", "true").lower() != "false"
+TEMPLATE_MIN_SIMILARITY = float(os.environ.get("TEMPLATE_MIN_SIMILARITY", "0.8"))
+# Templates kept per worker (their text and analysis are held in memory)
+TEMPLATE_INDEX_SIZE = int(os.environ.get("TEMPLATE_INDEX_SIZE", "200"))
+# Longer documents are not treated as templates
+TEMPLATE_MAX_WORDS = int(os.environ.get("TEMPLATE_MAX_WORDS", "20000"))
+# A match may change at most this fraction of the tokens, in spans of at most TEMPLATE_MAX_FIELD_TOKENS
+TEMPLATE_MAX_CHANGED_RATIO = float(os.environ.get("TEMPLATE_MAX_CHANGED_RATIO", "0.05"))
+TEMPLATE_MAX_FIELD_TOKENS = int(os.environ.get("TEMPLATE_MAX_FIELD_TOKENS", "12"))
+# LSH banding of the 128-bin signature: 32 bands of 4 rows puts the
+# candidate threshold near 0.42 similarity, well below TEMPLATE_MIN_SIMILARITY
+LSH_BANDS = 32
+LSH_ROWS = 4
+# Substitutions listed in a response
+MAX_LISTED_SUBSTITUTIONS = 50
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Numbers with or without thousands separators ("40,000", "1,00,000", "40000.50")
+NUMBER = r"(?<!\d)(?<!\d[.,])(?:\d{1,3}(?:,\d{2,3})+|\d+)(?:\.\d+)?(?!\d|[.,]\d)"
+NUMBER_PATTERN = re.compile(NUMBER)
+# Capitalized words of a name, checked for in analyses after filling
+NAME_WORD_PATTERN = re.compile(r"\b[A-Z][A-Za-z'-]{2,}\b")
+
+
+def tokenize(text):
+    """
+    Returns:
+        tuple: (token strings, (start, end) offsets in text)
+    """
+    matches = list(TOKEN_PATTERN.finditer(text))
+    return [m.group() for m in matches], [m.span() for m in matches]
+
+
+def field_substitutions(template_text, text):
+    """
+    The fields in which text differs from template_text
+
+    Token runs that differ are paired up by a token diff; differences
+    separated only by punctuation (e.g. the digit groups of ``10,000``)
+    form one field. Returns None when the texts are not the same template:
+    too many changed tokens, a changed run longer than
+    TEMPLATE_MAX_FIELD_TOKENS, or text added or removed outright.
+
+    Returns:
+        list or None: ``(template value, new value)`` pairs in document order
+    """
+    old_tokens, old_spans = tokenize(template_text)
+    new_tokens, new_spans = tokenize(text)
+    fields = []
+    for tag, i1, i2, j1, j2 in _token_opcodes(template_text, old_spans, old_tokens, text, new_spans, new_tokens):
+        if tag == "equal":
+            continue
+        if fields and all(not t[0].isalnum() for t in old_tokens[fields[-1][1]:i1]) \
+                and old_tokens[fields[-1][1]:i1] == new_tokens[fields[-1][3]:j1]:
+            fields[-1] = (fields[-1][0], i2, fields[-1][2], j2)
+        else:
+            fields.append((i1, i2, j1, j2))
+
+    changed = sum((i2 - i1) + (j2 - j1) for i1, i2, j1, j2 in fields)
+    if changed > TEMPLATE_MAX_CHANGED_RATIO * (len(old_tokens) + len(new_tokens)):
+        return None
+    substitutions, last_end = [], 0
+    for i1, i2, j1, j2 in fields:
+        if i1 == i2 or j1 == j2 or max(i2 - i1, j2 - j1) > TEMPLATE_MAX_FIELD_TOKENS:
+            return None
+        # Widen to whole values: only "40" differs between "40,000" and "50,000"
+        while _joined(old_tokens, old_spans, i1 - 1, -1) and _joined(new_tokens, new_spans, j1 - 1, -1):
+            i1, j1 = i1 - 1, j1 - 1
+        while _joined(old_tokens, old_spans, i2, 1) and _joined(new_tokens, new_spans, j2, 1):
+            i2, j2 = i2 + 1, j2 + 1
+        if i1 < last_end:
+            # Widened into the previous field (e.g. day and year of one date)
+            continue
+        last_end = i2
+        substitutions.append((template_text[old_spans[i1][0]:old_spans[i2 - 1][1]],
+                              text[new_spans[j1][0]:new_spans[j2 - 1][1]]))
+    return substitutions
+
+
+def _token_opcodes(old_text, old_spans, old_tokens, new_text, new_spans, new_tokens):
+    # Token diff restricted to the lines that differ: diffing whole documents
+    # token by token is slow, and filled-in fields leave most lines untouched
+    old_starts = [start for start, _ in old_spans]
+    new_starts = [start for start, _ in new_spans]
+    old_lines, new_lines = old_text.splitlines(True), new_text.splitlines(True)
+    old_offsets, new_offsets = _line_offsets(old_lines), _line_offsets(new_lines)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        i1, i2 = bisect.bisect_left(old_starts, old_offsets[a1]), bisect.bisect_left(old_starts, old_offsets[a2])
+        j1, j2 = bisect.bisect_left(new_starts, new_offsets[b1]), bisect.bisect_left(new_starts, new_offsets[b2])
+        tokens = difflib.SequenceMatcher(None, old_tokens[i1:i2], new_tokens[j1:j2], autojunk=False)
+        for op, x1, x2, y1, y2 in tokens.get_opcodes():
+            yield op, i1 + x1, i1 + x2, j1 + y1, j1 + y2
+
+
+def _line_offsets(lines):
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def _joined(tokens, spans, k, direction):
+    # Whether token k belongs to the same value as its neighbour on the other
+    # side of direction: no space between them, and k is a word or punctuation
+    # inside a value (the "," of "10,000", not a full stop)
+    if k < 0 or k >= len(tokens):
+        return False
+    neighbour = k - direction
+    if spans[min(k, neighbour)][1] != spans[max(k, neighbour)][0]:
+        return False
+    if tokens[k][0].isalnum():
+        return True
+    beyond = k + direction
+    return 0 <= beyond < len(tokens) and spans[min(k, beyond)][1] == spans[max(k, beyond)][0] \
+        and tokens[beyond][0].isalnum()
+
+
+def _value_pattern(value, flags=0):
+    return re.compile(r"(?<!\w)" + re.escape(value) + r"(?!\w)", flags)
+
+
+def _number(value):
+    # A value that is one number, without separators ("40,000" -> "40000"), or None
+    m = NUMBER_PATTERN.fullmatch(value.strip())
+    return m.group().replace(",", "") if m else None
+
+
+def _dates(text):
+    # (text, ISO date) of each valid date, in order
+    return [(m.group(), iso) for m in DATE_PATTERN.finditer(text) if (iso := normalize_date(m.group()))]
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+
+
+def normalized_substitutions(substitutions, text, template_text):
+    """
+    Substitutions of the normalized forms analyses store values in
+
+    Analyses hold dates as ISO dates and may write amounts without
+    separators, so the template's literal values alone do not cover them.
+    Dates are paired by position when both texts have the same number of
+    dates; amounts come from substitutions that are one number.
+
+    Returns:
+        tuple: ({old ISO date: (new ISO date, new date text)}, {old number: new number text},
+            stale ISO dates: the template's dates that are not in text)
+    """
+    old_dates, new_dates = _dates(template_text), _dates(text)
+    new_isos = {iso for _, iso in new_dates}
+    stale_dates = {iso for _, iso in old_dates} - new_isos
+    dates = {}
+    if len(old_dates) == len(new_dates):
+        for (_, old_iso), (new_text, new_iso) in zip(old_dates, new_dates):
+            if old_iso in stale_dates and dates.setdefault(old_iso, (new_iso, new_text))[0] != new_iso:
+                # One template date filled in with two different dates
+                dates.pop(old_iso)
+                break
+    numbers = {}
+    for old, new in substitutions:
+        old_number, new_number = _number(old), _number(new)
+        if old_number is not None and new_number is not None and old_number != new_number.replace(",", ""):
+            numbers[old_number] = new
+    return dates, numbers, stale_dates
+
+
+def fill_analysis(analysis, substitutions, text, template_text=""):
+    """
+    The template's analysis with its field values replaced by the new ones
+
+    Literal values are replaced where they occur, and so are dates and
+    amounts written in another form (ISO dates, numbers with or without
+    separators; see normalized_substitutions). Returns None if the
+    substitutions are ambiguous: a template value that was replaced by
+    different values, or that still occurs unchanged in the new text,
+    cannot be rewritten safely in the analysis. It also returns None if a
+    template value survives the filling in any form the analysis may use
+    (another letter case, a name word, a date or amount format), since
+    the analysis would report it as a fact about the new document.
+
+    Args:
+        analysis (dict): The template's analysis
+        substitutions (list): (template value, new value) pairs from field_substitutions
+        text (str): The new document's text
+        template_text (str): The template's text (for pairing its dates)
+
+    Returns:
+        tuple or None: (filled analysis, number of values replaced)
+    """
+    mapping = {}
+    for old, new in substitutions:
+        if mapping.setdefault(old, new) != new or _value_pattern(old).search(text):
+            return None
+    if not mapping:
+        return copy.deepcopy(analysis), 0
+    dates, numbers, stale_dates = normalized_substitutions(substitutions, text, template_text)
+    literals = "|".join(r"(?<!\w)" + re.escape(old) + r"(?!\w)" for old in sorted(mapping, key=len, reverse=True))
+    pattern = re.compile(f"(?P<literal>{literals})|(?P<date>{DATE_PATTERN.pattern})|(?P<number>{NUMBER})")
+    replaced = [0]
+
+    def substitute(match):
+        value = match.group()
+        if match.group("literal"):
+            new = mapping[value]
+        elif match.group("date") and normalize_date(value) in dates:
+            new_iso, new_text = dates[normalize_date(value)]
+            # Keep the analysis's format: ISO stays ISO, other forms take the document's
+            new = new_iso if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value) else new_text
+        elif match.group("number") and value.replace(",", "") in numbers:
+            new = numbers[value.replace(",", "")]
+        else:
+            return value
+        replaced[0] += 1
+        return new
+
+    def fill(value):
+        if isinstance(value, str):
+            return pattern.sub(substitute, value)
+        if isinstance(value, list):
+            return [fill(item) for item in value]
+        if isinstance(value, dict):
+            return {key: fill(item) for key, item in value.items()}
+        return value
+
+    filled = fill(analysis)
+    if stale_values(filled, mapping, numbers, stale_dates, text):
+        return None
+    return filled, replaced[0]
+
+
+def stale_values(analysis, mapping, numbers, stale_dates, text):
+    """
+    Whether a template value is left in a filled analysis in some form
+
+    Returns:
+        bool: True if an old value (any letter case), a word of an old
+            name that is not in the new text, an old date in any format or
+            an old amount with or without separators is still there
+    """
+    content = "\n".join(_strings(analysis))
+    new_values = " ".join(mapping.values()).lower()
+    for old in mapping:
+        # An old value inside a new one ("Ravi" -> "Ravi Kumar") is expected
+        if old.lower() not in new_values and _value_pattern(old, re.IGNORECASE).search(content):
+            return True
+        for word in NAME_WORD_PATTERN.findall(old):
+            if not _value_pattern(word, re.IGNORECASE).search(text) and \
+                    _value_pattern(word, re.IGNORECASE).search(content):
+                return True
+    if stale_dates and any(normalize_date(m.group()) in stale_dates for m in DATE_PATTERN.finditer(content)):
+        return True
+    return any(m.group().replace(",", "") in numbers for m in NUMBER_PATTERN.finditer(content))
+
+
+class TemplateIndex:
+    """
+    MinHash LSH index of analyzed documents that later uploads may be filled-in copies of
+
+    Each template's signature is split into LSH_BANDS bands; documents that
+    share a band are candidates, which are then checked with the full
+    signature and a token diff. The text and analysis of up to max_entries
+    templates are kept (least recently matched are dropped first).
+    """
+
+    def __init__(self, max_entries=TEMPLATE_INDEX_SIZE, min_similarity=TEMPLATE_MIN_SIMILARITY):
+        self.max_entries = max(0, max_entries)
+        self.min_similarity = min_similarity
+        self._templates = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "candidates": 0, "matches": 0, "not_fillable": 0}
+        self._matches = {}
+
+    @staticmethod
+    def _bands(signature):
+        return [(band, tuple(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])) for band in range(LSH_BANDS)]
+
+    def add(self, record, text, analysis):
+        """
+        Remember an analyzed document as a template
+
+        Args:
+            record (dict): Fingerprint from RevisionIndex.record
+            text (str): Extracted text
+            analysis (dict): Its analysis
+        """
+        if not self.max_entries or len(text.split()) > TEMPLATE_MAX_WORDS:
+            return
+        template_id = record["document_id"]
+        with self._lock:
+            if template_id in self._templates:
+                return
+            self._templates[template_id] = {
+                "document_type": record["document_type"],
+                "signature": record["signature"],
+                "text": text,
+                "analysis": analysis,
+            }
+            for band in self._bands(record["signature"]):
+                self._buckets.setdefault(band, set()).add(template_id)
+            while len(self._templates) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        template_id, template = self._templates.popitem(last=False)
+        for band in self._bands(template["signature"]):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(template_id)
+                if not bucket:
+                    del self._buckets[band]
+        self._matches.pop(template_id, None)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def match(self, record, text):
+        """
+        Find a template that text is a filled-in copy of and fill its analysis
+
+        Returns:
+            tuple: (filled analysis, match details), or (None, None)
+        """
+        with self._lock:
+            self._stats["lookups"] += 1
+            candidates = set()
+            for band in self._bands(record["signature"]):
+                candidates |= self._buckets.get(band, set())
+            candidates.discard(record["document_id"])
+            scored = []
+            for template_id in candidates:
+                template = self._templates[template_id]
+                if template["document_type"] != record["document_type"]:
+                    continue
+                similarity = estimate_similarity(template["signature"], record["signature"])
+                if similarity >= self.min_similarity:
+                    scored.append((similarity, template_id, template))
+        if not scored or len(text.split()) > TEMPLATE_MAX_WORDS:
+            return None, None
+        self._count("candidates")
+
+        for similarity, template_id, template in sorted(scored, key=lambda s: s[0], reverse=True):
+            substitutions = field_substitutions(template["text"], text)
+            if substitutions is None:
+                continue
+            filled = fill_analysis(template["analysis"], substitutions, text, template["text"])
+            if filled is None:
+                self._count("not_fillable")
+                continue
+            analysis, replaced = filled
+            with self._lock:
+                self._stats["matches"] += 1
+                self._matches[template_id] = self._matches.get(template_id, 0) + 1
+                if template_id in self._templates:
+                    self._templates.move_to_end(template_id)
+            return analysis, {
+                "template_id": template_id,
+                "similarity": round(similarity, 3),
+                "substitutions": [{"template": old, "document": new}
+                                  for old, new in substitutions[:MAX_LISTED_SUBSTITUTIONS]],
+                "fields_filled": replaced,
+            }
+        return None, None
+
+    def stats(self, top=10):
+        """
+        Template match counters and the most matched templates
+
+        Returns:
+            dict: Counters, template count, match ratio and top templates
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["templates"] = len(self._templates)
+            top_templates = sorted(self._matches.items(), key=lambda item: item[1], reverse=True)[:top]
+        stats["match_ratio"] = round(stats["matches"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["top_templates"] = [{"template_id": t, "matches": n} for t, n in top_templates]
+        return stats
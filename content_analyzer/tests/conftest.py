@@ -0,0 +1,55 @@
+import io
+import os
+import sys
+
+import pytest
+
+# The app reads its settings at import: use the local stub backend and keep caches in memory
+os.environ.update(MODEL_BACKEND="stub", MODEL_STUB_LATENCY_MS="0", MODEL_STUB_JITTER_MS="0",
+                  ANALYSIS_CACHE_DIR="", METRICS_ENABLED="false")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ooxml import write_docx  # noqa: E402
+
+AGREEMENT_LINES = [
+    "SERVICE AGREEMENT",
+    "This Service Agreement is made on 25 July 2020 between Asha Verma (hereinafter referred to as the "
+    "\"Client\") and Orbit Systems Pvt. Ltd. (hereinafter referred to as the \"Service Provider\").",
+    "1. Services",
+    "The Service Provider shall deliver the software described in Schedule 1 by 15/09/2020.",
+    "2. Fees",
+    "The Client shall pay fees of Rs. 40,000 within thirty days of receiving a valid invoice.",
+    "3. Confidentiality",
+    "\"Confidential Information\" means any information disclosed by either party under this Agreement.",
+    "4. Payment Terms",
+    "Compensation for additional work is agreed in writing before the work starts.",
+    "5. Performance",
+    "The Client shall review each deliverable within ten days and report defects in writing.",
+    "6. Termination",
+    "Either party may end this Agreement by giving a notice period of one month in writing.",
+    "7. Governing Law",
+    "This Agreement is governed by the laws of India and the courts at Pune shall have jurisdiction.",
+    "8. Arbitration",
+    "Any dispute between the parties shall be referred to arbitration by a sole arbitrator.",
+    "9. Definitions",
+    "Definitions in this clause apply throughout this Agreement and its schedules.",
+    "IN WITNESS WHEREOF the parties have signed this Agreement through an authorized signatory.",
+]
+
+
+@pytest.fixture
+def agreement_lines():
+    return list(AGREEMENT_LINES)
+
+
+@pytest.fixture
+def make_docx():
+    """
+    Build a .docx upload in memory from paragraph texts
+    """
+    def make(lines):
+        output = io.BytesIO()
+        write_docx(lines, output)
+        output.seek(0)
+        return output
+    return make
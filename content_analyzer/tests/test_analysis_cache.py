@@ -0,0 +1,25 @@
+from analysis_cache import AnalysisCache
+
+
+def test_memory_tier_returns_copies():
+    cache = AnalysisCache(directory="")
+    value = {"analysis": {"risks": ["late payment"]}}
+    cache.set("key", value)
+    value["analysis"]["risks"].append("changed after set")
+    first = cache.get("key")
+    first["analysis"]["risks"].clear()
+    assert cache.get("key") == {"analysis": {"risks": ["late payment"]}}
+
+
+def test_disk_tier_is_pruned_in_batches(tmp_path, monkeypatch):
+    cache = AnalysisCache(max_entries=0, directory=str(tmp_path), max_disk_entries=20)
+    listings = []
+    disk_files = cache._disk_files
+    monkeypatch.setattr(cache, "_disk_files", lambda: listings.append(1) or disk_files())
+    for n in range(100):
+        cache.set(f"{n:064x}", {"n": n})
+    # Listed on the first write, then about once per 20 / 10 new entries, not on every write
+    assert len(listings) < 50
+    assert 20 <= len(disk_files()) <= 22
+    assert cache.get(f"{99:064x}") == {"n": 99}
+    assert cache.get(f"{0:064x}") is None
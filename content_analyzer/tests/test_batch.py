@@ -0,0 +1,52 @@
+import io
+import time
+import zipfile
+
+import pytest
+
+import batch
+from batch import BatchError, open_zip_members, run_concurrently
+
+
+def make_zip(count):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for n in range(count):
+            archive.writestr(f"docs/{n}.txt", f"Document {n}")
+        archive.writestr("__MACOSX/docs/._0.txt", "resource fork")
+    buffer.seek(0)
+    return buffer
+
+
+def test_zip_members_are_extracted(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    members = open_zip_members(make_zip(3), (".txt",), max_files=3)
+    try:
+        assert [name for name, _ in members] == ["docs/0.txt", "docs/1.txt", "docs/2.txt"]
+        assert members[2][1].read() == b"Document 2"
+    finally:
+        for _, target in members:
+            target.close()
+
+
+def test_zip_with_too_many_documents_is_rejected_before_extraction(monkeypatch):
+    monkeypatch.setattr(batch.tempfile, "NamedTemporaryFile", pytest.fail)
+    with pytest.raises(BatchError, match="Too many files"):
+        open_zip_members(make_zip(5), (".txt",), max_files=4)
+
+
+def test_closing_early_waits_for_running_items():
+    finished = []
+
+    def process(item):
+        time.sleep(0.1)
+        finished.append(item)
+        return item
+
+    results = run_concurrently(process, list(range(8)), workers=2)
+    next(results)
+    results.close()
+    count = len(finished)
+    time.sleep(0.2)
+    # Nothing was still running after close, and items that had not started were cancelled
+    assert len(finished) == count < 8
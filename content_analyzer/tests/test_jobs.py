@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import RUNNING, SqliteJobBackend, new_job
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SqliteJobBackend(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_claim_runs_each_job_once(backend):
+    submitted = [new_job(f"{n}.pdf", None) for n in range(3)]
+    for job in submitted:
+        backend.submit(job)
+    claimed = [backend.claim(timeout=0) for _ in range(4)]
+    assert [job["id"] for job in claimed[:3]] == [job["id"] for job in submitted]
+    assert all(job["status"] == RUNNING for job in claimed[:3])
+    assert claimed[3] is None
+
+
+def test_locked_database_raises_the_lock_error(backend, monkeypatch):
+    backend.submit(new_job("a.pdf", None))
+    connect = backend._connect
+    monkeypatch.setattr(backend, "_connect", lambda: sqlite3.connect(backend.path, timeout=0.05,
+                                                                     isolation_level=None))
+    holder = connect()
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            backend.claim(timeout=0)
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+    monkeypatch.setattr(backend, "_connect", connect)
+    assert backend.claim(timeout=0)["filename"] == "a.pdf"
+
+
+def test_idle_claims_take_no_write_lock_and_back_off(backend, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(jobs, "JOB_IDLE_POLL_MAX", 0.08)
+    statements = []
+    connect = backend._connect
+
+    def traced():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+    monkeypatch.setattr(backend, "_connect", traced)
+
+    assert backend.claim(timeout=0.5) is None
+    assert not any(s.startswith("BEGIN") for s in statements)
+    # 0.01, 0.02, 0.04, then 0.08 s apart: about 9 polls instead of 50
+    assert len(statements) < 15
+
+
+def test_submit_wakes_an_idle_claim(backend, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 5)
+    job = new_job("a.pdf", None)
+    timer = threading.Timer(0.1, backend.submit, args=(job,))
+    started = time.monotonic()
+    timer.start()
+    claimed = backend.claim(timeout=10)
+    assert claimed["id"] == job["id"]
+    assert time.monotonic() - started < 2
+
+
+def test_requeued_job_belongs_to_the_latest_attempt(backend, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.05)
+    backend.submit(new_job("a.pdf", None))
+    first = backend.claim(timeout=0)
+    time.sleep(0.1)
+    second = backend.claim(timeout=0)
+    assert second["id"] == first["id"] and second["attempt"] == first["attempt"] + 1
+
+    assert not backend.renew(first["id"], first["attempt"])
+    assert not backend.finish(first["id"], first["attempt"], jobs.DONE, result={})
+    assert backend.finish(second["id"], second["attempt"], jobs.DONE, result={"ok": True})
+    assert backend.get(first["id"])["result"] == {"ok": True}
+
+
+def test_renewed_lease_keeps_a_long_job_claimed(backend, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.1)
+    backend.submit(new_job("a.pdf", None))
+    job = backend.claim(timeout=0)
+    for _ in range(4):
+        time.sleep(0.05)
+        assert backend.renew(job["id"], job["attempt"])
+    assert backend.claim(timeout=0) is None
+
+
+def test_runner_keeps_the_upload_of_a_job_claimed_again(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.05)
+    upload = tmp_path / "a.pdf"
+    upload.write_bytes(b"%PDF")
+    backend.submit(new_job("a.pdf", str(upload)))
+    done = threading.Event()
+
+    def handler(job):
+        # Outlive the lease without renewing it, then let another worker take the job
+        time.sleep(0.1)
+        backend.claim(timeout=0)
+        done.set()
+        return {}
+    runner = jobs.JobRunner(handler, backend=backend, workers=1)
+    runner.start()
+    assert done.wait(5)
+    time.sleep(0.1)
+    assert upload.exists()
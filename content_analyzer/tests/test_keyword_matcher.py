@@ -0,0 +1,59 @@
+import re
+
+import pytest
+
+from keyword_matcher import KeywordMatcher
+
+WORDS = ["lease", "rent", "rental", "term", "terms", "notice period"]
+SUBSTRINGS = ["rent", "confidential", "lease"]
+TEXTS = [
+    "the rental agreement sets the rent and the lease terms.",
+    "rents are due; the tenant_rent field is internal",
+    "a notice period of two months; notice periods vary",
+    "nonconfidential information is excluded",
+    "term",
+    "",
+]
+
+
+def expected_entries(text):
+    # The semantics KeywordMatcher promises: \b...\b for words, `in` for substrings
+    found = {(k, True) for k in WORDS if re.search(r"\b" + re.escape(k) + r"\b", text)}
+    return found | {(k, False) for k in SUBSTRINGS if k in text}
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return KeywordMatcher(words=WORDS, substrings=SUBSTRINGS)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_found_matches_regex_and_substring_search(matcher, text):
+    assert matcher.found(text) == expected_entries(text)
+
+
+def test_hits_include_overlapping_and_prefix_keywords(matcher):
+    hits = list(matcher.iter_hits("rental"))
+    assert (0, ("rental", True)) in hits
+    assert (0, ("rent", False)) in hits
+    # "rent" inside "rental" is not a whole word
+    assert (0, ("rent", True)) not in hits
+    assert [pos for pos, _ in hits] == sorted(pos for pos, _ in hits)
+
+
+def test_whole_word_boundary_at_scan_end(matcher):
+    # Scanning text[0:4] of "terms" behaves like re.search(r"\bterm\b", "terms", 0, 4)
+    assert (0, ("term", True)) in list(matcher.iter_hits("terms", 0, 4))
+    assert ("term", True) not in matcher.found("terms")
+
+
+def test_found_in_spans_counts_only_keywords_inside_each_span(matcher):
+    text = "rent due. lease signed. notice period"
+    spans = [(0, 8), (10, 22), (24, len(text))]
+    results = matcher.found_in_spans(text, spans)
+    for (start, end), entries in zip(spans, results):
+        assert entries == expected_entries(text[start:end])
+
+
+def test_found_in_spans_without_spans(matcher):
+    assert matcher.found_in_spans("rent", []) == []
@@ -0,0 +1,32 @@
+import os
+
+from metrics import MetricsRegistry
+
+
+def worker_registry(directory):
+    registry = MetricsRegistry(prefix="", directory=str(directory))
+    return registry, registry.counter("documents_total", "Documents", ("outcome",)), \
+        registry.gauge("calls_in_flight", "Calls")
+
+
+def test_metrics_are_summed_across_worker_files(tmp_path):
+    exited, documents, in_flight = worker_registry(tmp_path)
+    documents.inc(outcome="analyzed")
+    documents.inc(outcome="analyzed")
+    in_flight.set(3)
+    exited.flush()
+    # Written by a worker process that has exited since
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "999999999.json")
+
+    current, documents, in_flight = worker_registry(tmp_path)
+    documents.inc(outcome="analyzed")
+    in_flight.set(1)
+    lines = current.render().splitlines()
+    assert 'documents_total{outcome="analyzed"} 3' in lines
+    assert "calls_in_flight 1" in lines
+
+
+def test_metrics_without_a_directory_are_per_process():
+    registry = MetricsRegistry(prefix="", directory="")
+    registry.counter("documents_total", "Documents", ("outcome",)).inc(outcome="analyzed")
+    assert 'documents_total{outcome="analyzed"} 1' in registry.render().splitlines()
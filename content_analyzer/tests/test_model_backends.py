@@ -0,0 +1,26 @@
+import json
+
+from model_backends import ModelResponse, RecordingModel
+
+
+class SafetyChunk:
+    """
+    Final streamed chunk without text parts: .text raises like the Vertex AI SDK's
+    """
+
+    @property
+    def text(self):
+        raise ValueError("Response has no text parts")
+
+
+class StreamingModel:
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        return iter([ModelResponse('{"summary": '), ModelResponse('"ok"}'), SafetyChunk()])
+
+
+def test_recorded_stream_skips_chunks_without_text(tmp_path):
+    path = tmp_path / "responses.jsonl"
+    model = RecordingModel("gemini", StreamingModel(), path=str(path))
+    chunks = list(model.generate_content("Analyze", stream=True))
+    assert len(chunks) == 3
+    assert json.loads(path.read_text())["text"] == '{"summary": "ok"}'
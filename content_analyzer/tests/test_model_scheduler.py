@@ -0,0 +1,59 @@
+from enum import Enum
+from http import HTTPStatus
+
+import pytest
+
+from model_backends import ModelBackendError, ModelRateLimitError
+from model_scheduler import is_rate_limit_error
+
+
+class StatusCode(Enum):
+    # Shaped like grpc.StatusCode
+    RESOURCE_EXHAUSTED = (8, "resource exhausted")
+    INVALID_ARGUMENT = (3, "invalid argument")
+
+
+class APIError(Exception):
+    def __init__(self, message, code=None, grpc_status_code=None):
+        super().__init__(message)
+        self.code = code
+        self.grpc_status_code = grpc_status_code
+
+
+class RpcError(Exception):
+    def __init__(self, status):
+        super().__init__("rpc failed")
+        self._status = status
+
+    def code(self):
+        return self._status
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error", [
+    ModelRateLimitError("Simulated quota"),
+    APIError("Too many", code=429),
+    APIError("Too many", code=HTTPStatus.TOO_MANY_REQUESTS),
+    APIError("Exhausted", grpc_status_code=StatusCode.RESOURCE_EXHAUSTED),
+    RpcError(StatusCode.RESOURCE_EXHAUSTED),
+    ResourceExhausted("Quota exceeded"),
+    Exception("RESOURCE_EXHAUSTED: requests per minute exceeded"),
+    Exception("429 Too Many Requests"),
+])
+def test_rate_limit_errors(error):
+    assert is_rate_limit_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    ModelBackendError("Simulated model failure"),
+    APIError("Quota project not set for this API", code=400),
+    APIError("Invalid argument", grpc_status_code=StatusCode.INVALID_ARGUMENT),
+    RpcError(StatusCode.INVALID_ARGUMENT),
+    Exception("Request 4290017 failed: document too long"),
+    Exception("Daily quota report could not be generated"),
+])
+def test_other_errors(error):
+    assert not is_rate_limit_error(error)
@@ -0,0 +1,55 @@
+import io
+import zipfile
+
+import pytest
+
+from ooxml import iter_docx_text, write_docx
+
+
+def roundtrip(lines):
+    output = io.BytesIO()
+    write_docx(lines, output)
+    output.seek(0)
+    return list(iter_docx_text(output))
+
+
+def test_roundtrip_keeps_paragraphs_in_order():
+    lines = [f"Clause {n}: the Tenant shall pay rent." for n in range(1000)]
+    assert roundtrip(lines) == lines
+
+
+def test_roundtrip_escapes_markup_and_keeps_tabs():
+    lines = ["Fees & charges < 5% > nil", "Name:\tAsha Verma", "\"Quoted\" and 'single'"]
+    assert roundtrip(lines) == lines
+
+
+def test_empty_lines_are_skipped_and_invalid_characters_dropped():
+    assert roundtrip(["first", "", "bell\x07 char", "last"]) == ["first", "bell char", "last"]
+
+
+def test_written_package_opens_with_python_docx():
+    docx = pytest.importorskip("docx")
+    output = io.BytesIO()
+    write_docx(["Title", "Body\twith tab"], output)
+    output.seek(0)
+    assert zipfile.ZipFile(output).testzip() is None
+    document = docx.Document(output)
+    assert [p.text for p in document.paragraphs] == ["Title", "Body\twith tab"]
+
+
+def test_reads_tables_headers_and_footers():
+    docx = pytest.importorskip("docx")
+    document = docx.Document()
+    document.sections[0].header.paragraphs[0].text = "CONFIDENTIAL"
+    document.sections[0].footer.paragraphs[0].text = "Page footer"
+    document.add_paragraph("Before the table")
+    table = document.add_table(rows=2, cols=2)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"r{r}c{c}"
+    document.add_paragraph("After the table")
+    output = io.BytesIO()
+    document.save(output)
+    output.seek(0)
+    assert list(iter_docx_text(output)) == ["CONFIDENTIAL", "Before the table", "r0c0 | r0c1", "r1c0 | r1c1",
+                                            "After the table", "Page footer"]
@@ -0,0 +1,21 @@
+from passage_index import PassageIndex, split_passages
+
+
+def test_text_without_punctuation_is_split_by_word_count():
+    # OCR or table output: one long run of words with no sentence breaks
+    text = " ".join(f"cell{n}" for n in range(1000))
+    passages = split_passages(text, target_words=80)
+    assert max(len(p.split()) for p in passages) <= 80
+    assert " ".join(passages) == text
+
+
+def test_sentences_are_packed_up_to_the_target(agreement_lines):
+    passages = split_passages("\n".join(agreement_lines), target_words=40)
+    assert len(passages) > 1
+    assert all(len(p.split()) <= 40 for p in passages)
+
+
+def test_context_stays_within_max_chars():
+    index = PassageIndex(["rent " * 500, "deposit clause"])
+    context = index.context("rent", max_chars=300)
+    assert sum(len(p) for p in context) <= 300 and context
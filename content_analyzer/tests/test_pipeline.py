@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import app
+from analysis_cache import AnalysisCache
+from model_backends import ModelResponse, StubModel
+from model_clients import ModelRegistry
+from revisions import RevisionIndex
+from templates import TemplateIndex
+
+ANALYSIS_FIELDS = {"summary", "key_terms", "main_clauses", "critical_dates", "parties", "jurisdiction",
+                   "obligations", "risks", "recommendations", "missing_clauses", "compliance_issues", "next_steps"}
+
+
+class UnparseableModel:
+    """
+    Answers every prompt with text that is not JSON
+    """
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        return ModelResponse("I cannot analyze this document.")
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """
+    Fresh model registry and caches for each test, with an instant stub model
+    """
+    registry = ModelRegistry(factory=lambda name, **options: StubModel(name, latency_ms=0, jitter_ms=0,
+                                                                        failure_rate=0, quota_rpm=0))
+    monkeypatch.setattr(app, "model_registry", registry)
+    monkeypatch.setattr(app, "analysis_cache", AnalysisCache(directory=""))
+    monkeypatch.setattr(app, "chunk_analysis_cache", AnalysisCache(directory=""))
+    monkeypatch.setattr(app, "passage_index_cache", AnalysisCache(directory=""))
+    monkeypatch.setattr(app, "template_index", TemplateIndex())
+    monkeypatch.setattr(app, "revision_index", RevisionIndex())
+    return registry
+
+
+def test_pipeline_analyzes_and_caches(registry, make_docx, agreement_lines):
+    result, cache = app.run_pipeline(make_docx(agreement_lines), "agreement.docx")
+    assert cache == "miss"
+    assert result["accepted"]
+    assert result["document_type"] == "service agreement"
+    assert "Asha Verma" in result["extracted_text"]
+    analysis = result["analysis"]
+    assert ANALYSIS_FIELDS <= set(analysis)
+    assert "error" not in analysis and not analysis.get("fallback")
+    # Rule-based fields are filled in before the model is asked
+    assert any(d["date"] == "2020-09-15" for d in analysis["critical_dates"])
+
+    again, cache = app.run_pipeline(make_docx(agreement_lines), "agreement.docx")
+    assert cache == "hit"
+    assert again["analysis"] == analysis
+    assert sum(client["requests"] for client in registry.stats()["clients"]) == 1
+
+
+def test_pipeline_rejects_non_legal_documents(registry, make_docx):
+    result, _ = app.run_pipeline(make_docx(["Shopping list", "Milk, eggs and bread."]), "list.docx")
+    assert not result["accepted"]
+    assert registry.stats()["clients"] == []
+
+
+def test_map_reduce_merges_chunk_analyses(registry, monkeypatch, make_docx, agreement_lines):
+    monkeypatch.setattr(app, "ANALYSIS_MODE", "mapreduce")
+    # Longer than one chunk of MAP_CHUNK_WORDS words
+    lines = list(agreement_lines)
+    for n in range(10, 40):
+        lines += [f"{n}. Schedule {n}", f"The Service Provider shall maintain module {n} of the software. " * 8]
+    result, _ = app.run_pipeline(make_docx(lines), "long.docx")
+    analysis = result["analysis"]
+    assert ANALYSIS_FIELDS <= set(analysis)
+    assert analysis["summary"].startswith("Stub overview")
+    assert sum(client["requests"] for client in registry.stats()["clients"]) > 2
+
+
+def test_unparseable_replies_fall_back_and_are_not_cached(registry, make_docx, agreement_lines):
+    registry.factory = lambda name, **options: UnparseableModel()
+    result, _ = app.run_pipeline(make_docx(agreement_lines), "agreement.docx")
+    assert result["analysis"]["fallback"] is True
+    assert app.analysis_cache.stats()["stores"] == 0
+    assert app.template_index.stats()["templates"] == 0
+
+    _, cache = app.run_pipeline(make_docx(agreement_lines), "agreement.docx")
+    assert cache == "miss"
+
+
+def test_analysis_and_chat_routes(registry, make_docx, agreement_lines):
+    client = app.app.test_client()
+    response = client.post("/enhanced_analysis", data={"file": (make_docx(agreement_lines), "agreement.docx")})
+    assert response.status_code == 200
+    assert "Server-Timing" not in response.headers
+    document_id = response.get_json()["document_id"]
+
+    response = client.post("/enhanced_analysis?timing=true",
+                           data={"file": (make_docx(agreement_lines), "agreement.docx")})
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+    response = client.post("/chat", json={"document_id": document_id, "question": "When are fees due?"})
+    assert response.status_code == 200
+    assert response.get_json()["answer"].startswith("Stub answer")
+
+    response = client.post("/chat", json={"document_id": "0" * 64, "question": "When are fees due?"})
+    assert response.status_code == 404
+
+
+def test_pdf_export_of_an_analysis(registry):
+    analysis = {"summary": "A service agreement.", "key_terms": [{"term": "Fees", "definition": "Rs. 40,000"}]}
+    response = app.app.test_client().post("/export/pdf", data={"text": "Body", "analysis": json.dumps(analysis)})
+    assert response.status_code == 200
+    assert response.data.startswith(b"%PDF")
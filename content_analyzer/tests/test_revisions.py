@@ -0,0 +1,101 @@
+import pytest
+
+import app
+from analysis_cache import AnalysisCache
+from model_backends import StubModel
+from model_clients import ModelRegistry
+from revisions import RevisionIndex, diff_clauses
+from templates import TemplateIndex
+
+BOILERPLATE = [
+    "7. Governing Law",
+    "This Agreement is governed by the laws of India and the courts at Pune shall have jurisdiction.",
+    "8. Arbitration",
+    "Any dispute between the parties shall be referred to arbitration by a sole arbitrator.",
+    "9. Notices",
+    "Notices under this Agreement shall be in writing and delivered to the addresses given above.",
+    "10. Force Majeure",
+    "Neither party is liable for delay caused by events beyond its reasonable control, including fire, "
+    "flood, epidemic, strike or an order of any government authority, for as long as the event lasts.",
+    "11. Entire Agreement",
+    "This Agreement records the entire understanding of the parties and replaces all earlier drafts, "
+    "letters and discussions on its subject matter.",
+    "12. Amendment",
+    "No amendment is effective unless made in writing and signed by an authorized signatory of each party.",
+    "13. Severability",
+    "If any provision is held invalid, the remaining provisions continue in full force and effect.",
+]
+
+
+def test_revision_is_found_and_diffed(agreement_lines):
+    index = RevisionIndex()
+    original = RevisionIndex.record("v1", "\n".join(agreement_lines), "service agreement")
+    index.add(original)
+    revised_lines = [line.replace("Rs. 40,000", "Rs. 45,000") for line in agreement_lines]
+    revised = RevisionIndex.record("v2", "\n".join(revised_lines), "service agreement")
+
+    previous, similarity = index.find_previous(revised)
+    assert previous["document_id"] == "v1"
+    assert similarity >= index.min_similarity
+    assert diff_clauses(previous, revised)["clauses"]["changed"] == 1
+
+
+def test_unrelated_agreement_with_shared_boilerplate_is_not_a_revision(agreement_lines):
+    index = RevisionIndex()
+    # Mostly shared clauses: about 0.55 estimated similarity
+    index.add(RevisionIndex.record("service", "\n".join(agreement_lines[:6] + BOILERPLATE), "service agreement"))
+    other = [
+        "MAINTENANCE AGREEMENT",
+        "This Maintenance Agreement is made on 3 March 2023 between Kiran Rao and Delta Facilities LLP.",
+        "1. Scope",
+        "Delta Facilities LLP shall inspect the lifts and generators at the premises every quarter.",
+        "2. Charges",
+        "Kiran Rao shall pay an annual charge of Rs. 1,20,000 in four equal instalments.",
+    ] + BOILERPLATE
+    previous, similarity = index.find_previous(RevisionIndex.record("maintenance", "\n".join(other),
+                                                                    "service agreement"))
+    assert previous is None and similarity == 0.0
+
+
+def test_workers_sharing_a_directory_find_each_others_revisions(tmp_path, agreement_lines):
+    first, second = (RevisionIndex(directory=str(tmp_path)) for _ in range(2))
+    first.add(RevisionIndex.record("v1", "\n".join(agreement_lines), "service agreement"))
+    revised_lines = [line.replace("Rs. 40,000", "Rs. 45,000") for line in agreement_lines]
+    previous, _ = second.find_previous(RevisionIndex.record("v2", "\n".join(revised_lines), "service agreement"))
+    assert previous["document_id"] == "v1"
+
+
+def test_shared_directory_is_pruned_to_the_newest_records(tmp_path, agreement_lines):
+    index = RevisionIndex(max_entries=10, directory=str(tmp_path))
+    for n in range(30):
+        index.add(RevisionIndex.record(f"doc{n}", f"Draft {n}\n" + "\n".join(agreement_lines), "service agreement"))
+    names = {path.stem for path in tmp_path.glob("*.json")}
+    assert len(names) <= 11 and "doc29" in names and "doc0" not in names
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    registry = ModelRegistry(factory=lambda name, **options: StubModel(name, latency_ms=0, jitter_ms=0,
+                                                                        failure_rate=0, quota_rpm=0))
+    monkeypatch.setattr(app, "model_registry", registry)
+    for name in ("analysis_cache", "chunk_analysis_cache", "passage_index_cache"):
+        monkeypatch.setattr(app, name, AnalysisCache(directory=""))
+    monkeypatch.setattr(app, "template_index", TemplateIndex())
+    monkeypatch.setattr(app, "revision_index", RevisionIndex())
+    monkeypatch.setattr(app, "TEMPLATE_MATCHING", False)
+    monkeypatch.setattr(app, "REVISION_CHUNK_WORDS", 60)
+    return registry
+
+
+def test_short_revisions_are_analyzed_in_chunks(pipeline, make_docx, agreement_lines):
+    lines = agreement_lines + BOILERPLATE
+    app.run_pipeline(make_docx(lines), "v1.docx")
+    v2 = [line.replace("Rs. 40,000", "Rs. 45,000") for line in lines]
+    result, _ = app.run_pipeline(make_docx(v2), "v2.docx")
+    # The first version had a single prompt, so the second is chunked from scratch
+    assert result["revision"]["chunks"] > 1 and result["revision"]["reused_chunks"] == 0
+
+    v3 = [line.replace("Rs. 45,000", "Rs. 47,500") for line in v2]
+    result, _ = app.run_pipeline(make_docx(v3), "v3.docx")
+    revision = result["revision"]
+    assert revision["previous_document_id"] and 0 < revision["chunks"] - revision["reused_chunks"] < revision["chunks"]
@@ -0,0 +1,79 @@
+import pytest
+
+from rule_extractor import amounts_as_terms, extract_facts, normalize_date
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("15/09/2020", "2020-09-15"),
+    ("1.2.2021", "2021-02-01"),
+    ("25 July 2020", "2020-07-25"),
+    ("1st day of March, 2022", "2022-03-01"),
+    ("July 25, 2020", "2020-07-25"),
+    ("Sept 3 2021", "2021-09-03"),
+    ("2024-02-29", "2024-02-29"),
+])
+def test_normalize_date(value, expected):
+    assert normalize_date(value) == expected
+
+
+@pytest.mark.parametrize("value", ["00/00/0000", "31/02/2024", "2024-13-45", "45 March 2024", "not a date"])
+def test_invalid_dates_do_not_normalize(value):
+    assert normalize_date(value) is None
+
+
+def test_invalid_dates_are_not_critical_dates():
+    text = ("The lease starts on 2024-03-01. Rent is due by 00/00/0000 each month. "
+            "The deposit is refunded on 2024-13-45 or 31/02/2024.")
+    assert [d["date"] for d in extract_facts(text)["critical_dates"]] == ["2024-03-01"]
+
+
+def test_extract_facts(agreement_lines):
+    facts = extract_facts("\n".join(agreement_lines))
+
+    assert {p["role"] for p in facts["parties"]} == {"Client", "Service Provider"}
+    client = next(p for p in facts["parties"] if p["role"] == "Client")
+    assert client["name"] == "Asha Verma"
+
+    dates = {d["date"]: d["event"] for d in facts["critical_dates"]}
+    assert set(dates) == {"2020-07-25", "2020-09-15"}
+    assert "deliver the software" in dates["2020-09-15"]
+
+    assert [a["amount"] for a in facts["amounts"]] == ["Rs. 40,000"]
+    assert "Confidential Information" in {t["term"] for t in facts["key_terms"]}
+    assert facts["jurisdiction"] == "Governed by the laws of India; courts at Pune have jurisdiction"
+    obligation = next(o for o in facts["obligations"] if o["party"] == "Service Provider")
+    assert obligation["responsibility"].startswith("shall deliver the software")
+
+
+def test_obligations_of_non_parties_are_dropped():
+    text = ("This lease is between Ravi Kumar (hereinafter referred to as the \"Landlord\") and "
+            "Meena Shah (hereinafter referred to as the \"Tenant\"). The Tenant shall pay rent monthly. "
+            "The Notice shall be in writing. The Contractor shall paint the walls.")
+    parties = {o["party"] for o in extract_facts(text)["obligations"]}
+    assert any("Tenant" in party for party in parties)
+    assert not any("Notice" in party or "Contractor" in party for party in parties)
+
+
+@pytest.mark.parametrize("text, amount", [
+    ("A fee of Rs. 15000/- is payable.", "Rs. 15000/-"),
+    ("A fee of $5000 is payable.", "$5000"),
+    ("A fee of Rs.25000 is payable.", "Rs.25000"),
+    ("A fee of INR 250000.75 is payable.", "INR 250000.75"),
+    ("A fee of ₹ 1200 is payable.", "₹ 1200"),
+    ("A fee of Rs. 1,00,000 is payable.", "Rs. 1,00,000"),
+    ("A fee of $1,234,567.50 is payable.", "$1,234,567.50"),
+    ("A fee of Rs. 2 lakhs is payable.", "Rs. 2 lakhs"),
+])
+def test_amounts_are_read_whole(text, amount):
+    assert [a["amount"] for a in extract_facts(text)["amounts"]] == [amount]
+
+
+def test_amounts_as_terms():
+    facts = extract_facts("The deposit is Rs. 1,00,000 payable on signing.")
+    assert amounts_as_terms(facts) == [{"term": a["amount"], "definition": a["context"]} for a in facts["amounts"]]
+
+
+def test_no_facts_in_plain_text():
+    facts = extract_facts("Nothing to see here.")
+    assert facts == {"critical_dates": [], "parties": [], "key_terms": [], "obligations": [], "amounts": [],
+                     "jurisdiction": None}
@@ -0,0 +1,137 @@
+from revisions import RevisionIndex
+from templates import TemplateIndex, field_substitutions, fill_analysis
+
+TEMPLATE = ("RENTAL AGREEMENT\n"
+            "This agreement is made on 01/04/2023 between Ravi Kumar and Meena Shah.\n"
+            "The monthly rent is Rs. 40,000 payable on the 5th day of each month.\n"
+            "The tenant shall keep the premises in good condition and pay all utility bills on time.\n"
+            "Either party may terminate this agreement with two months notice in writing.\n"
+            "The landlord shall carry out structural repairs within fifteen days of being informed.\n"
+            "The tenant shall not sublet the premises or any part of it without written consent.\n"
+            "Disputes shall be settled by arbitration under the Arbitration and Conciliation Act, 1996.\n"
+            "This agreement is governed by the laws of India and the courts at Pune have jurisdiction.\n")
+
+
+def test_substitutions_pair_changed_fields_in_document_order():
+    text = TEMPLATE.replace("Ravi Kumar", "Anil Rao").replace("40,000", "55,500")
+    assert field_substitutions(TEMPLATE, text) == [("Ravi Kumar", "Anil Rao"), ("40,000", "55,500")]
+
+
+def test_substitutions_widen_to_whole_values():
+    # Only "40" differs, but the field is the whole amount
+    text = TEMPLATE.replace("40,000", "50,000")
+    assert field_substitutions(TEMPLATE, text) == [("40,000", "50,000")]
+
+
+def test_identical_texts_have_no_substitutions():
+    assert field_substitutions(TEMPLATE, TEMPLATE) == []
+
+
+def test_added_text_is_not_a_filled_template():
+    text = TEMPLATE.replace("on time.", "on time. The landlord shall repaint the flat every year.")
+    assert field_substitutions(TEMPLATE, text) is None
+
+
+def test_rewritten_text_is_not_a_filled_template():
+    text = TEMPLATE.replace("Either party may terminate this agreement with two months notice in writing.",
+                            "This lease cannot be ended early by the tenant under any circumstances.")
+    assert field_substitutions(TEMPLATE, text) is None
+
+
+def test_fill_analysis_replaces_values_throughout():
+    analysis = {
+        "summary": "Ravi Kumar rents a flat for Rs. 40,000 a month.",
+        "parties": [{"name": "Ravi Kumar", "role": "Landlord"}],
+        "key_terms": [{"term": "Rent", "definition": "Rs. 40,000 per month"}],
+        "risk_score": 3,
+    }
+    text = TEMPLATE.replace("Ravi Kumar", "Anil Rao").replace("40,000", "55,500")
+    result = fill_analysis(analysis, [("Ravi Kumar", "Anil Rao"), ("40,000", "55,500")], text)
+    assert result is not None
+    filled_analysis, replaced = result
+    assert replaced == 4
+    assert filled_analysis["summary"] == "Anil Rao rents a flat for Rs. 55,500 a month."
+    assert filled_analysis["parties"] == [{"name": "Anil Rao", "role": "Landlord"}]
+    assert filled_analysis["risk_score"] == 3
+    # The template's analysis is left untouched
+    assert analysis["parties"][0]["name"] == "Ravi Kumar"
+
+
+def test_fill_analysis_matches_whole_values_only():
+    analysis = {"summary": "Rs. 140,000 deposit and Rs. 40,000 rent"}
+    filled_analysis, replaced = fill_analysis(analysis, [("40,000", "55,500")], "")
+    assert filled_analysis["summary"] == "Rs. 140,000 deposit and Rs. 55,500 rent"
+    assert replaced == 1
+
+
+def test_fill_analysis_rejects_ambiguous_substitutions():
+    # One template value replaced by two different values
+    assert fill_analysis({}, [("Ravi", "Anil"), ("Ravi", "Sunil")], "") is None
+    # A template value that still occurs in the new text
+    assert fill_analysis({}, [("Ravi", "Anil")], "Anil and Ravi") is None
+
+
+def test_fill_analysis_without_substitutions_copies():
+    analysis = {"parties": [{"name": "Ravi Kumar"}]}
+    copied, replaced = fill_analysis(analysis, [], TEMPLATE)
+    assert copied == analysis and copied is not analysis and replaced == 0
+
+
+DATED = ("SERVICE AGREEMENT\n"
+         "This agreement is made on 25 July 2020 between Asha Verma and Orbit Systems.\n"
+         "The Service Provider shall deliver the software by 15/09/2020 at the Client's office.\n"
+         "The Client shall pay fees of Rs. 40,000 within thirty days of receiving a valid invoice.\n"
+         "Either party may end this agreement with one month notice in writing to the other party.\n"
+         "Disputes shall be settled by arbitration under the Arbitration and Conciliation Act, 1996.\n"
+         "This agreement is governed by the laws of India and the courts at Pune have jurisdiction.\n")
+DATED_ANALYSIS = {
+    "critical_dates": [{"date": "2020-07-25", "event": "Agreement made"},
+                       {"date": "2020-09-15", "event": "Software delivered by 15/09/2020"}],
+    "key_terms": [{"term": "Fees", "definition": "Rs. 40000, due within thirty days"}],
+    "parties": [{"name": "Asha Verma", "role": "Client"}],
+}
+
+
+def fill_dated(text, analysis=DATED_ANALYSIS):
+    substitutions = field_substitutions(DATED, text)
+    assert substitutions is not None
+    return fill_analysis(analysis, substitutions, text, DATED)
+
+
+def test_fill_analysis_rewrites_iso_dates():
+    filled_analysis, _ = fill_dated(DATED.replace("15/09/2020", "20/10/2021"))
+    assert filled_analysis["critical_dates"][1] == {"date": "2021-10-20", "event": "Software delivered by 20/10/2021"}
+    assert filled_analysis["critical_dates"][0]["date"] == "2020-07-25"
+
+
+def test_fill_analysis_rewrites_dates_changed_in_part():
+    # Only the day token differs between the texts
+    filled_analysis, _ = fill_dated(DATED.replace("25 July 2020", "26 July 2020"))
+    assert filled_analysis["critical_dates"][0]["date"] == "2020-07-26"
+
+
+def test_fill_analysis_rewrites_amounts_without_separators():
+    filled_analysis, _ = fill_dated(DATED.replace("40,000", "55,500"))
+    assert filled_analysis["key_terms"][0]["definition"] == "Rs. 55,500, due within thirty days"
+
+
+def test_fill_analysis_refuses_values_left_in_another_form():
+    text = DATED.replace("Asha Verma", "Kiran Rao")
+    # The model wrote the name in capitals, or only the surname
+    assert fill_dated(text, {"parties": [{"name": "ASHA VERMA", "role": "Client"}]}) is None
+    assert fill_dated(text, {"summary": "Ms. Verma hires Orbit Systems."}) is None
+
+
+def test_fill_analysis_rewrites_dates_in_other_formats():
+    analysis = {"critical_dates": [{"date": "September 15, 2020", "event": "Delivery"}]}
+    assert fill_dated(DATED.replace("15/09/2020", "20/10/2021"), analysis) == \
+        ({"critical_dates": [{"date": "20/10/2021", "event": "Delivery"}]}, 1)
+
+
+def test_template_match_reuses_analysis_with_new_iso_dates():
+    index = TemplateIndex()
+    index.add(RevisionIndex.record("template", DATED, "service agreement"), DATED, DATED_ANALYSIS)
+    text = DATED.replace("15/09/2020", "20/10/2021")
+    analysis, details = index.match(RevisionIndex.record("filled", text, "service agreement"), text)
+    assert details["substitutions"] == [{"template": "15/09/2020", "document": "20/10/2021"}]
+    assert [d["date"] for d in analysis["critical_dates"]] == ["2020-07-25", "2021-10-20"]
@@ -0,0 +1,47 @@
+import os
+import re
+import tempfile
+from io import BytesIO
+
+from flask import Request
+
+# Upload handling configuration
+# Uploads larger than this are written straight to a named temp file
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+# Requests larger than this are rejected with 413 while they stream in
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "50"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Endpoints whose requests may exceed MAX_UPLOAD_BYTES, with their own limit (e.g. zip batches)
+ENDPOINT_UPLOAD_LIMITS = {}
+
+
+class SpoolingRequest(Request):
+    """
+    Request that spools file uploads to disk instead of memory
+
+    Werkzeug writes each multipart file part into the stream returned here
+    as it parses the body, so large uploads never sit in memory. Small
+    uploads stay in a BytesIO. Disk-backed streams are named temp files, so
+    extractors and pool workers can open them by path; they are removed
+    when the request closes its files.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_THRESHOLD:
+            return BytesIO()
+        suffix = os.path.splitext(filename or "")[1].lower()
+        if not re.fullmatch(r"\.[a-z0-9]{1,8}", suffix):
+            suffix = ""
+        return tempfile.NamedTemporaryFile("w+b", suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+
+    @property
+    def max_content_length(self):
+        """
+        Upload limit of this request's endpoint (ENDPOINT_UPLOAD_LIMITS), else the app's
+
+        Read-only on every supported Flask version (2.3 has no setter), so
+        endpoints register their limit instead of assigning it per request.
+        """
+        limit = ENDPOINT_UPLOAD_LIMITS.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length